@@ -0,0 +1,437 @@
+"""
+Agent Activity Tracking
+=======================
+Turns the stream of Magentic workflow events into the structured activity log
+shown in the UI. A tracker is fed one event at a time and returns the entries
+each event produced, so the same log can be returned at the end of a run or
+streamed to the client as it is built.
+
+A long run produces hundreds of entries and many runs are in flight at once,
+so the log is kept small:
+
+- entries are slotted ``ActivityEntry`` records whose type and icon are shared
+  enum members, and whose fixed messages are shared strings
+- a repeat of one of the latest few entries, such as "processing: EventType"
+  for every token delta, is rolled up into that entry's count
+- at most ``max_entries`` entries are kept; the rest are counted, and the end
+  of run entries are always added
+- entries are serialized straight to JSON (``iter_activity_json``) rather
+  than through dicts and a response model
+"""
+
+import re
+import sys
+from enum import Enum
+from json.encoder import encode_basestring
+
+from agent_framework import WorkflowOutputEvent
+
+from event_classifier import classify, classify_message, coder_operation_type, research_analysis_type
+from event_tracing import event_source
+
+# Entries kept per run before further ones are only counted
+MAX_ENTRIES = 500
+
+# Latest entries a repeat can be folded into; an event may add a few alternating ones
+ROLLUP_WINDOW = 4
+
+
+class ActivityType(str, Enum):
+    RESEARCHER = "researcher"
+    CODER = "coder"
+    REVIEWER = "reviewer"
+    MANAGER = "manager"
+    SYSTEM = "system"
+    SUCCESS = "success"
+
+
+class Icon(str, Enum):
+    SEARCH = "🔍"
+    BOOKS = "📚"
+    LAPTOP = "💻"
+    ABACUS = "🧮"
+    MAGNIFIER = "🔎"
+    TARGET = "🎯"
+    WRENCH = "🔧"
+    ZAP = "⚡"
+    CHECK = "✅"
+    CHART = "📊"
+    SCISSORS = "✂️"
+
+
+class ActivityEntry:
+    """One activity log line; ``count`` is how many identical lines it stands for"""
+
+    __slots__ = ("type", "icon", "message", "count")
+
+    def __init__(self, type, icon, message, count=1):
+        self.type = type
+        self.icon = icon
+        self.message = message
+        self.count = count
+
+    def to_dict(self):
+        entry = {"type": self.type.value, "message": self.message, "icon": self.icon.value}
+        if self.count > 1:
+            entry["message"] = f"{self.message} (x{self.count})"
+            entry["count"] = self.count
+        return entry
+
+    def to_json(self):
+        """``to_dict`` as JSON, formatted directly; only the message needs escaping"""
+        message = self.message if self.count == 1 else f"{self.message} (x{self.count})"
+        count = "" if self.count == 1 else f', "count": {self.count}'
+        return f'{{"type": "{self.type.value}", "message": {encode_basestring(message)}, "icon": "{self.icon.value}"{count}}}'
+
+
+def iter_activity_json(entries, batch=64):
+    """A JSON array of ``entries``, in chunks of ``batch`` encoded entries"""
+    yield "["
+    for start in range(0, len(entries), batch):
+        chunk = ", ".join([entry.to_json() for entry in entries[start:start + batch]])
+        yield chunk if start == 0 else ", " + chunk
+    yield "]"
+
+
+def processing_message(prefix, event_type):
+    """Shared "processing: EventType" message, so rolled-up and repeated entries hold one string"""
+    return sys.intern(f"{prefix} processing: {event_type}")
+
+
+RESEARCHER_ACTIVATED = "🔍 Researcher Agent activated - Starting comprehensive information gathering"
+CODER_ACTIVATED = "💻 Coder Agent activated - Initializing computational analysis tools"
+REVIEWER_ACTIVATED = "🔍 Reviewer Agent activated - Critically evaluating analysis quality"
+MANAGER_ACTIVATED = "🎯 Manager Agent coordinating - Analyzing task and planning workflow"
+REVIEWER_FEEDBACK = "🔎 Reviewer providing critical feedback:\n   Identified quality checks and improvement areas"
+CODE_EXECUTION = "🔧 Coder executing code interpreter for calculations"
+RESULT_GENERATED = "✨ Results generated successfully with multi-agent collaboration"
+
+
+class ActivityTracker:
+    """Builds the activity log and final result for a single workflow run"""
+
+    def __init__(self, tracer=None, max_entries=MAX_ENTRIES, rollup_window=ROLLUP_WINDOW):
+        self.tracer = tracer
+        self.max_entries = max_entries
+        self.rollup_window = rollup_window
+        self.result_text = ""
+        self.activity_log = []
+        self.event_count = 0
+        # Entries over max_entries, and repeats folded into an earlier entry
+        self.dropped = 0
+        self.rolled_up = 0
+        
+        # Track which agents have been active and how much each produced
+        self.agent_activities = set()
+        self.researcher_findings = 0
+        self.coder_steps = 0
+        self.researcher_topics = set()
+        self.coder_operations = set()
+        
+        # Hashes of the outputs already logged, for O(1) duplicate checks
+        self._researcher_seen = set()
+        self._coder_seen = set()
+        
+        # Entries ready to hand out, and the latest ones, which may still roll up repeats
+        self._ready = []
+        self._open = []
+
+    def _add(self, type, icon, message, keep=False):
+        """Append an entry, or fold it into an identical one among the last few.
+
+        ``keep`` entries are added even when the log is full.
+        """
+        for entry in self._open:
+            if entry.message is message and entry.type is type:
+                entry.count += 1
+                self.rolled_up += 1
+                return
+        if not keep and len(self.activity_log) >= self.max_entries:
+            self.dropped += 1
+            self._ready.extend(self._open)
+            self._open.clear()
+            return
+        entry = ActivityEntry(type, icon, message)
+        self.activity_log.append(entry)
+        self._open.append(entry)
+        if len(self._open) > self.rollup_window:
+            self._ready.append(self._open.pop(0))
+
+    def _take_ready(self, close=False):
+        if close:
+            self._ready.extend(self._open)
+            self._open.clear()
+        ready, self._ready = self._ready, []
+        return ready
+
+    def _add_result_activities(self, text):
+        """Extract what agents did by analyzing the final result text"""
+        if not text:
+            return
+        
+        # Look for calculations (Coder's work)
+        calculations = re.findall(r'\$[0-9,]+|×|÷|[0-9]+%|=\s*\$?[0-9,]+|ROI|CAGR|calculation|formula', text, re.IGNORECASE)
+        if calculations:
+            # Found calculation-related content
+            self._add(
+                ActivityType.CODER, Icon.ABACUS,
+                f"🧮 Coder performed calculations:\n   Found {len(set(calculations))} mathematical operations in analysis",
+                keep=True,
+            )
+            self.coder_steps += 1
+            self.coder_operations.add("Mathematical Analysis")
+        
+        # Look for research data (Researcher's work)
+        research_indicators = re.findall(r'average|market|industry|study|research|data|statistics|according to|typical|standard', text, re.IGNORECASE)
+        if research_indicators:
+            self._add(
+                ActivityType.RESEARCHER, Icon.BOOKS,
+                f"📚 Researcher gathered market intelligence:\n   Found {len(set(research_indicators))} research data points",
+                keep=True,
+            )
+            self.researcher_findings += 1
+            self.researcher_topics.add("market_research")
+
+    def process_event(self, event):
+        """Update the log for one workflow event and return the entries it completed.
+
+        The latest ``rollup_window`` entries are returned once newer ones push
+        them out, so they carry the count of any repeats rolled up into them.
+        """
+        self.event_count += 1
+        event_type = event.__class__.__name__
+        
+        # Get event source/agent info from the event's typed attributes
+        agent_name = event_source(event)
+        
+        # Extract full message content from events - check multiple possible attributes
+        message_content = None
+        full_message = None
+        
+        # Check various event data structures
+        if hasattr(event, 'data') and event.data:
+            messages = event.data if isinstance(event.data, list) else [event.data]
+            for msg in messages:
+                if hasattr(msg, 'text') and msg.text:
+                    full_message = msg.text
+                    message_content = msg.text[:300]
+                elif hasattr(msg, 'content') and msg.content:
+                    full_message = msg.content
+                    message_content = msg.content[:300]
+        
+        # Also check if event itself has content
+        if not message_content and hasattr(event, 'content'):
+            full_message = str(event.content)
+            message_content = str(event.content)[:300]
+        
+        # Check for messages in event directly
+        if not message_content and hasattr(event, 'message'):
+            full_message = str(event.message)
+            message_content = str(event.message)[:300]
+        
+        # Only traced requests pay for dumping the event
+        if self.tracer is not None:
+            self.tracer.trace(event, agent_name, message_content)
+        
+        # Classify the event source once
+        event_groups = classify(agent_name)
+        content_hash = hash(message_content) if message_content else None
+        
+        # Track Researcher Agent activities with detailed analysis
+        if "agent_researcher" in event_groups:
+            if "researcher" not in self.agent_activities:
+                self._add(ActivityType.RESEARCHER, Icon.SEARCH, RESEARCHER_ACTIVATED)
+                self.agent_activities.add("researcher")
+            
+            # ALWAYS log researcher activity, even without message content
+            if not message_content or content_hash in self._researcher_seen:
+                # Log the event type at minimum
+                if event_type not in ["WorkflowEvent", "WorkflowOutputEvent"]:
+                    self._add(ActivityType.RESEARCHER, Icon.SEARCH, processing_message("🔍 Researcher", event_type))
+            
+            # Track detailed researcher outputs
+            if message_content and content_hash not in self._researcher_seen:
+                self.researcher_findings += 1
+                self._researcher_seen.add(content_hash)
+                
+                # Analyze what the researcher found
+                analysis_type, topic = research_analysis_type(classify_message(message_content))
+                if topic:
+                    self.researcher_topics.add(topic)
+                
+                # Extract key findings
+                key_points = []
+                if full_message:
+                    # Look for bullet points or numbered lists
+                    lines = full_message.split('\n')
+                    for line in lines[:5]:  # First 5 lines
+                        line = line.strip()
+                        if line and (line.startswith('-') or line.startswith('•') or line.startswith('*') or line[0].isdigit()):
+                            key_points.append(line.lstrip('-•* 0123456789.)'))
+                
+                # Create detailed log entry
+                detail_msg = f"📚 Researcher completed {analysis_type}:\n"
+                if key_points:
+                    detail_msg += f"   • {key_points[0][:100]}"
+                    if len(key_points) > 1:
+                        detail_msg += f"\n   • {key_points[1][:100]}"
+                else:
+                    detail_msg += f"   {message_content[:200]}"
+                
+                self._add(ActivityType.RESEARCHER, Icon.BOOKS, detail_msg)
+        
+        # Track Coder Agent activities with detailed code analysis
+        if "agent_coder" in event_groups:
+            if "coder" not in self.agent_activities:
+                self._add(ActivityType.CODER, Icon.LAPTOP, CODER_ACTIVATED)
+                self.agent_activities.add("coder")
+            
+            # ALWAYS log coder activity, even without message content
+            if not message_content or content_hash in self._coder_seen:
+                # Log the event type at minimum
+                if event_type not in ["WorkflowEvent", "WorkflowOutputEvent"]:
+                    self._add(ActivityType.CODER, Icon.LAPTOP, processing_message("💻 Coder", event_type))
+            
+            # Track detailed coder outputs
+            if message_content and content_hash not in self._coder_seen:
+                self.coder_steps += 1
+                self._coder_seen.add(content_hash)
+                
+                # Analyze what type of coding/calculation was performed
+                operation_type, is_calculation = coder_operation_type(classify_message(message_content))
+                detail_info = ""
+                
+                if is_calculation:
+                    # Try to extract the calculation
+                    if '=' in message_content:
+                        parts = message_content.split('=')
+                        if len(parts) >= 2:
+                            detail_info = f"Formula: {parts[0].strip()[:80]} = {parts[1].strip()[:80]}"
+                elif operation_type == "Code Execution":
+                    detail_info = "Running Python code interpreter"
+                
+                # Extract code snippets if present
+                code_snippet = None
+                if '```' in message_content:
+                    code_parts = message_content.split('```')
+                    if len(code_parts) > 1:
+                        code_snippet = code_parts[1].strip()[:150]
+                
+                # Create detailed log entry
+                detail_msg = f"🧮 Coder performing {operation_type}:"
+                if detail_info:
+                    detail_msg += f"\n   {detail_info}"
+                elif code_snippet:
+                    detail_msg += f"\n   Code: {code_snippet}..."
+                else:
+                    # Show the actual calculation or result
+                    detail_msg += f"\n   {message_content[:200]}"
+                
+                self.coder_operations.add(operation_type)
+                
+                self._add(ActivityType.CODER, Icon.ABACUS, detail_msg)
+        
+        # Track Reviewer Agent activities
+        if "agent_reviewer" in event_groups:
+            if "reviewer" not in self.agent_activities:
+                self._add(ActivityType.REVIEWER, Icon.SEARCH, REVIEWER_ACTIVATED)
+                self.agent_activities.add("reviewer")
+            
+            # Track reviewer feedback/critique
+            if message_content and "critique" in classify_message(message_content):
+                self._add(ActivityType.REVIEWER, Icon.MAGNIFIER, REVIEWER_FEEDBACK)
+        
+        # Track Manager/Orchestrator
+        if "agent_manager" in event_groups or "agent_orchestrator" in event_groups:
+            if "manager" not in self.agent_activities:
+                self._add(ActivityType.MANAGER, Icon.TARGET, MANAGER_ACTIVATED)
+                self.agent_activities.add("manager")
+        
+        # Track tool/code execution
+        if "tool_use" in event_groups:
+            self._add(ActivityType.CODER, Icon.WRENCH, CODE_EXECUTION)
+        
+        # Track workflow progress milestones
+        if self.event_count in [10, 20, 30, 40]:
+            self._add(
+                ActivityType.SYSTEM, Icon.ZAP,
+                f"⚡ Workflow milestone: {self.event_count} events processed, agents collaborating",
+            )
+        
+        if isinstance(event, WorkflowOutputEvent):
+            if event.data:
+                # Handle if data is a list or a single object
+                messages = event.data if isinstance(event.data, list) else [event.data]
+                for message in messages:
+                    if hasattr(message, 'text') and message.text:
+                        self.result_text = message.text
+                        
+                        # Parse the result to extract what each agent did
+                        self._add_result_activities(self.result_text)
+                        
+                        self._add(
+                            ActivityType.SUCCESS, Icon.CHECK,
+                            f"📄 Final report compiled! Manager synthesized inputs from {len(self.agent_activities)} agents",
+                            keep=True,
+                        )
+                    elif hasattr(message, 'content') and message.content:
+                        self.result_text = message.content
+                        
+                        # Parse the result to extract what each agent did
+                        self._add_result_activities(self.result_text)
+                        
+                        self._add(ActivityType.SUCCESS, Icon.CHECK, RESULT_GENERATED, keep=True)
+        
+        return self._take_ready()
+
+    def finish(self):
+        """Add the end-of-run entries and return every entry not yet returned"""
+        # Parse the final result to extract what agents did
+        self._add_result_activities(self.result_text)
+        
+        # Add comprehensive final summary
+        if len(self.agent_activities) > 0:
+            summary_parts = []
+            
+            if "researcher" in self.agent_activities:
+                research_types = []
+                if "market_analysis" in self.researcher_topics:
+                    research_types.append("market analysis")
+                if "data_research" in self.researcher_topics:
+                    research_types.append("data research")
+                if "trend_research" in self.researcher_topics:
+                    research_types.append("trend analysis")
+                if "comparative_research" in self.researcher_topics:
+                    research_types.append("comparative analysis")
+                
+                research_detail = f"{self.researcher_findings} findings"
+                if research_types:
+                    research_detail += f" ({', '.join(research_types)})"
+                summary_parts.append(f"� Researcher: {research_detail}")
+            
+            if "coder" in self.agent_activities:
+                # Count unique operation types
+                unique_ops = list(self.coder_operations)
+                coder_detail = f"{self.coder_steps} operations"
+                if unique_ops:
+                    coder_detail += f" ({', '.join(unique_ops[:3])})"  # Show up to 3 types
+                summary_parts.append(f"💻 Coder: {coder_detail}")
+            
+            if "manager" in self.agent_activities:
+                summary_parts.append(f"🎯 Manager: Coordinated {self.event_count} workflow events")
+            
+            if summary_parts:
+                self._add(
+                    ActivityType.SYSTEM, Icon.CHART,
+                    f"📊 Collaboration Summary:\n   " + "\n   ".join(summary_parts),
+                    keep=True,
+                )
+        
+        if self.dropped:
+            self._add(
+                ActivityType.SYSTEM, Icon.SCISSORS,
+                f"✂️ {self.dropped} further activity entries not kept (limit {self.max_entries})",
+                keep=True,
+            )
+        
+        return self._take_ready(close=True)
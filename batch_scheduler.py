@@ -0,0 +1,174 @@
+"""
+Batch Scheduler
+===============
+Runs batches of tasks for ``/api/execute-batch`` on a bounded pool of worker
+slots shared by every batch in flight, so a second nightly batch queues
+behind the first instead of doubling the number of workflows running. Slots
+are handed out first come, first served, which interleaves the items of
+concurrent batches.
+
+Items go through the same path as ``/api/execute``, so they are served from
+the result cache, coalesced with identical in-flight tasks and run on warmed
+workflows and shared chat clients. Results come back as they finish, ending
+with a summary of the batch's throughput and per-item latency.
+"""
+
+import asyncio
+import json
+import logging
+import time
+
+from hedging import percentile
+from task_metrics import Histogram, prometheus_labels, render_header, render_histogram
+
+logger = logging.getLogger(__name__)
+
+# Item latency buckets in seconds; batch items are whole workflow runs
+ITEM_BUCKETS = (1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+
+def parse_batch(body):
+    """Items of a batch body: a JSON array, or JSON Lines with one item per line.
+
+    An item is an object of task request fields or just the task text.
+    Raises ValueError naming the item that is not valid JSON.
+    """
+    text = body.decode("utf-8") if isinstance(body, bytes) else body
+    if text.lstrip().startswith("["):
+        items = json.loads(text)
+    else:
+        items = []
+        for number, line in enumerate(text.splitlines(), start=1):
+            if not line.strip():
+                continue
+            try:
+                items.append(json.loads(line))
+            except json.JSONDecodeError as e:
+                raise ValueError(f"Line {number} is not valid JSON: {e}") from None
+    return [{"task": item} if isinstance(item, str) else item for item in items]
+
+
+def latency_summary(seconds):
+    """Percentiles, mean and max of item latencies in milliseconds, or None"""
+    if not seconds:
+        return None
+    ms = [value * 1000 for value in seconds]
+    return {
+        "p50": round(percentile(ms, 50), 1),
+        "p95": round(percentile(ms, 95), 1),
+        "p99": round(percentile(ms, 99), 1),
+        "mean": round(sum(ms) / len(ms), 1),
+        "max": round(max(ms), 1),
+    }
+
+
+class BatchScheduler:
+    """Worker slots shared by all batches, plus batch and item counters.
+
+    ``run_item`` is awaited with an item's request and returns its
+    TaskResponse; an exception counts as a failed item.
+    """
+
+    def __init__(self, run_item, workers=4):
+        self._run_item = run_item
+        self.worker_count = workers
+        self._slots = asyncio.Semaphore(workers)
+
+        self.running = 0
+        self.active_batches = 0
+        self.batches = 0
+        self.items = {}
+        self.item_seconds = Histogram(ITEM_BUCKETS)
+
+    async def run(self, requests):
+        """Yield one result dict per item as it finishes, then the batch summary"""
+        self.batches += 1
+        self.active_batches += 1
+        started_at = time.monotonic()
+        results = asyncio.Queue()
+        pending = iter(enumerate(requests))
+
+        async def worker():
+            # Workers share the batch's items, so each takes the next one once it holds a slot
+            while True:
+                async with self._slots:
+                    item = next(pending, None)
+                    if item is None:
+                        return
+                    await results.put(await self._run(*item, started_at))
+
+        workers = [asyncio.create_task(worker()) for _ in range(min(self.worker_count, len(requests)))]
+        latencies = []
+        counts = {}
+        cached = 0
+        try:
+            for _ in range(len(requests)):
+                result = await results.get()
+                latencies.append(result["latency_ms"] / 1000)
+                counts[result["status"]] = counts.get(result["status"], 0) + 1
+                cached += bool(result.get("cached"))
+                yield result
+        finally:
+            self.active_batches -= 1
+            # Runs nobody reads any more are cancelled with their model calls
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+        wall = time.monotonic() - started_at
+        logger.info(f"Batch of {len(requests)} items finished in {wall:.1f}s")
+        yield {
+            "type": "summary",
+            "items": len(requests),
+            "succeeded": counts.get("success", 0),
+            "failed": counts.get("error", 0),
+            "cached": cached,
+            "wall_seconds": round(wall, 3),
+            "items_per_minute": round(len(requests) / wall * 60, 2) if wall else None,
+            "latency_ms": latency_summary(latencies),
+        }
+
+    async def _run(self, index, request, batch_started_at):
+        started_at = time.monotonic()
+        self.running += 1
+        try:
+            response = await self._run_item(request)
+            result = response.model_dump(exclude={"activity_log"})
+        except Exception as e:
+            logger.exception(f"Batch item {index} failed")
+            result = {"status": "error", "error": str(e)}
+        finally:
+            self.running -= 1
+        latency = time.monotonic() - started_at
+        self.item_seconds.observe(latency)
+        self.items[result["status"]] = self.items.get(result["status"], 0) + 1
+        return {
+            "type": "item",
+            "index": index,
+            **result,
+            "queue_wait_ms": round((started_at - batch_started_at) * 1000, 1),
+            "latency_ms": round(latency * 1000, 1),
+        }
+
+    def stats(self):
+        """Slot usage and batch and item counters, for the health endpoint"""
+        return {
+            "workers": self.worker_count,
+            "running": self.running,
+            "active_batches": self.active_batches,
+            "batches": self.batches,
+            "items": dict(sorted(self.items.items())),
+        }
+
+    def render_prometheus(self):
+        lines = []
+        render_header(lines, "magentic_batches_total", "counter", "Batches submitted to /api/execute-batch")
+        lines.append(f"magentic_batches_total {self.batches}")
+        render_header(lines, "magentic_batch_items_total", "counter", "Batch items finished, by status")
+        for status, count in sorted(self.items.items()):
+            lines.append(f"magentic_batch_items_total{prometheus_labels(status=status)} {count}")
+        render_header(lines, "magentic_batch_workers_busy", "gauge", "Batch worker slots running an item")
+        lines.append(f"magentic_batch_workers_busy {self.running}")
+        render_header(lines, "magentic_batch_item_seconds", "histogram", "Run time of batch items")
+        render_histogram(lines, "magentic_batch_item_seconds", self.item_seconds)
+        return "\n".join(lines) + "\n"
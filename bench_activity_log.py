@@ -0,0 +1,124 @@
+"""
+Activity Log Memory Benchmark
+=============================
+Measures the memory the activity logs of many concurrent runs hold, and the
+cost of serializing one. Feeds generated event streams (see
+``bench_event_classifier``) through one ``ActivityTracker`` per task, keeps
+every log alive at once, and compares:
+
+- dicts: a dict per entry and a string per formatted message, nothing
+  rolled up or capped, as the log used to be kept
+- slotted: ``ActivityEntry`` records, nothing rolled up or capped
+- rollup: ``ActivityEntry`` records with repeats rolled up (the default)
+- capped: rolled up and capped at ``--max-entries``
+
+Usage:
+    python bench_activity_log.py [--tasks 1000] [--events 300] [--max-entries 50]
+"""
+
+import argparse
+import json
+import tracemalloc
+
+from pydantic import BaseModel
+
+import activity_tracker
+from activity_tracker import ActivityTracker, iter_activity_json
+from bench_event_classifier import best_of, build_event, generate_events
+
+# Distinct generated streams the tasks cycle through
+STREAMS = 10
+
+
+# Messages that were string literals, and so shared, before entries were records
+LITERAL_MESSAGES = {
+    activity_tracker.RESEARCHER_ACTIVATED, activity_tracker.CODER_ACTIVATED, activity_tracker.REVIEWER_ACTIVATED,
+    activity_tracker.MANAGER_ACTIVATED, activity_tracker.REVIEWER_FEEDBACK, activity_tracker.CODE_EXECUTION,
+    activity_tracker.RESULT_GENERATED,
+}
+
+
+class Response(BaseModel):
+    activity_log: list = []
+
+
+def as_dicts(entries):
+    """The entries as they used to be held: a dict per entry, and a message string per formatted message"""
+    return [
+        {
+            "type": entry.type.value,
+            "message": entry.message if entry.message in LITERAL_MESSAGES else (entry.message + " ")[:-1],
+            "icon": entry.icon.value,
+        }
+        for entry in entries
+    ]
+
+
+def build_logs(streams, tasks, **options):
+    logs = []
+    for index in range(tasks):
+        tracker = ActivityTracker(**options)
+        for event in streams[index % len(streams)]:
+            tracker.process_event(event)
+        tracker.finish()
+        logs.append(tracker.activity_log)
+    return logs
+
+
+def measure(build):
+    """Memory held by the result of ``build`` and the peak while building it, in bytes"""
+    tracemalloc.start()
+    start, _ = tracemalloc.get_traced_memory()
+    logs = build()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return logs, current - start, peak - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tasks", type=int, default=1000, help="Concurrent tasks whose logs are kept")
+    parser.add_argument("--events", type=int, default=300, help="Workflow events per task")
+    parser.add_argument("--max-entries", type=int, default=50, help="Entry cap of the capped layout")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per serialization timing; the best is reported")
+    args = parser.parse_args()
+
+    streams = [[build_event(record) for record in generate_events(args.events, seed=seed)] for seed in range(STREAMS)]
+    unbounded = dict(max_entries=float("inf"), rollup_window=0)
+    layouts = {
+        "dicts": lambda: [as_dicts(log) for log in build_logs(streams, args.tasks, **unbounded)],
+        "slotted": lambda: build_logs(streams, args.tasks, **unbounded),
+        "rollup": lambda: build_logs(streams, args.tasks, max_entries=float("inf")),
+        "capped": lambda: build_logs(streams, args.tasks, max_entries=args.max_entries),
+    }
+
+    print(f"Tasks: {args.tasks}, events per task: {args.events}")
+    results = {}
+    for name, build in layouts.items():
+        logs, held, peak = measure(build)
+        entries = sum(len(log) for log in logs)
+        results[name] = (logs, held)
+        print(f"  {name:<8} {entries / args.tasks:7.1f} entries/task  {held / 2**20:8.2f} MiB held  "
+              f"{held / args.tasks / 1024:7.1f} KiB/task  (peak {peak / 2**20:.2f} MiB)")
+        del logs
+    print(f"  rollup holds {results['dicts'][1] / results['rollup'][1]:.1f}x less than dicts")
+
+    # Serializing one task's log for the response
+    log, dicts, rolled_up = results["slotted"][0][0], results["dicts"][0][0], results["rollup"][0][0]
+    timings = {
+        # What a response model costs: validate, dump to JSON-able values, then encode
+        "response model": best_of(args.repeat, lambda: json.dumps(
+            Response.model_validate(Response(activity_log=dicts).model_dump()).model_dump(mode="json"),
+            ensure_ascii=False,
+        )),
+        "json.dumps(dicts)": best_of(args.repeat, lambda: json.dumps(dicts, ensure_ascii=False)),
+        "iter_activity_json": best_of(args.repeat, lambda: "".join(iter_activity_json(log))),
+        f"  rolled up ({len(rolled_up)})": best_of(args.repeat, lambda: "".join(iter_activity_json(rolled_up))),
+    }
+    print(f"Serializing one log of {len(log)} entries:")
+    for name, seconds in timings.items():
+        print(f"  {name:<20} {seconds * 1e6:9.1f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,350 @@
+"""
+Backend Benchmark
+=================
+Drives ``/api/execute``, ``/api/execute-stream`` and ``/copilotkit`` at
+configurable concurrency and reports latency percentiles, requests/sec,
+time to first workflow event (streaming only), peak RSS and event-loop lag.
+
+By default the backend runs in this process on the offline chat client
+(``MAGENTIC_CHAT_CLIENT=offline``), so the numbers measure orchestration
+overhead rather than model latency. Pass ``--url`` to benchmark a running
+server instead; RSS and loop lag are then not measured.
+
+``--resume-check`` also times one task, sends another with a deadline it cannot
+meet and resumes it, checking that the resumed run gets back the full round
+budget the request asked for. Runs need to take long enough for the deadline to
+shorten them first, so pair it with a model latency such as
+``--model-latency constant:250``.
+
+Usage:
+    python bench_backend.py --concurrency 1,8,32 --requests 64 --output bench_results.json
+    python bench_backend.py --baseline bench_results.json   # exit 1 on regression
+    python bench_backend.py --resume-check --model-latency constant:250 --requests 8
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import math
+import os
+import platform
+import resource
+import sys
+import time
+
+import httpx
+
+ENDPOINTS = {
+    "execute": ("POST", "/api/execute"),
+    "stream": ("POST", "/api/execute-stream"),
+    "copilotkit": ("POST", "/copilotkit"),
+}
+
+BENCH_TASK = "Calculate the ROI for a $25,000 solar installation saving $200 a month, and research typical US market returns."
+
+# Numbers each request's task
+_request_ids = itertools.count()
+
+
+def bench_task():
+    """A distinct task per request, so coalescing and the result cache stay out of the measurement"""
+    return f"{BENCH_TASK}\n\n(benchmark request {next(_request_ids)})"
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of ``values``, or None if empty"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(math.ceil(pct / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+def summarize_ms(seconds):
+    if not seconds:
+        return None
+    ms = [s * 1000 for s in seconds]
+    return {
+        "p50": round(percentile(ms, 50), 2),
+        "p95": round(percentile(ms, 95), 2),
+        "p99": round(percentile(ms, 99), 2),
+        "mean": round(sum(ms) / len(ms), 2),
+        "max": round(max(ms), 2),
+    }
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == "darwin" else peak / 1024
+
+
+def current_rss_mb():
+    """Resident set size from /proc, falling back to the peak from getrusage"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError):
+        return peak_rss_mb()
+
+
+class ProcessMonitor:
+    """Samples event-loop lag and RSS while a scenario runs"""
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.lags = []
+        self.peak_rss_mb = 0.0
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            self.lags.append(max(loop.time() - start - self.interval, 0))
+            self.peak_rss_mb = max(self.peak_rss_mb, current_rss_mb())
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+
+async def call_endpoint(client, endpoint):
+    """One request; returns (latency, time to first event, error or None)"""
+    method, path = ENDPOINTS[endpoint]
+    start = time.perf_counter()
+    first_event = None
+    task = bench_task()
+    task_body = {"task": task, "no_cache": True, "no_store": True}
+
+    if endpoint == "stream":
+        error = None
+        async with client.stream(method, path, json=task_body) as response:
+            if response.status_code != 200:
+                return time.perf_counter() - start, None, f"HTTP {response.status_code}"
+            async for line in response.aiter_lines():
+                if first_event is None and line == "event: event":
+                    first_event = time.perf_counter() - start
+                elif line == "event: error":
+                    error = "error frame"
+        return time.perf_counter() - start, first_event, error
+
+    body = task_body if endpoint == "execute" else {"messages": [{"role": "user", "content": task}]}
+    response = await client.request(method, path, json=body)
+    latency = time.perf_counter() - start
+    if response.status_code != 200:
+        return latency, None, f"HTTP {response.status_code}"
+
+    data = response.json()
+    if endpoint == "execute" and data.get("status") != "success":
+        return latency, None, data.get("error") or "error status"
+    if endpoint == "copilotkit":
+        content = (data.get("messages") or [{}])[-1].get("content", "")
+        if content.startswith("Error executing task"):
+            return latency, None, content
+    return latency, None, None
+
+
+async def run_scenario(client, endpoint, concurrency, requests, measure_process):
+    latencies, first_events, errors = [], [], []
+    remaining = iter(range(requests))
+    monitor = ProcessMonitor() if measure_process else None
+
+    async def worker():
+        for _ in remaining:
+            try:
+                latency, first_event, error = await call_endpoint(client, endpoint)
+            except httpx.HTTPError as e:
+                latency, first_event, error = None, None, repr(e)
+            if error:
+                errors.append(error)
+            elif latency is not None:
+                latencies.append(latency)
+            if first_event is not None:
+                first_events.append(first_event)
+
+    if monitor:
+        monitor.start()
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    if monitor:
+        await monitor.stop()
+
+    return {
+        "endpoint": endpoint,
+        "concurrency": concurrency,
+        "requests": requests,
+        "succeeded": len(latencies),
+        "errors": len(errors),
+        "sample_errors": sorted(set(errors))[:3],
+        "elapsed_s": round(elapsed, 3),
+        "rps": round(len(latencies) / elapsed, 2) if elapsed else None,
+        "latency_ms": summarize_ms(latencies),
+        "time_to_first_event_ms": summarize_ms(first_events),
+        "loop_lag_ms": summarize_ms(monitor.lags) if monitor else None,
+        "peak_rss_mb": round(monitor.peak_rss_mb, 1) if monitor else None,
+    }
+
+
+async def check_resume_after_deadline(client, max_rounds=20):
+    """Resume a task that ran out of time; its resumed run must keep the requested round budget"""
+    body = {"task": bench_task(), "no_cache": True, "no_store": True, "max_rounds": max_rounds}
+    start = time.perf_counter()
+    await client.post("/api/execute", json=body)
+    # A deadline three quarters into an uninterrupted run lets the budget shrink before the run is cut
+    deadline_s = round((time.perf_counter() - start) * 0.75, 3)
+
+    body = {**body, "task": bench_task(), "deadline_s": deadline_s}
+    first = (await client.post("/api/execute", json=body)).json()
+    if first.get("status") != "error" or not first.get("task_id"):
+        return {"check": "resume_after_deadline", "ok": None, "detail": f"finished within {deadline_s}s; nothing to resume"}
+
+    task_id = first["task_id"]
+    resumed = (await client.post(f"/api/tasks/{task_id}/resume")).json()
+    trace = (await client.get(f"/api/traces/{task_id}")).json()
+    resumed_rounds = trace.get("round_budget", {}).get("max_rounds")
+    ok = resumed.get("status") == "success" and resumed_rounds == max_rounds
+    return {
+        "check": "resume_after_deadline",
+        "ok": ok,
+        "detail": f"resumed with status {resumed.get('status')} and a budget of {resumed_rounds} of {max_rounds} rounds",
+    }
+
+
+async def start_local_server(port, log_level):
+    """Serve the backend in this event loop on the offline chat client"""
+    import uvicorn
+
+    os.environ.setdefault("MAGENTIC_CHAT_CLIENT", "offline")
+    # Requests differ only in their number; measure the workflow, not near-duplicate cache hits
+    os.environ.setdefault("MAGENTIC_CACHE_ENABLED", "0")
+    from magentic_ui_backend import app
+
+    # The backend configures INFO logging on import; per-request logs would dominate the numbers
+    logging.getLogger().setLevel(log_level)
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", lifespan="on"))
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        if task.done():
+            task.result()
+        await asyncio.sleep(0.05)
+    return server, task
+
+
+def compare_to_baseline(results, baseline_path, threshold):
+    """Regressions in p95 latency or requests/sec beyond ``threshold`` (a fraction)"""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {(r["endpoint"], r["concurrency"]): r for r in json.load(f)["results"]}
+
+    regressions = []
+    for result in results:
+        before = baseline.get((result["endpoint"], result["concurrency"]))
+        if not before or not before["latency_ms"] or not result["latency_ms"]:
+            continue
+        name = f"{result['endpoint']}@{result['concurrency']}"
+        if result["latency_ms"]["p95"] > before["latency_ms"]["p95"] * (1 + threshold):
+            regressions.append(f"{name}: p95 {before['latency_ms']['p95']}ms -> {result['latency_ms']['p95']}ms")
+        if result["rps"] < before["rps"] * (1 - threshold):
+            regressions.append(f"{name}: rps {before['rps']} -> {result['rps']}")
+    return regressions
+
+
+async def main_async(args):
+    server = server_task = None
+    base_url = args.url
+    if not base_url:
+        os.environ.setdefault("MAGENTIC_OFFLINE_LATENCY_MS", args.model_latency)
+        server, server_task = await start_local_server(args.port, args.log_level)
+        base_url = f"http://127.0.0.1:{args.port}"
+
+    endpoints = [e.strip() for e in args.endpoints.split(",") if e.strip()]
+    levels = [int(c) for c in args.concurrency.split(",")]
+    limits = httpx.Limits(max_connections=max(levels) * 2, max_keepalive_connections=max(levels) * 2)
+    results = []
+    checks = []
+
+    try:
+        async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as client:
+            # Warm the workflow pool and chat clients before measuring
+            await call_endpoint(client, "execute")
+
+            for endpoint in endpoints:
+                for concurrency in levels:
+                    result = await run_scenario(client, endpoint, concurrency, args.requests, measure_process=server is not None)
+                    results.append(result)
+                    latency = result["latency_ms"] or {}
+                    print(
+                        f"{endpoint:<11} c={concurrency:<4} rps={result['rps']:<8} "
+                        f"p50={latency.get('p50')}ms p95={latency.get('p95')}ms p99={latency.get('p99')}ms "
+                        f"errors={result['errors']}"
+                    )
+
+            if args.resume_check:
+                check = await check_resume_after_deadline(client)
+                checks.append(check)
+                print(f"{check['check']}: {'ok' if check['ok'] else 'skipped' if check['ok'] is None else 'FAILED'} ({check['detail']})")
+    finally:
+        if server is not None:
+            server.should_exit = True
+            await server_task
+
+    return results, checks
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="Benchmark a running server instead of an in-process offline one")
+    parser.add_argument("--port", type=int, default=8765, help="Port for the in-process server")
+    parser.add_argument("--endpoints", default="execute,stream,copilotkit", help="Comma-separated: " + ", ".join(ENDPOINTS))
+    parser.add_argument("--concurrency", default="1,8,32", help="Comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=64, help="Requests per endpoint and concurrency level")
+    parser.add_argument("--model-latency", default="constant:0", help="MAGENTIC_OFFLINE_LATENCY_MS for the in-process server")
+    parser.add_argument("--timeout", type=float, default=300, help="Per-request timeout in seconds")
+    parser.add_argument("--output", default="bench_results.json", help="Where to write the JSON results")
+    parser.add_argument("--baseline", help="Earlier results to compare against; exits 1 on regression")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Allowed regression as a fraction (default 0.2)")
+    parser.add_argument("--resume-check", action="store_true", help="Also check that a task resumed after its deadline keeps its round budget")
+    parser.add_argument("--log-level", default="WARNING", help="Backend log level while benchmarking")
+    args = parser.parse_args()
+
+    results, checks = asyncio.run(main_async(args))
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "url": args.url,
+            "model_latency": None if args.url else os.environ.get("MAGENTIC_OFFLINE_LATENCY_MS"),
+            "process_peak_rss_mb": None if args.url else round(peak_rss_mb(), 1),
+        },
+        "results": results,
+        "checks": checks,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    failed = any(check["ok"] is False for check in checks)
+    if args.baseline:
+        regressions = compare_to_baseline(results, args.baseline, args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        failed = failed or bool(regressions)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
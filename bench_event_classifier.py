@@ -0,0 +1,154 @@
+"""
+Event Classifier Microbenchmark
+===============================
+Measures the per-event cost of building the activity log. Replays a recorded
+event stream (JSON lines) or a generated one through ``ActivityTracker``, and
+compares the classifier against re-lower-casing the text for every keyword.
+
+Recorded streams have one event per line:
+
+    {"kind": "agent_delta", "agent": "researcher", "text": "..."}
+
+where ``kind`` is one of agent_delta, agent_message, orchestrator,
+executor_invoked, superstep or output.
+
+Usage:
+    python bench_event_classifier.py [--events stream.jsonl] [--count 5000] [--repeat 5]
+"""
+
+import argparse
+import json
+import random
+import time
+
+from agent_framework import (
+    ChatMessage,
+    ExecutorInvokedEvent,
+    MagenticAgentDeltaEvent,
+    MagenticAgentMessageEvent,
+    MagenticOrchestratorMessageEvent,
+    SuperStepStartedEvent,
+    WorkflowOutputEvent,
+)
+
+from activity_tracker import ActivityTracker
+from event_classifier import EVENT_GROUPS, EVENT_KEYWORDS, MESSAGE_GROUPS, MESSAGE_KEYWORDS, classify
+
+SAMPLE_TEXTS = [
+    "- The EV market grew 35% year over year\n- Industry analysts expect growth to continue",
+    "Average deployment cost is $1.2M according to recent data",
+    "```python\nrevenue = 1200000 * 1.15\nprint(revenue)\n```",
+    "CAGR = (End / Start) ** (1 / years) - 1 = 12.4%",
+    "The ROI result is 18% with a payback period of 3 years",
+    "Total = 450 + 320 + 230 = 1000",
+    "However, the assumption about adoption rates is missing a source; I suggest we validate it",
+    "Comparing the two vendors versus last year shows little difference",
+    "Let me analyze the trend before writing code",
+    "Working on it",
+]
+
+AGENTS = ["researcher", "coder", "reviewer"]
+
+
+def build_event(record):
+    """Turn one recorded JSON line into a workflow event"""
+    kind = record["kind"]
+    agent = record.get("agent", "")
+    text = record.get("text", "")
+    if kind == "agent_delta":
+        return MagenticAgentDeltaEvent(agent_id=agent, text=text)
+    if kind == "agent_message":
+        return MagenticAgentMessageEvent(agent_id=agent, message=ChatMessage(role="assistant", text=text))
+    if kind == "orchestrator":
+        return MagenticOrchestratorMessageEvent(
+            orchestrator_id="magentic_orchestrator",
+            message=ChatMessage(role="assistant", text=text),
+            kind=record.get("orchestrator_kind", "instruction"),
+        )
+    if kind == "executor_invoked":
+        return ExecutorInvokedEvent(executor_id=f"agent_{agent}" if agent else "magentic_orchestrator")
+    if kind == "superstep":
+        return SuperStepStartedEvent(iteration=record.get("iteration", 0))
+    if kind == "output":
+        return WorkflowOutputEvent(data=ChatMessage(role="assistant", text=text), source_executor_id="magentic_orchestrator")
+    raise ValueError(f"Unknown event kind: {kind}")
+
+
+def load_events(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def generate_events(count, seed=0):
+    """A run-shaped stream: mostly agent deltas, with messages, steps and a final output"""
+    rng = random.Random(seed)
+    records = []
+    for i in range(count - 1):
+        agent = AGENTS[(i // 40) % len(AGENTS)]
+        roll = rng.random()
+        if roll < 0.75:
+            records.append({"kind": "agent_delta", "agent": agent, "text": rng.choice(SAMPLE_TEXTS)[: rng.randint(4, 60)]})
+        elif roll < 0.85:
+            records.append({"kind": "agent_message", "agent": agent, "text": rng.choice(SAMPLE_TEXTS)})
+        elif roll < 0.9:
+            records.append({"kind": "orchestrator", "text": f"Next, {agent}: {rng.choice(SAMPLE_TEXTS)}"})
+        elif roll < 0.95:
+            records.append({"kind": "executor_invoked", "agent": agent})
+        else:
+            records.append({"kind": "superstep", "iteration": i})
+    records.append({"kind": "output", "text": "Final report: market average ROI = 18%, CAGR 12.4%"})
+    return records
+
+
+def substring_scan(text, keywords):
+    """Baseline: lower-case the text again for every keyword, as the tracker used to"""
+    return {group for group, words in keywords.items() if any(k in text.lower() for k in words)}
+
+
+def best_of(repeat, fn):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", help="Recorded event stream (JSON lines); generated if omitted")
+    parser.add_argument("--count", type=int, default=5000, help="Generated stream length")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per measurement; the best is reported")
+    args = parser.parse_args()
+
+    records = load_events(args.events) if args.events else generate_events(args.count)
+    events = [build_event(record) for record in records]
+    texts = [str(event) for event in events]
+    messages = [record["text"] for record in records if record.get("text")]
+    print(f"Events: {len(events)}")
+
+    def run_tracker():
+        tracker = ActivityTracker()
+        for event in events:
+            tracker.process_event(event)
+        tracker.finish()
+
+    results = {
+        "tracker": best_of(args.repeat, run_tracker),
+        "classify": best_of(args.repeat, lambda: (
+            [classify(text, EVENT_GROUPS) for text in texts],
+            [classify(text, MESSAGE_GROUPS) for text in messages],
+        )),
+        "substring_scan": best_of(args.repeat, lambda: (
+            [substring_scan(text, EVENT_KEYWORDS) for text in texts],
+            [substring_scan(text, MESSAGE_KEYWORDS) for text in messages],
+        )),
+    }
+
+    for name, seconds in results.items():
+        print(f"  {name:<15} {seconds * 1e6 / len(events):8.2f} us/event  ({seconds * 1000:.1f} ms total)")
+    print(f"  classify speedup over substring_scan: {results['substring_scan'] / results['classify']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
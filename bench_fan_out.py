@@ -0,0 +1,157 @@
+"""
+Fan-Out Benchmark
+=================
+Runs the same task through ``/api/execute`` with ``"orchestration": "sequential"``
+and ``"parallel"`` and reports wall time, manager rounds, model calls and
+tokens per mode, plus the speed-up of the parallel mode.
+
+By default the backend runs in this process on the offline chat client with a
+fixed model latency, so the difference is the time saved by running
+independent agent turns side by side (the scripted manager sends researcher
+and coder together). Pass ``--url`` to compare the modes against a running
+server and real models instead.
+
+Usage:
+    python bench_fan_out.py --runs 10 --model-latency constant:500
+    python bench_fan_out.py --url http://localhost:8000 --runs 3
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import time
+
+import httpx
+
+from bench_backend import start_local_server, summarize_ms
+
+MODES = ("sequential", "parallel")
+
+# Research and calculation steps that do not depend on each other
+BENCH_TASK = """
+Calculate the ROI for a solar panel installation:
+- Initial cost: $25,000
+- Monthly savings: $200
+- Lifespan: 20 years
+
+Also research the average ROI for solar panels in the US market.
+"""
+
+
+async def run_once(client, mode, index):
+    """One task in ``mode``; returns (wall time, trace) or raises on failure"""
+    body = {
+        # A distinct task per run keeps coalescing out of the measurement
+        "task": f"{BENCH_TASK.strip()}\n\n(benchmark run {index})",
+        "orchestration": mode,
+        "no_cache": True,
+        "no_store": True,
+    }
+    start = time.perf_counter()
+    response = await client.post("/api/execute", json=body)
+    elapsed = time.perf_counter() - start
+    response.raise_for_status()
+    data = response.json()
+    if data.get("status") != "success":
+        raise RuntimeError(data.get("error") or "error status")
+
+    trace = None
+    if data.get("task_id"):
+        reply = await client.get(f"/api/traces/{data['task_id']}")
+        if reply.status_code == 200:
+            trace = reply.json()
+    return elapsed, trace
+
+
+async def run_mode(client, mode, runs, concurrency):
+    latencies, rounds, calls, tokens, errors = [], [], [], [], []
+    remaining = iter(range(runs))
+
+    async def worker():
+        for index in remaining:
+            try:
+                elapsed, trace = await run_once(client, mode, index)
+            except (httpx.HTTPError, RuntimeError) as e:
+                errors.append(repr(e))
+                continue
+            latencies.append(elapsed)
+            if trace:
+                rounds.append(trace["rounds"])
+                calls.append(sum(span["calls"] for span in trace["spans"]))
+                tokens.append(trace["prompt_tokens"] + trace["completion_tokens"])
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+    def mean(values):
+        return round(sum(values) / len(values), 2) if values else None
+
+    return {
+        "mode": mode,
+        "runs": runs,
+        "succeeded": len(latencies),
+        "errors": len(errors),
+        "sample_errors": sorted(set(errors))[:3],
+        "latency_ms": summarize_ms(latencies),
+        "rounds": mean(rounds),
+        "model_calls": mean(calls),
+        "tokens": mean(tokens),
+    }
+
+
+async def main_async(args):
+    server = server_task = None
+    base_url = args.url
+    if not base_url:
+        os.environ.setdefault("MAGENTIC_OFFLINE_LATENCY_MS", args.model_latency)
+        server, server_task = await start_local_server(args.port, args.log_level)
+        base_url = f"http://127.0.0.1:{args.port}"
+
+    results = []
+    try:
+        async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout) as client:
+            # Warm the workflow pool and chat clients before measuring
+            for mode in MODES:
+                await run_once(client, mode, "warm-up")
+
+            for mode in MODES:
+                result = await run_mode(client, mode, args.runs, args.concurrency)
+                results.append(result)
+                latency = result["latency_ms"] or {}
+                print(
+                    f"{mode:<10} p50={latency.get('p50')}ms mean={latency.get('mean')}ms "
+                    f"rounds={result['rounds']} calls={result['model_calls']} tokens={result['tokens']} "
+                    f"errors={result['errors']}"
+                )
+    finally:
+        if server is not None:
+            server.should_exit = True
+            await server_task
+
+    sequential, parallel = (result["latency_ms"] for result in results)
+    if sequential and parallel:
+        saved = 1 - parallel["mean"] / sequential["mean"]
+        print(f"parallel saves {saved:.1%} of wall time ({sequential['mean'] / parallel['mean']:.2f}x)")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="Benchmark a running server instead of an in-process offline one")
+    parser.add_argument("--port", type=int, default=8766, help="Port for the in-process server")
+    parser.add_argument("--runs", type=int, default=10, help="Tasks per orchestration mode")
+    parser.add_argument("--concurrency", type=int, default=1, help="Tasks in flight at once")
+    parser.add_argument("--model-latency", default="constant:500", help="MAGENTIC_OFFLINE_LATENCY_MS for the in-process server")
+    parser.add_argument("--timeout", type=float, default=600, help="Per-request timeout in seconds")
+    parser.add_argument("--output", help="Where to write the JSON results")
+    parser.add_argument("--log-level", default="WARNING", help="Backend log level while benchmarking")
+    args = parser.parse_args()
+
+    results = asyncio.run(main_async(args))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"task": BENCH_TASK.strip(), "model_latency": args.model_latency, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Hedging Benchmark
+=================
+Runs the same tasks through ``/api/execute`` with call hedging off and then on
+and reports task latency percentiles, the share of model calls that were
+hedged and how many hedges won.
+
+The backend runs in this process on the offline chat client with a
+heavy-tailed model latency, so a few slow calls set each task's tail; hedging
+is toggled on the running backend between the two passes. The off pass also
+fills the latency windows the hedge delay is taken from.
+
+Usage:
+    python bench_hedging.py --runs 40 --model-latency lognormal:200,1.0
+    python bench_hedging.py --concurrency 4 --error-rate 0.05
+"""
+
+import argparse
+import asyncio
+import json
+import os
+
+import httpx
+
+from bench_backend import start_local_server, summarize_ms
+from bench_fan_out import run_once
+
+MODES = ("off", "on")
+
+
+def hedge_totals(hedging):
+    """Calls, hedges, hedge wins and retries summed over deployments and call types"""
+    totals = dict(calls=0, hedged=0, hedge_wins=0, retries=0)
+    for deployment in hedging["deployments"].values():
+        totals["retries"] += deployment.get("retries", 0)
+        for call_type in ("response", "stream"):
+            for name in ("calls", "hedged", "hedge_wins"):
+                totals[name] += deployment.get(call_type, {}).get(name, 0)
+    return totals
+
+
+async def run_mode(client, backend, mode, runs, concurrency):
+    backend.call_hedging.enabled = mode == "on"
+    before = hedge_totals(backend.call_hedging.stats())
+    latencies, errors = [], []
+    remaining = iter(range(runs))
+
+    async def worker():
+        for index in remaining:
+            try:
+                elapsed, _ = await run_once(client, "sequential", f"{mode}-{index}")
+            except (httpx.HTTPError, RuntimeError) as e:
+                errors.append(repr(e))
+                continue
+            latencies.append(elapsed)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+    after = hedge_totals(backend.call_hedging.stats())
+    calls, hedged, wins, retries = (after[name] - before[name] for name in ("calls", "hedged", "hedge_wins", "retries"))
+    return {
+        "hedging": mode,
+        "runs": runs,
+        "succeeded": len(latencies),
+        "errors": len(errors),
+        "sample_errors": sorted(set(errors))[:3],
+        "latency_ms": summarize_ms(latencies),
+        "model_calls": calls,
+        "hedge_rate": round(hedged / calls, 4) if calls else 0.0,
+        "hedge_wins": wins,
+        "retries": retries,
+    }
+
+
+async def main_async(args):
+    os.environ.setdefault("MAGENTIC_OFFLINE_LATENCY_MS", args.model_latency)
+    os.environ.setdefault("MAGENTIC_OFFLINE_ERROR_RATE", str(args.error_rate))
+    os.environ.setdefault("MAGENTIC_HEDGE_PERCENTILE", str(args.percentile))
+    server, server_task = await start_local_server(args.port, args.log_level)
+    import magentic_ui_backend as backend
+
+    results = []
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.port}", timeout=args.timeout) as client:
+            await run_once(client, "sequential", "warm-up")
+            for mode in MODES:
+                result = await run_mode(client, backend, mode, args.runs, args.concurrency)
+                results.append(result)
+                latency = result["latency_ms"] or {}
+                print(
+                    f"hedging {mode:<3} p50={latency.get('p50')}ms p95={latency.get('p95')}ms p99={latency.get('p99')}ms "
+                    f"calls={result['model_calls']} hedge_rate={result['hedge_rate']:.1%} "
+                    f"hedge_wins={result['hedge_wins']} retries={result['retries']} errors={result['errors']}"
+                )
+            hedging = (await client.get("/api/health")).json()["hedging"]
+    finally:
+        server.should_exit = True
+        await server_task
+
+    off, on = (result["latency_ms"] for result in results)
+    if off and on:
+        for pct in ("p50", "p95", "p99"):
+            print(f"{pct}: {off[pct]}ms -> {on[pct]}ms ({1 - on[pct] / off[pct]:+.1%} saved)")
+    return results, hedging
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8767, help="Port for the in-process server")
+    parser.add_argument("--runs", type=int, default=40, help="Tasks per pass")
+    parser.add_argument("--concurrency", type=int, default=1, help="Tasks in flight at once")
+    parser.add_argument("--model-latency", default="lognormal:200,1.0", help="MAGENTIC_OFFLINE_LATENCY_MS for the server")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="MAGENTIC_OFFLINE_ERROR_RATE for the server")
+    parser.add_argument("--percentile", type=float, default=95, help="MAGENTIC_HEDGE_PERCENTILE for the server")
+    parser.add_argument("--timeout", type=float, default=600, help="Per-request timeout in seconds")
+    parser.add_argument("--output", help="Where to write the JSON results")
+    parser.add_argument("--log-level", default="WARNING", help="Backend log level while benchmarking")
+    args = parser.parse_args()
+
+    results, hedging = asyncio.run(main_async(args))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"model_latency": args.model_latency, "results": results, "hedging": hedging}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Request Cancellation
+====================
+Stops paying for answers nobody will read. A workflow run is shared by the
+requests waiting for it and is cancelled, with its in-flight model calls,
+once the last of them leaves (see ``single_flight``). Requests leave when:
+
+- the client disconnects. ``until_disconnected`` watches the connection of a
+  request whose response is only sent at the end; streamed responses notice
+  through the server, which stops the stream
+- their deadline passes. Runs aim to finish before it by shortening their
+  round budget (see ``round_budget``); a run that still overruns is left
+
+``Cancellations`` counts requests that left, by endpoint and reason, for
+``/api/health`` and ``/api/metrics``.
+"""
+
+import asyncio
+import logging
+import time
+
+from task_metrics import prometheus_labels, render_header
+
+logger = logging.getLogger(__name__)
+
+
+class ClientDisconnected(Exception):
+    """The client went away before its response was ready"""
+
+
+def deadline_after(seconds):
+    """``time.monotonic()`` deadline ``seconds`` from now, or None for no deadline"""
+    return time.monotonic() + seconds if seconds else None
+
+
+def time_left(deadline):
+    """Seconds until ``deadline``, never negative; None for no deadline"""
+    return max(deadline - time.monotonic(), 0) if deadline is not None else None
+
+
+async def wait_for_disconnect(request):
+    """Return once the client of a request whose body has been read disconnects"""
+    while True:
+        message = await request.receive()
+        if message["type"] == "http.disconnect":
+            return
+
+
+class Cancellations:
+    """Counts of requests that left before their result, by endpoint and reason"""
+
+    def __init__(self):
+        self.counts = {}
+
+    def record(self, endpoint, reason):
+        logger.info(f"Request to {endpoint} left before its result ({reason})")
+        self.counts[(endpoint, reason)] = self.counts.get((endpoint, reason), 0) + 1
+
+    async def until_disconnected(self, request, awaitable, endpoint):
+        """Result of ``awaitable``; cancels it and raises ClientDisconnected if the client leaves first"""
+        work = asyncio.ensure_future(awaitable)
+        watcher = asyncio.create_task(wait_for_disconnect(request))
+        try:
+            await asyncio.wait((work, watcher), return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            if not work.done():
+                work.cancel()
+                try:
+                    await work
+                except asyncio.CancelledError:
+                    pass
+            watcher.cancel()
+        if work.cancelled() and watcher.done():
+            self.record(endpoint, "disconnect")
+            raise ClientDisconnected()
+        return work.result()
+
+    def stats(self):
+        requests = {}
+        for (endpoint, reason), count in sorted(self.counts.items()):
+            requests.setdefault(endpoint, {})[reason] = count
+        return {"requests_left": requests}
+
+    def render_prometheus(self):
+        lines = []
+        render_header(lines, "magentic_requests_cancelled_total", "counter", "Requests that left before their result, by endpoint and reason")
+        for (endpoint, reason), count in sorted(self.counts.items()):
+            lines.append(f"magentic_requests_cancelled_total{prometheus_labels(endpoint=endpoint, reason=reason)} {count}")
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,219 @@
+"""
+Shared Credential and Chat Client Registry
+==========================================
+Hands out one process-wide Azure credential and one chat client per
+(endpoint, deployment) pair, so agents and workflows share HTTP connection
+pools instead of each building their own client. The Entra ID token is
+prefetched at startup and refreshed in the background before it expires, so
+model calls never wait on token acquisition.
+
+Chat clients are built on an ``AsyncAzureOpenAI`` with SDK retries turned off.
+A 429 or 5xx comes straight back to the middleware, where the concurrency
+limiter and the retry and failover layers handle it without holding a
+concurrency slot through the SDK's backoff sleeps.
+"""
+
+import asyncio
+import logging
+import os
+import time
+
+from agent_framework.azure import AzureOpenAIChatClient
+from azure.identity import DefaultAzureCredential
+from dotenv import dotenv_values
+from openai import AsyncAzureOpenAI
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TOKEN_SCOPE = "https://cognitiveservices.azure.com/.default"
+DEFAULT_API_VERSION = "2024-10-21"
+
+
+class ChatClientRegistry:
+    """Process-wide credential, token cache and chat clients.
+
+    Clients are keyed by (endpoint, deployment). The credential and token are
+    shared by every client, and the token is exposed to the OpenAI SDK through
+    an async ``azure_ad_token_provider`` that serves the cached value.
+    ``middleware`` is installed on every chat client the registry creates.
+    """
+
+    def __init__(self, env_file_path=None, refresh_margin=300, middleware=None):
+        self.env_file_path = env_file_path
+        self.refresh_margin = refresh_margin
+        self.middleware = middleware
+
+        # Resolve connection settings once instead of per client
+        settings = dotenv_values(env_file_path) if env_file_path else {}
+        self.endpoint = settings.get("AZURE_OPENAI_ENDPOINT") or os.getenv("AZURE_OPENAI_ENDPOINT")
+        self.token_scope = (
+            settings.get("AZURE_OPENAI_TOKEN_ENDPOINT")
+            or os.getenv("AZURE_OPENAI_TOKEN_ENDPOINT")
+            or DEFAULT_TOKEN_SCOPE
+        )
+        self.deployment = (
+            settings.get("AZURE_OPENAI_CHAT_DEPLOYMENT_NAME") or os.getenv("AZURE_OPENAI_CHAT_DEPLOYMENT_NAME")
+        )
+        self.api_key = settings.get("AZURE_OPENAI_API_KEY") or os.getenv("AZURE_OPENAI_API_KEY")
+        self.uses_api_key = bool(self.api_key)
+        self.api_version = (
+            settings.get("AZURE_OPENAI_API_VERSION")
+            or os.getenv("AZURE_OPENAI_API_VERSION")
+            or DEFAULT_API_VERSION
+        )
+
+        self._credential = None
+        self._clients = {}
+        self._embedding_client = None
+        self._token = None
+        self._token_lock = None
+        self._refresh_task = None
+
+        self.client_requests = 0
+        self.client_reuses = 0
+        self.token_fetches = 0
+        self.token_failures = 0
+        self.token_waits = 0
+
+    @property
+    def credential(self):
+        """The shared ``DefaultAzureCredential``, created on first use."""
+        if self._credential is None:
+            self._credential = DefaultAzureCredential()
+        return self._credential
+
+    def get_chat_client(self, deployment=None, endpoint=None, middleware=None, api_key=None):
+        """Return the shared chat client for ``deployment`` on ``endpoint``.
+
+        Without a deployment the client uses the one configured in the .env file.
+        ``middleware`` replaces the registry's middleware for this client, and
+        ``api_key`` authenticates it with that key instead of the shared one.
+        """
+        endpoint = endpoint or self.endpoint
+        middleware = self.middleware if middleware is None else middleware
+        key = (endpoint or "", deployment, tuple(middleware or ()))
+        self.client_requests += 1
+
+        client = self._clients.get(key)
+        if client is not None:
+            self.client_reuses += 1
+            return client
+
+        client_kwargs = {"env_file_path": self.env_file_path}
+        if deployment:
+            client_kwargs["deployment_name"] = deployment
+        if endpoint:
+            client_kwargs["endpoint"] = endpoint
+            client_kwargs["async_client"] = self._sdk_client(endpoint, deployment or self.deployment, api_key)
+        if middleware:
+            client_kwargs["middleware"] = middleware
+
+        client = AzureOpenAIChatClient(**client_kwargs)
+        self._clients[key] = client
+        logger.info(f"Created shared chat client for deployment '{deployment}'")
+        return client
+
+    def _sdk_client(self, endpoint, deployment, api_key=None):
+        """``AsyncAzureOpenAI`` for a chat client; retries are left to the middleware"""
+        client_kwargs = {
+            "azure_endpoint": endpoint,
+            "azure_deployment": deployment,
+            "api_version": self.api_version,
+            "max_retries": 0,
+        }
+        if api_key or self.uses_api_key:
+            client_kwargs["api_key"] = api_key or self.api_key
+        else:
+            client_kwargs["azure_ad_token_provider"] = self._token_provider
+        return AsyncAzureOpenAI(**client_kwargs)
+
+    def get_embedding_client(self):
+        """Shared ``AsyncAzureOpenAI`` client for embedding calls, on the same token cache."""
+        if self._embedding_client is None:
+            client_kwargs = {"azure_endpoint": self.endpoint, "api_version": self.api_version}
+            if self.uses_api_key:
+                client_kwargs["api_key"] = self.api_key
+            else:
+                client_kwargs["azure_ad_token_provider"] = self._token_provider
+            self._embedding_client = AsyncAzureOpenAI(**client_kwargs)
+        return self._embedding_client
+
+    def _token_is_fresh(self):
+        return self._token is not None and self._token.expires_on - time.time() > self.refresh_margin / 2
+
+    async def _fetch_token(self, force=False):
+        """Acquire a new token off the event loop, one fetch at a time."""
+        if self._token_lock is None:
+            self._token_lock = asyncio.Lock()
+
+        async with self._token_lock:
+            if not force and self._token_is_fresh():
+                return self._token
+            try:
+                self._token = await asyncio.to_thread(self.credential.get_token, self.token_scope)
+                self.token_fetches += 1
+            except Exception:
+                self.token_failures += 1
+                raise
+            return self._token
+
+    async def _token_provider(self):
+        """``azure_ad_token_provider`` for the OpenAI SDK: serve the cached token."""
+        if not self._token_is_fresh():
+            # Only reached if prefetch or background refresh has not kept up
+            self.token_waits += 1
+            await self._fetch_token()
+        return self._token.token
+
+    async def _refresh_loop(self):
+        """Refresh the token ``refresh_margin`` seconds before it expires."""
+        while True:
+            if self._token is None:
+                delay = 0
+            else:
+                delay = max(self._token.expires_on - time.time() - self.refresh_margin, 0)
+            await asyncio.sleep(delay)
+
+            try:
+                await self._fetch_token(force=True)
+            except Exception:
+                logger.exception("Background token refresh failed, retrying in 30s")
+                await asyncio.sleep(30)
+
+    async def start(self):
+        """Prefetch the token and start the background refresher."""
+        if self.uses_api_key or self._refresh_task is not None:
+            return
+        try:
+            await self._fetch_token()
+        except Exception:
+            logger.exception("Token prefetch failed; requests will fetch on demand")
+        self._refresh_task = asyncio.create_task(self._refresh_loop())
+
+    async def close(self):
+        """Stop the refresher and release the credential."""
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            try:
+                await self._refresh_task
+            except asyncio.CancelledError:
+                pass
+            self._refresh_task = None
+        if self._embedding_client is not None:
+            await self._embedding_client.close()
+            self._embedding_client = None
+        if self._credential is not None:
+            self._credential.close()
+            self._credential = None
+
+    def stats(self):
+        """Pool size, reuse and token counters for the health endpoint."""
+        return {
+            "clients": len(self._clients),
+            "client_requests": self.client_requests,
+            "client_reuses": self.client_reuses,
+            "token_fetches": self.token_fetches,
+            "token_failures": self.token_failures,
+            "token_waits": self.token_waits,
+            "token_expires_in": int(self._token.expires_on - time.time()) if self._token else None,
+        }
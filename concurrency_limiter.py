@@ -0,0 +1,365 @@
+"""
+Concurrency Limiter
+===================
+Adaptive per-deployment concurrency for model calls. Every task runs four
+participants and most of them default to the same deployment, so a burst of
+tasks overruns the deployment's rate limit. The 429s then fail whole tasks.
+``ConcurrencyLimitMiddleware`` sits in front of every chat client and keeps
+one ``DeploymentLimiter`` per deployment:
+
+- a call runs only while fewer than ``limit`` calls to its deployment are in
+  flight and, with a tokens-per-minute budget, while the last minute's tokens
+  are under it; other calls wait, served round-robin across tasks so one
+  large task cannot starve the rest
+- the limit grows by about one per limit's worth of successful calls made
+  while it was the bottleneck (additive increase), and halves on a 429 or
+  shrinks by a tenth on a call slower than ``latency_target``
+  (multiplicative decrease). Only calls started after the last decrease can
+  decrease it again, so one burst of 429s counts once
+- a throttled call pauses the deployment for its Retry-After and goes back
+  into the queue, up to ``max_retries`` times and while the call's attempt
+  budget lasts (see ``hedging``), instead of failing its task
+
+Limits, in-flight calls, queue depth, tokens per minute, throttles and queue
+wait are served on ``/api/health`` and ``/api/metrics``.
+"""
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+
+from agent_framework import ChatMiddleware, UsageContent
+
+from hedging import take_attempt
+from task_metrics import Histogram, current_trace, prometheus_labels, render_header, render_histogram
+
+logger = logging.getLogger(__name__)
+
+# Seconds a deployment is paused after a 429 that gives no Retry-After
+DEFAULT_RETRY_AFTER = 1.0
+
+# Limit multipliers on a 429 and on a call over the latency target
+THROTTLE_DECREASE = 0.5
+LATENCY_DECREASE = 0.9
+
+TOKEN_WINDOW_SECONDS = 60
+
+
+def throttle_delay(error):
+    """Seconds to wait if ``error`` (or an error it was raised from) is a 429, else None"""
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        response = getattr(error, "response", None)
+        status = getattr(error, "status_code", None) or getattr(response, "status_code", None)
+        if status == 429:
+            retry_after = getattr(error, "retry_after", None)
+            headers = getattr(response, "headers", None)
+            if retry_after is None and headers is not None:
+                retry_after = headers.get("retry-after-ms")
+                retry_after = float(retry_after) / 1000 if retry_after else headers.get("retry-after")
+            try:
+                return max(float(retry_after), 0) if retry_after is not None else DEFAULT_RETRY_AFTER
+            except ValueError:
+                return DEFAULT_RETRY_AFTER
+        error = error.__cause__ or error.__context__
+    return None
+
+
+def parse_limits(spec):
+    """Per-deployment limits from "gpt-4o=150000,gpt-4o-mini=400000" """
+    limits = {}
+    for item in (spec or "").split(","):
+        name, _, value = item.partition("=")
+        if name.strip() and value.strip():
+            limits[name.strip()] = int(value)
+    return limits
+
+
+class DeploymentLimiter:
+    """AIMD concurrency limit, token budget and fair wait queue of one deployment"""
+
+    def __init__(self, initial=8, min_limit=1, max_limit=64, tpm_limit=None, latency_target=None):
+        self.limit = float(min(max(initial, min_limit), max_limit))
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.tpm_limit = tpm_limit
+        self.latency_target = latency_target
+        self.in_flight = 0
+        # task -> waiting futures, served round-robin
+        self._waiting = OrderedDict()
+        self._tokens = deque()
+        self._token_total = 0
+        self._paused_until = 0.0
+        self._last_decrease = 0.0
+        self._wake_handle = None
+
+        self.calls = 0
+        self.throttled = 0
+        self.slow = 0
+        self.increases = 0
+        self.decreases = 0
+        self.wait = Histogram()
+
+    @property
+    def queued(self):
+        return sum(len(waiters) for waiters in self._waiting.values())
+
+    def tokens_last_minute(self):
+        cutoff = time.monotonic() - TOKEN_WINDOW_SECONDS
+        while self._tokens and self._tokens[0][0] < cutoff:
+            self._token_total -= self._tokens.popleft()[1]
+        return self._token_total
+
+    def _blocked_for(self):
+        """Seconds until calls may start again, 0 if they may start now"""
+        now = time.monotonic()
+        if self._paused_until > now:
+            return self._paused_until - now
+        if self.tpm_limit and self.tokens_last_minute() >= self.tpm_limit:
+            return self._tokens[0][0] + TOKEN_WINDOW_SECONDS - now
+        return 0
+
+    def _can_start(self):
+        return self.in_flight < max(int(self.limit), self.min_limit) and self._blocked_for() == 0
+
+    async def acquire(self, task_key=None):
+        """Wait for a slot; returns the seconds waited"""
+        start = time.monotonic()
+        if not self._waiting and self._can_start():
+            self.in_flight += 1
+            self.wait.observe(0)
+            return 0
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiting.setdefault(task_key, deque()).append(waiter)
+        self._wake()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # Granted a slot as it was cancelled; hand it on
+                self.in_flight -= 1
+                self._wake()
+            else:
+                self._forget(task_key, waiter)
+            raise
+        waited = time.monotonic() - start
+        self.wait.observe(waited)
+        return waited
+
+    def _forget(self, task_key, waiter):
+        waiters = self._waiting.get(task_key)
+        if waiters is not None and waiter in waiters:
+            waiters.remove(waiter)
+            if not waiters:
+                del self._waiting[task_key]
+
+    def _wake(self):
+        """Grant slots to waiting calls, one task at a time"""
+        while self._waiting and self._can_start():
+            task_key, waiters = next(iter(self._waiting.items()))
+            waiter = waiters.popleft()
+            if waiters:
+                self._waiting.move_to_end(task_key)
+            else:
+                del self._waiting[task_key]
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+        blocked_for = self._blocked_for()
+        if self._waiting and blocked_for > 0 and self._wake_handle is None:
+            # Nothing in flight will finish to wake the queue; wake it when the pause ends
+            self._wake_handle = asyncio.get_running_loop().call_later(blocked_for, self._timed_wake)
+
+    def _timed_wake(self):
+        self._wake_handle = None
+        self._wake()
+
+    def release(self, started_at=None, outcome="ok", latency=None, tokens=0, retry_after=None):
+        """Free a slot and adapt the limit; outcome is "ok", "throttled" or "error" """
+        self.in_flight -= 1
+        self.calls += 1
+        if tokens:
+            self._tokens.append((time.monotonic(), tokens))
+            self._token_total += tokens
+
+        # Calls started before the last decrease saw the old limit; they do not decrease it again
+        fresh = started_at is None or started_at > self._last_decrease
+        if outcome == "throttled":
+            self.throttled += 1
+            self._paused_until = max(self._paused_until, time.monotonic() + (retry_after or 0))
+            if fresh:
+                self._decrease(THROTTLE_DECREASE)
+        elif outcome == "ok":
+            if self.latency_target and latency is not None and latency > self.latency_target:
+                self.slow += 1
+                if fresh:
+                    self._decrease(LATENCY_DECREASE)
+            elif self.in_flight + 1 + self.queued >= int(self.limit) and self.limit < self.max_limit:
+                # The limit was the bottleneck: grow by about one per limit's worth of calls
+                self.limit = min(self.limit + 1 / self.limit, self.max_limit)
+                self.increases += 1
+        self._wake()
+
+    def _decrease(self, factor):
+        self.limit = max(self.limit * factor, self.min_limit)
+        self._last_decrease = time.monotonic()
+        self.decreases += 1
+
+    def stats(self):
+        return {
+            "limit": round(self.limit, 2),
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "tokens_last_minute": self.tokens_last_minute(),
+            "tpm_limit": self.tpm_limit,
+            "calls": self.calls,
+            "throttled": self.throttled,
+            "slow": self.slow,
+            "mean_wait_ms": round(self.wait.total / self.wait.count * 1000, 1) if self.wait.count else None,
+        }
+
+
+def _call_tokens(usage):
+    if usage is None:
+        return 0
+    return usage.total_token_count or (usage.input_token_count or 0) + (usage.output_token_count or 0)
+
+
+class ConcurrencyLimitMiddleware(ChatMiddleware):
+    """Chat middleware that runs each call within its deployment's adaptive limit.
+
+    ``tpm_limits`` maps deployments to tokens-per-minute budgets;
+    ``latency_target`` (seconds, None for none) is compared with the full
+    time of non-streaming calls and the time to first update of streaming
+    ones. ``max_concurrency`` of 0 turns limiting off.
+    """
+
+    def __init__(self, initial=8, min_limit=1, max_concurrency=64, tpm_limits=None, latency_target=None, max_retries=3):
+        self.initial = initial
+        self.min_limit = min_limit
+        self.max_concurrency = max_concurrency
+        self.tpm_limits = tpm_limits or {}
+        self.latency_target = latency_target
+        self.max_retries = max_retries
+        self.limiters = {}
+        self.retries = {}
+
+    def limiter_for(self, deployment):
+        limiter = self.limiters.get(deployment)
+        if limiter is None:
+            limiter = self.limiters[deployment] = DeploymentLimiter(
+                initial=self.initial,
+                min_limit=self.min_limit,
+                max_limit=self.max_concurrency,
+                tpm_limit=self.tpm_limits.get(deployment),
+                latency_target=self.latency_target,
+            )
+        return limiter
+
+    async def process(self, context, next):
+        if self.max_concurrency <= 0:
+            await next(context)
+            return
+        deployment = str(
+            getattr(context.chat_client, "backend_name", None)
+            or context.chat_options.model_id
+            or getattr(context.chat_client, "model_id", None)
+        )
+        limiter = self.limiter_for(deployment)
+        trace = current_trace.get()
+        task_key = trace.task_id if trace is not None else None
+
+        if context.is_streaming:
+            # The call runs while the stream is read; hold the slot until it ends
+            context.result = self._limit_stream(limiter, deployment, task_key, context, next)
+            return
+
+        for attempt in range(self.max_retries + 1):
+            await limiter.acquire(task_key)
+            started_at = time.monotonic()
+            try:
+                await next(context)
+            except Exception as e:
+                retry_after = throttle_delay(e)
+                limiter.release(started_at, "throttled" if retry_after is not None else "error", retry_after=retry_after)
+                if retry_after is None or attempt == self.max_retries or not take_attempt():
+                    raise
+                self._count_retry(deployment, retry_after)
+                continue
+            except BaseException:
+                limiter.release(started_at, "error")
+                raise
+            usage = getattr(context.result, "usage_details", None)
+            limiter.release(started_at, "ok", time.monotonic() - started_at, _call_tokens(usage))
+            return
+
+    async def _limit_stream(self, limiter, deployment, task_key, context, next):
+        for attempt in range(self.max_retries + 1):
+            await limiter.acquire(task_key)
+            started_at = time.monotonic()
+            first_update_at = None
+            usage = None
+            outcome = "error"
+            retry_after = None
+            try:
+                await next(context)
+                async for update in context.result:
+                    if first_update_at is None:
+                        first_update_at = time.monotonic()
+                    for content in update.contents or ():
+                        if isinstance(content, UsageContent):
+                            usage = content.details
+                    yield update
+                outcome = "ok"
+                return
+            except Exception as e:
+                retry_after = throttle_delay(e)
+                if retry_after is None:
+                    raise
+                outcome = "throttled"
+                # Text already sent cannot be taken back, so only a stream that sent nothing is retried
+                if first_update_at is not None or attempt == self.max_retries or not take_attempt():
+                    raise
+                self._count_retry(deployment, retry_after)
+            finally:
+                latency = first_update_at - started_at if first_update_at is not None else None
+                limiter.release(started_at, outcome, latency, _call_tokens(usage), retry_after)
+
+    def _count_retry(self, deployment, retry_after):
+        logger.info(f"Deployment {deployment} throttled the call; retrying in {retry_after:.2f}s")
+        self.retries[deployment] = self.retries.get(deployment, 0) + 1
+
+    def stats(self):
+        """Limit, in-flight calls and queue depth per deployment, for the health endpoint"""
+        deployments = {}
+        for deployment, limiter in sorted(self.limiters.items()):
+            deployments[deployment] = dict(limiter.stats(), retried=self.retries.get(deployment, 0))
+        return {"enabled": self.max_concurrency > 0, "deployments": deployments}
+
+    def render_prometheus(self):
+        lines = []
+        gauges = (
+            ("magentic_deployment_concurrency_limit", "Calls allowed in flight per deployment", lambda limiter: round(limiter.limit, 3)),
+            ("magentic_deployment_in_flight", "Model calls in flight per deployment", lambda limiter: limiter.in_flight),
+            ("magentic_deployment_queue_depth", "Model calls waiting for a slot per deployment", lambda limiter: limiter.queued),
+            ("magentic_deployment_tokens_per_minute", "Tokens used in the last minute per deployment", lambda limiter: limiter.tokens_last_minute()),
+        )
+        for name, help_text, value in gauges:
+            render_header(lines, name, "gauge", help_text)
+            for deployment, limiter in sorted(self.limiters.items()):
+                lines.append(f"{name}{prometheus_labels(deployment=deployment)} {value(limiter)}")
+
+        render_header(lines, "magentic_deployment_throttled_total", "counter", "Model calls answered with 429 per deployment")
+        for deployment, limiter in sorted(self.limiters.items()):
+            lines.append(f"magentic_deployment_throttled_total{prometheus_labels(deployment=deployment)} {limiter.throttled}")
+        render_header(lines, "magentic_deployment_throttle_retries_total", "counter", "Throttled model calls queued again per deployment")
+        for deployment, count in sorted(self.retries.items()):
+            lines.append(f"magentic_deployment_throttle_retries_total{prometheus_labels(deployment=deployment)} {count}")
+        render_header(lines, "magentic_deployment_queue_wait_seconds", "histogram", "Time model calls waited for a slot per deployment")
+        for deployment, limiter in sorted(self.limiters.items()):
+            render_histogram(lines, "magentic_deployment_queue_wait_seconds", limiter.wait, deployment=deployment)
+        return "\n".join(lines) + "\n"
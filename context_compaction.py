@@ -0,0 +1,223 @@
+"""
+Context Compaction
+==================
+Token-budgeted conversation context for long runs. Every manager call resends
+the whole shared conversation, and every agent call resends the agent's own
+history, so prompt size and latency grow with every round.
+``ContextCompactionMiddleware`` sits between the workflow and the chat clients.
+It fits the messages of each call into the budget of the participant making
+it:
+
+- system messages, the first other message (the task, or the agent's first
+  hand-off), the current task ledger and the most recent messages are sent
+  as they are
+- older messages, oldest first, lose their code blocks. Any that are still
+  large are cut down to the lines that share a term with the task ledger or
+  the first message
+- if that is not enough, the oldest of them are folded: each becomes a stub
+  that still shows who spoke, and one note ahead of them keeps only their
+  fact lines
+
+Messages are compacted in steps of ``COMPACTION_STEP``, and the terms facts
+are matched against only change with the ledger, so the compacted start of
+the conversation stays byte-identical from one call to the next and the
+provider's prompt cache keeps matching it. Only what is sent changes; the
+workflow's own conversation, and so its checkpoints, keep every message.
+Estimated prompt tokens before and after compaction are recorded on the task
+trace.
+"""
+
+import logging
+import re
+
+from agent_framework import ChatMessage, ChatMiddleware, Role, TextContent
+
+from task_metrics import AGENT_EXECUTOR_PREFIX, current_executor, current_trace
+
+logger = logging.getLogger(__name__)
+
+# Most recent messages of a call that are never compacted
+KEEP_RECENT = 4
+
+# Older messages are compacted this many at a time, so the compacted prefix changes rarely
+COMPACTION_STEP = 8
+
+# Size an older message is cut down to, and the size of the note that replaces folded ones
+STALE_MESSAGE_TOKENS = 300
+FACT_NOTE_TOKENS = 800
+
+# Text of the task ledger message the manager adds to the conversation
+LEDGER_MARKER = "Here is the plan to follow"
+
+# Words too common to tie a line to the ledger
+STOP_WORDS = frozenset((
+    "about", "above", "after", "again", "their", "there", "these", "those", "which", "while",
+    "would", "could", "should", "other", "being", "every", "first", "please", "based", "following",
+    "request", "answer", "address", "working", "team", "member", "members", "provide",
+))
+
+_CODE_BLOCK_PATTERN = re.compile(r"```.*?(?:```|$)", re.DOTALL)
+_TERM_PATTERN = re.compile(r"[a-z][a-z0-9_-]{4,}|\d[\d,.]*%?")
+
+
+def message_tokens(message):
+    """Rough size of a message: about four characters per token, plus framing"""
+    return len(message.text or "") // 4 + 4
+
+
+def _text_only(message):
+    return all(isinstance(content, TextContent) for content in message.contents)
+
+
+def _terms(text):
+    return {term.rstrip(".,") for term in _TERM_PATTERN.findall(text.lower())} - STOP_WORDS
+
+
+def reference_terms(messages, first):
+    """Terms of the latest task ledger and the first message, which older facts must share"""
+    text = [messages[first].text or ""]
+    for message in reversed(messages):
+        if LEDGER_MARKER in (message.text or ""):
+            text.append(message.text)
+            break
+    return _terms("\n".join(text))
+
+
+def strip_code_blocks(text):
+    def omitted(match):
+        return f"[code block of {match.group(0).count(chr(10)) + 1} lines omitted]"
+    return _CODE_BLOCK_PATTERN.sub(omitted, text)
+
+
+def fact_lines(text, terms):
+    """Lines of ``text`` outside code blocks that share a term with ``terms``"""
+    lines = []
+    for line in strip_code_blocks(text).splitlines():
+        line = line.strip()
+        if line and not line.startswith("[code block") and _terms(line) & terms:
+            lines.append(line[:400])
+    return lines
+
+
+def _take(lines, limit):
+    kept, size = [], 0
+    for line in lines:
+        size += len(line) // 4 + 1
+        if size > limit:
+            break
+        kept.append(line)
+    return kept
+
+
+def shrink_message(message, terms, limit=STALE_MESSAGE_TOKENS):
+    """Copy of an older message without code blocks, cut down to its fact lines if still over ``limit``"""
+    text = strip_code_blocks(message.text or "")
+    if len(text) // 4 > limit:
+        original = message_tokens(message)
+        kept = _take(fact_lines(text, terms), limit) or [text[:limit * 4]]
+        text = "\n".join(kept) + f"\n[compacted from about {original} tokens]"
+    return ChatMessage(role=message.role, text=text, author_name=message.author_name)
+
+
+def stub_message(message):
+    """Placeholder for a folded message that keeps its role and author"""
+    return ChatMessage(role=message.role, text="[omitted]", author_name=message.author_name)
+
+
+def fact_note(messages, terms, limit=FACT_NOTE_TOKENS):
+    """Note with the fact lines of folded ``messages``"""
+    lines = []
+    for message in messages:
+        author = message.author_name or str(message.role)
+        lines.extend(f"- {author}: {line}" for line in fact_lines(message.text or "", terms))
+    kept = _take(lines, limit)
+    header = f"[{len(messages)} earlier messages omitted to fit the context budget"
+    text = header + ("; facts they held:]\n" + "\n".join(kept) if kept else "]")
+    return ChatMessage(role=Role.USER, text=text)
+
+
+def compact_messages(messages, budget, keep_recent=KEEP_RECENT):
+    """Messages fitted into ``budget`` tokens where possible.
+
+    Returns (messages, estimated tokens before, estimated tokens after); the
+    input list is returned unchanged when it already fits or ``budget`` is 0.
+    """
+    sizes = [message_tokens(message) for message in messages]
+    before = total = sum(sizes)
+    if budget <= 0 or total <= budget:
+        return messages, before, before
+
+    first = next((index for index, message in enumerate(messages) if message.role != Role.SYSTEM), 0)
+    terms = reference_terms(messages, first)
+    stale = [
+        index for index, message in enumerate(messages[:len(messages) - keep_recent])
+        if index > first and message.role != Role.SYSTEM and _text_only(message)
+        and LEDGER_MARKER not in (message.text or "")
+    ]
+
+    # Each pass stops within budget, at a multiple of COMPACTION_STEP messages
+    compacted = list(messages)
+    for count, index in enumerate(stale):
+        if total <= budget and count % COMPACTION_STEP == 0:
+            break
+        compacted[index] = shrink_message(compacted[index], terms)
+        total += message_tokens(compacted[index]) - sizes[index]
+        sizes[index] = message_tokens(compacted[index])
+
+    folded = []
+    for index in stale:
+        if total <= budget and len(folded) % COMPACTION_STEP == 0:
+            break
+        folded.append(index)
+        compacted[index] = stub_message(messages[index])
+        total += message_tokens(compacted[index]) - sizes[index]
+    if folded:
+        note = fact_note([messages[index] for index in folded], terms)
+        compacted.insert(folded[0], note)
+        total += message_tokens(note)
+    if total >= before:
+        # Short messages do not shrink; send the conversation as it was
+        return messages, before, before
+    return compacted, before, total
+
+
+def parse_budgets(spec):
+    """Per-participant budgets from "manager=16000,coder=8000" """
+    budgets = {}
+    for item in (spec or "").split(","):
+        name, _, value = item.partition("=")
+        if name.strip() and value.strip():
+            budgets[name.strip()] = int(value)
+    return budgets
+
+
+class ContextCompactionMiddleware(ChatMiddleware):
+    """Chat middleware that fits each call's messages into its participant's token budget.
+
+    ``budget`` applies to every participant without an entry in ``budgets``
+    (participant name, or "manager", to tokens); 0 turns compaction off.
+    """
+
+    def __init__(self, budget=12000, budgets=None, keep_recent=KEEP_RECENT):
+        self.budget = budget
+        self.budgets = budgets or {}
+        self.keep_recent = keep_recent
+
+    def budget_for(self, participant):
+        return self.budgets.get(participant, self.budget)
+
+    async def process(self, context, next):
+        executor_id = current_executor.get()
+        if executor_id and executor_id.startswith(AGENT_EXECUTOR_PREFIX):
+            participant = executor_id[len(AGENT_EXECUTOR_PREFIX):]
+        else:
+            participant = "manager"
+
+        messages, before, after = compact_messages(context.messages, self.budget_for(participant), self.keep_recent)
+        if after < before:
+            logger.debug(f"Compacted {participant} context from ~{before} to ~{after} tokens")
+            context.messages = messages
+        trace = current_trace.get()
+        if trace is not None:
+            trace.record_context(before, after, executor_id)
+        await next(context)
@@ -0,0 +1,374 @@
+"""
+Endpoint Balancer
+=================
+Load balancing and failover of a model id across Azure OpenAI endpoints.
+Every client otherwise talks to the one endpoint in the .env file, so a slow
+or exhausted region takes the whole service down. ``EndpointBalancer`` sits
+in front of the concurrency limiter and sends each call for a model id with
+configured endpoints to one of them:
+
+- ``least_outstanding`` balancing picks the endpoint with the fewest calls in
+  flight; ``latency`` balancing weighs that by each endpoint's recent latency
+  (time to first update for streaming calls)
+- a call that fails with a transient error or a 429 that outlasted the
+  limiter's retries is counted against its endpoint and tried on the next
+  one, while the call's attempt budget lasts (see ``hedging``). Streaming
+  calls only fail over before their first update
+- ``failure_threshold`` failures in a row eject an endpoint (the circuit
+  opens) for ``cooldown`` seconds. After that one probe call is let through:
+  success re-admits it, failure ejects it again for twice as long, up to
+  ``max_cooldown``. With every endpoint ejected, calls go to the one due back
+  first rather than fail. An endpoint whose probe is in flight gets no other
+  calls; when it is the only one left, calls wait for the probe to end
+
+Endpoints are configured per model id with ``load_endpoints``. Their state,
+calls in flight, latency and ejections are served on ``/api/health``,
+``/api/models`` and ``/api/metrics``.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+from collections import deque
+from urllib.parse import urlparse
+
+from agent_framework import ChatMiddleware
+
+from concurrency_limiter import throttle_delay
+from hedging import is_transient, percentile, take_attempt
+from task_metrics import prometheus_labels, render_header
+
+logger = logging.getLogger(__name__)
+
+BALANCING = ("least_outstanding", "latency")
+
+# Circuit states of an endpoint
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+# Weight of the newest call in an endpoint's latency average
+LATENCY_ALPHA = 0.2
+
+# Latencies kept per endpoint for its reported percentiles
+LATENCY_WINDOW = 200
+
+
+def load_endpoints(spec):
+    """Endpoints per model id from a JSON file path or inline JSON.
+
+    The JSON maps model ids to lists of endpoints, each an endpoint URL or an
+    object with ``endpoint``, ``deployment`` (default: the model id) and
+    ``api_key_env`` (the environment variable holding that resource's key).
+    Other keys are kept as the endpoint's ``options``.
+    """
+    if not spec:
+        return {}
+    if os.path.exists(spec):
+        with open(spec, encoding="utf-8") as f:
+            config = json.load(f)
+    else:
+        config = json.loads(spec)
+
+    endpoints = {}
+    for model_id, entries in config.items():
+        endpoints[model_id] = []
+        for entry in entries:
+            if isinstance(entry, str):
+                entry = {"endpoint": entry}
+            entry = dict(entry)
+            endpoints[model_id].append(Endpoint(
+                entry.pop("endpoint"),
+                entry.pop("deployment", model_id),
+                api_key_env=entry.pop("api_key_env", None),
+                options=entry,
+            ))
+    return endpoints
+
+
+def should_fail_over(error):
+    """Whether ``error`` says more about the endpoint than about the call"""
+    return is_transient(error) or throttle_delay(error) is not None
+
+
+class Endpoint:
+    """One deployment on one endpoint, with its circuit breaker and call statistics"""
+
+    def __init__(self, url, deployment, api_key_env=None, options=None):
+        self.url = url
+        self.deployment = deployment
+        self.api_key_env = api_key_env
+        self.options = options or {}
+        self.name = f"{deployment}@{urlparse(url).hostname or url}"
+
+        self.state = CLOSED
+        self.failures_in_row = 0
+        self.open_until = 0.0
+        self.cooldown = None
+        self.outstanding = 0
+        # Set when the next call in flight ends, for calls waiting on a probe
+        self.call_ended = None
+        self.latency = None
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+
+        self.calls = 0
+        self.failures = 0
+        self.ejections = 0
+        self.readmissions = 0
+
+    def available(self, now):
+        """Whether a call may go here, moving an ejected endpoint to half-open once its cooldown is over"""
+        if self.state == OPEN and now >= self.open_until:
+            self.state = HALF_OPEN
+            logger.info(f"Endpoint {self.name} cooled down; probing it")
+        if self.state == HALF_OPEN:
+            # One probe at a time
+            return self.outstanding == 0
+        return self.state == CLOSED
+
+    @property
+    def probing(self):
+        """Whether the endpoint's probe call is in flight"""
+        return self.state == HALF_OPEN and self.outstanding > 0
+
+    async def wait_call_end(self):
+        if self.call_ended is None:
+            self.call_ended = asyncio.Event()
+        await self.call_ended.wait()
+
+    def start(self):
+        self.outstanding += 1
+        self.calls += 1
+        return time.monotonic()
+
+    def _ended(self):
+        self.outstanding -= 1
+        if self.call_ended is not None:
+            self.call_ended.set()
+            self.call_ended = None
+
+    def succeeded(self, latency):
+        self._ended()
+        self.failures_in_row = 0
+        if latency is not None:
+            self.latencies.append(latency)
+            self.latency = latency if self.latency is None else self.latency + LATENCY_ALPHA * (latency - self.latency)
+        if self.state != CLOSED:
+            self.state = CLOSED
+            self.cooldown = None
+            self.readmissions += 1
+            logger.info(f"Endpoint {self.name} re-admitted")
+
+    def failed(self, threshold, cooldown, max_cooldown):
+        self._ended()
+        self.failures += 1
+        self.failures_in_row += 1
+        if self.state == HALF_OPEN or (self.state == CLOSED and self.failures_in_row >= threshold):
+            self.cooldown = cooldown if self.cooldown is None else min(self.cooldown * 2, max_cooldown)
+            self.state = OPEN
+            self.open_until = time.monotonic() + self.cooldown
+            self.ejections += 1
+            logger.warning(f"Endpoint {self.name} ejected for {self.cooldown:.0f}s after {self.failures_in_row} failures in a row")
+
+    def abandoned(self):
+        """The call ended without an outcome (cancelled, or an error that was the call's own)"""
+        self._ended()
+
+    def stats(self):
+        return {
+            "endpoint": self.url,
+            "deployment": self.deployment,
+            "state": self.state,
+            "outstanding": self.outstanding,
+            "calls": self.calls,
+            "failures": self.failures,
+            "ejections": self.ejections,
+            "readmissions": self.readmissions,
+            "retry_in_s": round(max(self.open_until - time.monotonic(), 0), 1) if self.state == OPEN else None,
+            "latency_ms": round(self.latency * 1000, 1) if self.latency is not None else None,
+            "p95_ms": round(percentile(self.latencies, 95) * 1000, 1) if self.latencies else None,
+        }
+
+
+class EndpointBalancer(ChatMiddleware):
+    """Chat middleware that balances each model id's calls over its endpoints.
+
+    ``endpoints`` maps model ids to ``Endpoint`` lists; calls for other model
+    ids pass through. ``backend_client(chat_client, endpoint)`` returns the
+    client that calls an endpoint, which should carry only the middleware
+    after this one. The balancer names it ``endpoint.name`` through its
+    ``backend_name`` attribute, so the concurrency limiter keeps each
+    endpoint apart.
+    """
+
+    def __init__(self, endpoints=None, balancing="least_outstanding", failure_threshold=3, cooldown=30.0,
+                 max_cooldown=300.0, backend_client=None):
+        if balancing not in BALANCING:
+            raise ValueError(f"Unknown balancing '{balancing}' (expected one of {', '.join(BALANCING)})")
+        self.endpoints = endpoints or {}
+        self.balancing = balancing
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.backend_client = backend_client
+        self.failovers = {}
+
+    def pick(self, model_id, tried=()):
+        """Endpoint for the next call to ``model_id``, skipping ``tried``.
+
+        None when the endpoints left are all being probed (or all were tried).
+        """
+        candidates = [endpoint for endpoint in self.endpoints[model_id] if endpoint not in tried]
+        if not candidates:
+            return None
+        now = time.monotonic()
+        available = [endpoint for endpoint in candidates if endpoint.available(now)]
+        if not available:
+            # Everything is ejected; the endpoint due back first is the best bet, but a probe stays alone
+            due = [endpoint for endpoint in candidates if not endpoint.probing]
+            return min(due, key=lambda endpoint: endpoint.open_until) if due else None
+        return min(available, key=lambda endpoint: (self._score(endpoint), random.random()))
+
+    async def _next_endpoint(self, model_id, tried):
+        """``pick``, waiting for a probe to settle while only probed endpoints are left"""
+        while True:
+            endpoint = self.pick(model_id, tried)
+            if endpoint is not None:
+                return endpoint
+            waits = [
+                asyncio.ensure_future(endpoint.wait_call_end())
+                for endpoint in self.endpoints[model_id] if endpoint not in tried and endpoint.probing
+            ]
+            try:
+                await asyncio.wait(waits, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                for wait in waits:
+                    wait.cancel()
+
+    def _score(self, endpoint):
+        if self.balancing == "latency":
+            # Endpoints without a latency yet score 0, so each gets a first call
+            return (endpoint.outstanding + 1) * (endpoint.latency or 0)
+        return endpoint.outstanding
+
+    def _client(self, chat_client, endpoint):
+        client = self.backend_client(chat_client, endpoint)
+        client.backend_name = endpoint.name
+        return client
+
+    def _failed(self, model_id, endpoint, error):
+        endpoint.failed(self.failure_threshold, self.cooldown, self.max_cooldown)
+        self.failovers[model_id] = self.failovers.get(model_id, 0) + 1
+        logger.warning(f"Call to {endpoint.name} failed ({error}); failing over")
+
+    async def process(self, context, next):
+        model_id = str(context.chat_options.model_id or getattr(context.chat_client, "model_id", None))
+        if not self.endpoints.get(model_id) or self.backend_client is None:
+            await next(context)
+            return
+        if context.is_streaming:
+            context.result = self._balanced_stream(context, model_id)
+            return
+
+        tried = []
+        while True:
+            endpoint = await self._next_endpoint(model_id, tried)
+            tried.append(endpoint)
+            client = self._client(context.chat_client, endpoint)
+            started_at = endpoint.start()
+            try:
+                context.result = await client.get_response(
+                    list(context.messages), chat_options=context.chat_options, **context.kwargs
+                )
+            except Exception as e:
+                if not should_fail_over(e):
+                    endpoint.abandoned()
+                    raise
+                self._failed(model_id, endpoint, e)
+                if len(tried) == len(self.endpoints[model_id]) or not take_attempt():
+                    raise
+                continue
+            except BaseException:
+                endpoint.abandoned()
+                raise
+            endpoint.succeeded(time.monotonic() - started_at)
+            return
+
+    async def _balanced_stream(self, context, model_id):
+        tried = []
+        while True:
+            endpoint = await self._next_endpoint(model_id, tried)
+            tried.append(endpoint)
+            client = self._client(context.chat_client, endpoint)
+            started_at = endpoint.start()
+            latency = None
+            outcome = None
+            try:
+                stream = client.get_streaming_response(
+                    list(context.messages), chat_options=context.chat_options, **context.kwargs
+                )
+                async for update in stream:
+                    if latency is None:
+                        latency = time.monotonic() - started_at
+                    yield update
+                outcome = "ok"
+                return
+            except Exception as e:
+                if not should_fail_over(e):
+                    raise
+                outcome = "failed"
+                self._failed(model_id, endpoint, e)
+                # Text already sent cannot be taken back, so only a stream that sent nothing fails over
+                if latency is not None or len(tried) == len(self.endpoints[model_id]) or not take_attempt():
+                    raise
+            finally:
+                if outcome == "ok":
+                    endpoint.succeeded(latency)
+                elif outcome is None:
+                    endpoint.abandoned()
+
+    def describe(self, model_id):
+        """Endpoints of ``model_id`` and their state, for the models endpoint"""
+        return [
+            {"name": endpoint.name, "deployment": endpoint.deployment, "state": endpoint.state}
+            for endpoint in self.endpoints.get(model_id, ())
+        ]
+
+    def stats(self):
+        """State, calls in flight and latency per endpoint of each model id, for the health endpoint"""
+        return {
+            "balancing": self.balancing,
+            "models": {
+                model_id: {
+                    "failovers": self.failovers.get(model_id, 0),
+                    "endpoints": {endpoint.name: endpoint.stats() for endpoint in endpoints},
+                }
+                for model_id, endpoints in sorted(self.endpoints.items())
+            },
+        }
+
+    def render_prometheus(self):
+        lines = []
+        endpoints = [(model_id, endpoint) for model_id, group in sorted(self.endpoints.items()) for endpoint in group]
+        gauges = (
+            ("magentic_endpoint_up", "1 while an endpoint takes calls, 0.5 while it is probed, 0 while ejected",
+             lambda endpoint: {CLOSED: 1, HALF_OPEN: 0.5, OPEN: 0}[endpoint.state]),
+            ("magentic_endpoint_outstanding", "Model calls in flight per endpoint", lambda endpoint: endpoint.outstanding),
+            ("magentic_endpoint_latency_seconds", "Recent average model call latency per endpoint",
+             lambda endpoint: round(endpoint.latency or 0, 6)),
+        )
+        for name, help_text, value in gauges:
+            render_header(lines, name, "gauge", help_text)
+            for model_id, endpoint in endpoints:
+                lines.append(f"{name}{prometheus_labels(model=model_id, endpoint=endpoint.name)} {value(endpoint)}")
+        counters = (
+            ("magentic_endpoint_calls_total", "Model calls sent per endpoint", lambda endpoint: endpoint.calls),
+            ("magentic_endpoint_failures_total", "Model calls failed over per endpoint", lambda endpoint: endpoint.failures),
+            ("magentic_endpoint_ejections_total", "Times an endpoint was ejected", lambda endpoint: endpoint.ejections),
+        )
+        for name, help_text, value in counters:
+            render_header(lines, name, "counter", help_text)
+            for model_id, endpoint in endpoints:
+                lines.append(f"{name}{prometheus_labels(model=model_id, endpoint=endpoint.name)} {value(endpoint)}")
+        return "\n".join(lines) + "\n"
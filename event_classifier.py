@@ -0,0 +1,114 @@
+"""
+Event Text Classifier
+=====================
+Keyword matching for the activity log. The keywords the tracker looks for are
+grouped once at import time (agent names in the event source, research and
+calculation vocabulary in agent messages, reviewer critique words). Each text
+is lower-cased once and checked against every group it needs, and the result is
+the set of groups that occur anywhere in it, exactly as the individual
+``keyword in text.lower()`` checks used to report. Message texts are only
+classified when an agent branch actually needs them.
+"""
+
+from functools import lru_cache
+
+# Groups checked against the agent or executor that produced an event
+EVENT_KEYWORDS = {
+    "agent_researcher": ("researcher",),
+    "agent_coder": ("coder",),
+    "agent_reviewer": ("reviewer",),
+    "agent_manager": ("manager",),
+    "agent_orchestrator": ("orchestrator",),
+    "tool_use": ("tool", "code"),
+}
+
+# Groups checked against agent messages
+MESSAGE_KEYWORDS = {
+    # Researcher findings, in order of precedence
+    "market": ("market", "industry", "sector", "company", "companies"),
+    "data": ("data", "statistics", "number", "figure", "percent"),
+    "trend": ("trend", "growth", "increase", "decrease", "change"),
+    "comparison": ("compare", "comparison", "versus", "vs", "difference"),
+
+    # Coder operations, in order of precedence
+    "calculation": ("=", "result", "answer", "equals"),
+    "cagr": ("cagr", "compound", "growth rate"),
+    "roi": ("roi", "return on investment", "payback"),
+    "summation": ("sum", "total", "add"),
+    "statistics": ("average", "mean", "median"),
+    "percentage": ("percent", "%", "percentage"),
+    "python": ("python",),
+    "code": ("code",),
+    "analysis": ("analyze", "analysis", "examine"),
+
+    # Reviewer critique
+    "critique": ("however", "concern", "gap", "missing", "assumption", "validate", "suggest", "recommend", "issue", "question"),
+}
+
+# Groups matched against the original text rather than the lower-cased one
+CASE_SENSITIVE_GROUPS = {"calculation"}
+
+
+def compile_groups(keywords):
+    """Flatten a keyword table into (group, keywords, case_sensitive) tuples"""
+    return tuple((group, tuple(words), group in CASE_SENSITIVE_GROUPS) for group, words in keywords.items())
+
+
+EVENT_GROUPS = compile_groups(EVENT_KEYWORDS)
+MESSAGE_GROUPS = compile_groups(MESSAGE_KEYWORDS)
+
+
+def classify(text, groups=EVENT_GROUPS):
+    """Return the set of ``groups`` that have a keyword in ``text``"""
+    if not text:
+        return frozenset()
+
+    lower = text.lower()
+    found = set()
+    for group, keywords, case_sensitive in groups:
+        haystack = text if case_sensitive else lower
+        for keyword in keywords:
+            if keyword in haystack:
+                found.add(group)
+                break
+    return frozenset(found)
+
+
+@lru_cache(maxsize=1024)
+def classify_message(text):
+    """Message groups for ``text``; cached, since a message is checked by several agents"""
+    return classify(text, MESSAGE_GROUPS)
+
+
+def research_analysis_type(groups):
+    """Analysis type and topic for a researcher message, or ("Information", None)"""
+    if "market" in groups:
+        return "Market Research", "market_analysis"
+    if "data" in groups:
+        return "Data Analysis", "data_research"
+    if "trend" in groups:
+        return "Trend Analysis", "trend_research"
+    if "comparison" in groups:
+        return "Comparative Analysis", "comparative_research"
+    return "Information", None
+
+
+def coder_operation_type(groups):
+    """Operation type for a coder message and whether it is a calculation"""
+    if "calculation" in groups:
+        if "cagr" in groups:
+            return "CAGR Calculation", True
+        if "roi" in groups:
+            return "ROI Analysis", True
+        if "summation" in groups:
+            return "Summation", True
+        if "statistics" in groups:
+            return "Statistical Analysis", True
+        if "percentage" in groups:
+            return "Percentage Calculation", True
+        return "Calculation", True
+    if "python" in groups or "code" in groups:
+        return "Code Execution", False
+    if "analysis" in groups:
+        return "Data Analysis", False
+    return "Processing", False
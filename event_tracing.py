@@ -0,0 +1,79 @@
+"""
+Workflow Event Tracing
+======================
+Opt-in debug tracing of workflow events. Agent identity is read from the typed
+attributes the framework sets on each event, never from the event's string
+form. Full per-event dumps are only built for traced requests: those that send
+the ``X-Magentic-Trace`` header, a random sample set by
+``MAGENTIC_TRACE_SAMPLE_RATE``, or every request while the ``magentic.trace``
+logger is at DEBUG level.
+"""
+
+import json
+import logging
+import os
+import random
+import uuid
+
+logger = logging.getLogger("magentic.trace")
+
+TRACE_HEADER = "X-Magentic-Trace"
+
+# Fraction of untagged requests to trace, 0.0 - 1.0
+TRACE_SAMPLE_RATE = float(os.getenv("MAGENTIC_TRACE_SAMPLE_RATE", "0"))
+
+# Events logged per traced run
+TRACE_MAX_EVENTS = int(os.getenv("MAGENTIC_TRACE_MAX_EVENTS", "200"))
+
+# Typed attributes that name the agent or executor behind an event, most specific first
+SOURCE_ATTRIBUTES = ("source", "agent_name", "agent_id", "executor_id", "orchestrator_id", "source_executor_id")
+
+
+def event_source(event):
+    """Name of the agent or executor that produced ``event``, or None"""
+    for attribute in SOURCE_ATTRIBUTES:
+        value = getattr(event, attribute, None)
+        if value:
+            return str(value)
+    return None
+
+
+def should_trace(header_value=None, sample_rate=TRACE_SAMPLE_RATE):
+    """Decide once per request whether its events are traced"""
+    if header_value is not None:
+        return header_value.strip().lower() in ("1", "true", "yes", "on")
+    if logger.isEnabledFor(logging.DEBUG):
+        return True
+    return sample_rate > 0 and random.random() < sample_rate
+
+
+def _summarize(value, limit=200):
+    if isinstance(value, (bool, int, float)):
+        return value
+    text = value if isinstance(value, str) else repr(value)
+    return text if len(text) <= limit else f"{text[:limit]}... ({len(text)} chars)"
+
+
+class EventTracer:
+    """Logs one JSON record per workflow event for a traced run"""
+
+    def __init__(self, max_events=TRACE_MAX_EVENTS):
+        self.trace_id = uuid.uuid4().hex[:12]
+        self.max_events = max_events
+        self.count = 0
+
+    def trace(self, event, source=None, message=None):
+        self.count += 1
+        if self.count > self.max_events:
+            return
+
+        fields = getattr(event, "__dict__", {})
+        record = {
+            "trace_id": self.trace_id,
+            "seq": self.count,
+            "event": event.__class__.__name__,
+            "source": source,
+            "message": _summarize(message) if message else None,
+            "fields": {name: _summarize(value) for name, value in fields.items() if value is not None},
+        }
+        logger.info(json.dumps(record, ensure_ascii=False))
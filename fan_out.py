@@ -0,0 +1,254 @@
+"""
+Fan-Out Orchestration
+=====================
+A parallel orchestration mode for the Magentic workflow. The standard manager
+hands the task to one participant per round, so independent steps (say,
+researching market returns while the coder computes a payback period) still
+run one after another. Here the progress ledger may also list instructions
+for other participants that do not depend on the next speaker's result; the
+orchestrator then sends the whole batch in one message, every agent in it
+runs in the same superstep, and the next round starts once all of them have
+replied, with each reply merged into the manager's conversation.
+
+Build the workflow with ``FanOutMagenticBuilder`` and a ``FanOutMagenticManager``
+and call ``manager.configure_fan_out(True)`` before a run to enable batches;
+with fan-out off the workflow behaves exactly like the standard one.
+"""
+
+import logging
+from dataclasses import dataclass, field
+
+from agent_framework import AgentRunResponse, ChatMessage, MagenticBuilder, Role, WorkflowContext, handler
+from agent_framework._workflows._magentic import (
+    MAGENTIC_MANAGER_NAME,
+    ORCH_MSG_KIND_INSTRUCTION,
+    ORCHESTRATOR_PROGRESS_LEDGER_PROMPT,
+    GroupChatBuilder,
+    MagenticAgentExecutor,
+    MagenticOrchestratorExecutor,
+    _extract_json,
+    _MagenticRequestMessage,
+    _MagenticResponseMessage,
+    group_chat_orchestrator,
+    participant_description,
+)
+
+from round_budget import BudgetedMagenticManager
+from task_metrics import current_executor
+
+logger = logging.getLogger(__name__)
+
+# Progress ledger prompt that also asks for instructions that can run in parallel
+FAN_OUT_PROGRESS_LEDGER_PROMPT = ORCHESTRATOR_PROGRESS_LEDGER_PROMPT.replace(
+    "\nPlease output an answer",
+    """    - Which other team members can work at the same time as the next speaker? Only include steps that
+      do not need the next speaker's result or each other's, at most one instruction per team member, and
+      leave the list empty when the remaining steps depend on each other.
+
+Please output an answer""",
+).replace(
+    '        "answer": string\n    }}\n}}',
+    '        "answer": string\n    }},\n'
+    '    "parallel_instructions": [\n'
+    '        {{"agent": string (select from: {names}), "instruction": string}}\n'
+    "    ]\n}}",
+)
+
+
+@dataclass
+class FanOutRequest:
+    """Instructions for several agents, keyed by participant name, to run in one superstep"""
+
+    instructions: dict[str, str] = field(default_factory=dict)
+    task_context: str = ""
+
+
+class FanOutMagenticManager(BudgetedMagenticManager):
+    """Budgeted manager whose progress ledger can add a batch of parallel instructions.
+
+    After ``create_progress_ledger`` the batch, if any, is in ``batch``: the
+    next speaker's instruction first, then the independent ones.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.sequential_progress_ledger_prompt = self.progress_ledger_prompt
+        self.configure_fan_out(False)
+
+    def configure_fan_out(self, enabled):
+        """Turn parallel batches on or off for the next run and clear per-run state"""
+        self.parallel = enabled
+        self.progress_ledger_prompt = FAN_OUT_PROGRESS_LEDGER_PROMPT if enabled else self.sequential_progress_ledger_prompt
+        self.batch = None
+        self.batches = 0
+        self.batched_turns = 0
+        self._last_reply = None
+
+    async def _complete(self, messages):
+        # Keep the raw reply; the framework's ledger model drops unknown fields
+        self._last_reply = await super()._complete(messages)
+        return self._last_reply
+
+    async def create_progress_ledger(self, magentic_context):
+        self.batch = None
+        ledger = await super().create_progress_ledger(magentic_context)
+        if self.parallel and not ledger.is_request_satisfied.answer:
+            self.batch = self._parse_batch(ledger, magentic_context.participant_descriptions)
+            if self.batch is not None:
+                self.batches += 1
+                self.batched_turns += len(self.batch)
+        return ledger
+
+    def _parse_batch(self, ledger, participants):
+        try:
+            extra = _extract_json(self._last_reply.text).get("parallel_instructions") or []
+        except Exception:
+            return None
+
+        batch = {str(ledger.next_speaker.answer): str(ledger.instruction_or_question.answer)}
+        for item in extra if isinstance(extra, list) else []:
+            if not isinstance(item, dict):
+                continue
+            name, instruction = str(item.get("agent", "")).strip(), item.get("instruction")
+            if name in participants and name not in batch and instruction:
+                batch[name] = str(instruction)
+        return batch if len(batch) > 1 else None
+
+    def on_checkpoint_save(self):
+        state = super().on_checkpoint_save()
+        state["fan_out"] = {"parallel": self.parallel, "batches": self.batches, "batched_turns": self.batched_turns}
+        return state
+
+    def on_checkpoint_restore(self, state):
+        super().on_checkpoint_restore(state)
+        fan_out = state.get("fan_out")
+        if fan_out:
+            # A resumed run keeps the orchestration mode it started with
+            self.configure_fan_out(fan_out["parallel"])
+            self.batches, self.batched_turns = fan_out["batches"], fan_out["batched_turns"]
+
+
+class _BatchingContext:
+    """Orchestrator context that sends the manager's batch in place of a single agent request"""
+
+    def __init__(self, orchestrator, context):
+        self._orchestrator = orchestrator
+        self._context = context
+
+    def __getattr__(self, name):
+        return getattr(self._context, name)
+
+    async def send_message(self, message, target_id=None):
+        manager = self._orchestrator._manager
+        batch, manager.batch = getattr(manager, "batch", None), None
+        if batch is None or not isinstance(message, _MagenticRequestMessage):
+            await self._context.send_message(message, target_id=target_id)
+            return
+        await self._orchestrator._send_batch(self._context, message, batch)
+
+
+class FanOutOrchestratorExecutor(MagenticOrchestratorExecutor):
+    """Magentic orchestrator that can run a batch of agents in one superstep.
+
+    Each agent in a batch replies separately, so the orchestrator is invoked
+    once per reply; only the last one runs the next round.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._pending_replies = 0
+
+    async def _run_inner_loop(self, context):
+        if self._pending_replies > 1:
+            # The reply is already in the chat history; wait for the rest of the batch
+            self._pending_replies -= 1
+            return
+        self._pending_replies = 0
+        if not isinstance(context, _BatchingContext):
+            context = _BatchingContext(self, context)
+        await super()._run_inner_loop(context)
+
+    async def _send_batch(self, context, request, batch):
+        # The next speaker's instruction is already in the chat history
+        for name, instruction in batch.items():
+            if name == request.agent_name:
+                continue
+            message = ChatMessage(role=Role.ASSISTANT, text=instruction, author_name=MAGENTIC_MANAGER_NAME)
+            self._context.chat_history.append(message)
+            await self._emit_orchestrator_message(context, message, ORCH_MSG_KIND_INSTRUCTION)
+
+        logger.info(f"Fan-out: running {', '.join(batch)} in parallel")
+        self._pending_replies = len(batch)
+        await context.send_message(FanOutRequest(instructions=batch, task_context=request.task_context))
+
+    async def on_checkpoint_save(self):
+        state = await super().on_checkpoint_save()
+        state["pending_replies"] = self._pending_replies
+        return state
+
+    async def on_checkpoint_restore(self, state):
+        await super().on_checkpoint_restore(state)
+        self._pending_replies = int(state.get("pending_replies", 0))
+
+
+class FanOutAgentExecutor(MagenticAgentExecutor):
+    """Magentic agent executor that also takes its part of a ``FanOutRequest``"""
+
+    def can_handle(self, message):
+        # Agents left out of a batch are not invoked at all
+        if isinstance(message.data, FanOutRequest) and self._agent_id not in message.data.instructions:
+            return False
+        return super().can_handle(message)
+
+    @handler
+    async def handle_fan_out_request(
+        self, message: FanOutRequest, context: WorkflowContext[_MagenticResponseMessage, AgentRunResponse]
+    ) -> None:
+        request = _MagenticRequestMessage(
+            agent_name=self._agent_id,
+            instruction=message.instructions[self._agent_id],
+            task_context=message.task_context,
+        )
+        await self.handle_request_message(request, context)
+
+    async def _invoke_agent(self, ctx):
+        # Agents of a batch run side by side; model calls are attributed by executor
+        current_executor.set(self.id)
+        return await super()._invoke_agent(ctx)
+
+
+class FanOutMagenticBuilder(MagenticBuilder):
+    """``MagenticBuilder`` that wires the fan-out orchestrator and agent executors"""
+
+    def build(self):
+        if not self._participants:
+            raise ValueError("No participants added to Magentic workflow")
+        if self._manager is None:
+            raise ValueError("No manager configured. Call with_standard_manager(...) before build().")
+
+        descriptions = {
+            name: participant_description(participant, f"Agent {name}")
+            for name, participant in self._participants.items()
+        }
+        manager = self._manager
+
+        def orchestrator_factory(wiring):
+            return FanOutOrchestratorExecutor(
+                manager=manager,
+                participants=descriptions,
+                require_plan_signoff=self._enable_plan_review,
+                executor_id="magentic_orchestrator",
+            )
+
+        def participant_factory(spec, wiring):
+            agent_executor = FanOutAgentExecutor(spec.participant, spec.name)
+            wiring.orchestrator.register_agent_executor(spec.name, agent_executor)
+            return (agent_executor,)
+
+        group_builder = GroupChatBuilder(
+            _orchestrator_factory=group_chat_orchestrator(orchestrator_factory),
+            _participant_factory=participant_factory,
+        ).participants(self._participants)
+        if self._checkpoint_storage is not None:
+            group_builder = group_builder.with_checkpointing(self._checkpoint_storage)
+        return group_builder.build()
@@ -0,0 +1,369 @@
+"""
+Hedged Calls
+============
+Tail-latency control for model calls. A Magentic round waits for its one
+speaker, so a single slow completion stalls the whole task. ``HedgingMiddleware``
+sits between the prompt-shaping middleware and the concurrency limiter:
+
+- a call that fails with a transient error (connection error, timeout, 408
+  or 5xx) is retried after a jittered exponential backoff; 429s are left to
+  the concurrency limiter
+- with hedging on, a call that has not finished after the ``percentile`` of
+  recent latencies for its deployment gets a duplicate, sent to the
+  deployment's alternate if one is configured, and the first response wins.
+  The other is cancelled. Streaming calls race to their first update, since
+  text already sent cannot be taken back; non-streaming calls race to
+  completion
+
+Each error class has one layer that retries it:
+
+- 429: the concurrency limiter waits out the Retry-After and queues the call
+  again; once it gives up, the endpoint balancer fails over
+- connection errors, timeouts, 408 and 5xx: the endpoint balancer fails over
+  to the model id's next endpoint, and this middleware retries with backoff
+  (through the balancer again)
+- anything else fails the call. The OpenAI SDK's own retries are off
+
+On top of the per-layer limits, ``max_attempts`` caps the upstream attempts
+of one call across all of them: retries, re-queued 429s, failovers and hedges
+each claim one from the call's ``AttemptBudget`` and are skipped once it is
+spent, so one failing call cannot multiply into a retry storm.
+
+Hedge rates, retries and latency percentiles per deployment are served on
+``/api/health`` and ``/api/metrics``; ``bench_hedging.py`` measures the tail
+latency saved against the same load with hedging off.
+"""
+
+import asyncio
+import contextvars
+import copy
+import logging
+import math
+import random
+import time
+from collections import deque
+
+from agent_framework import ChatMiddleware
+from openai import APIConnectionError
+
+from task_metrics import prometheus_labels, render_header
+
+logger = logging.getLogger(__name__)
+
+# Status codes worth retrying; 429s are retried by the concurrency limiter
+TRANSIENT_STATUS = frozenset((408, 500, 502, 503, 504))
+
+# Latencies kept per deployment and call type, for thresholds and reporting
+LATENCY_WINDOW = 1000
+
+REPORTED_PERCENTILES = (50, 95, 99)
+
+# Attempt budget of the model call being made, shared by every layer that retries it
+call_attempts = contextvars.ContextVar("call_attempts", default=None)
+
+
+class AttemptBudget:
+    """Upstream attempts one model call may make, the first one included"""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 1
+
+    def take(self):
+        """Claim one more attempt; False once the call has used them all"""
+        if self.used >= self.limit:
+            return False
+        self.used += 1
+        return True
+
+
+def take_attempt():
+    """Claim another attempt for the current call; calls without a budget are not capped"""
+    budget = call_attempts.get()
+    return budget is None or budget.take()
+
+
+def _budgeted(budget):
+    """A copy of the current context in which ``budget`` is the call's attempt budget"""
+    context = contextvars.copy_context()
+    context.run(call_attempts.set, budget)
+    return context
+
+
+def is_transient(error):
+    """Whether ``error`` (or an error it was raised from) is worth retrying"""
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        if isinstance(error, (APIConnectionError, asyncio.TimeoutError, ConnectionError)):
+            return True
+        response = getattr(error, "response", None)
+        status = getattr(error, "status_code", None) or getattr(response, "status_code", None)
+        if status in TRANSIENT_STATUS:
+            return True
+        error = error.__cause__ or error.__context__
+    return False
+
+
+def backoff_delay(attempt, base, cap):
+    """Full-jitter exponential backoff for retry ``attempt`` (0 for the first retry)"""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of ``values``, or None if empty"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(math.ceil(pct / 100 * len(ordered)), 1) - 1]
+
+
+def parse_alternates(spec):
+    """Alternate deployments from "gpt-4o=gpt-4o-mini,gpt-4=gpt-4o" """
+    alternates = {}
+    for item in (spec or "").split(","):
+        name, _, alternate = item.partition("=")
+        if name.strip() and alternate.strip():
+            alternates[name.strip()] = alternate.strip()
+    return alternates
+
+
+class CallStats:
+    """Latencies, hedges and retries of one deployment and call type"""
+
+    def __init__(self):
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.calls = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+
+
+class HedgingMiddleware(ChatMiddleware):
+    """Chat middleware that retries transient failures and hedges slow calls.
+
+    ``enabled`` turns hedging on; retries always apply. A call is hedged once
+    it has run for the ``percentile`` of its deployment's recent latencies
+    (at least ``min_delay`` seconds, and only after ``min_samples`` calls).
+    ``alternates`` maps deployments to the deployment their hedges go to, and
+    ``hedge_client(chat_client, deployment)`` returns the client for it;
+    without one, hedges go to the same deployment. ``max_attempts`` caps the
+    upstream attempts of each call across every retrying layer.
+    """
+
+    def __init__(self, enabled=False, percentile=95, min_samples=20, min_delay=0.25, alternates=None,
+                 hedge_client=None, max_retries=2, retry_base=0.2, retry_cap=5.0, max_attempts=4):
+        self.enabled = enabled
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.alternates = alternates or {}
+        self.hedge_client = hedge_client
+        self.max_retries = max_retries
+        self.retry_base = retry_base
+        self.retry_cap = retry_cap
+        self.max_attempts = max_attempts
+        # (deployment, "stream" or "response") -> CallStats
+        self.calls = {}
+        self.retries = {}
+
+    def _stats(self, deployment, streaming):
+        key = (deployment, "stream" if streaming else "response")
+        stats = self.calls.get(key)
+        if stats is None:
+            stats = self.calls[key] = CallStats()
+        return stats
+
+    def hedge_delay(self, stats):
+        """Seconds after which a call is hedged, or None if it is not"""
+        if not self.enabled or len(stats.latencies) < self.min_samples:
+            return None
+        return max(percentile(stats.latencies, self.percentile), self.min_delay)
+
+    async def _retry_wait(self, deployment, attempt, error):
+        delay = backoff_delay(attempt, self.retry_base, self.retry_cap)
+        logger.info(f"Transient failure on {deployment} ({error}); retrying in {delay:.2f}s")
+        self.retries[deployment] = self.retries.get(deployment, 0) + 1
+        await asyncio.sleep(delay)
+
+    async def process(self, context, next):
+        deployment = str(context.chat_options.model_id or getattr(context.chat_client, "model_id", None))
+        stats = self._stats(deployment, context.is_streaming)
+        if context.is_streaming:
+            context.result = self._hedged_stream(context, next, deployment, stats)
+            return
+
+        start = time.monotonic()
+        budget = AttemptBudget(self.max_attempts)
+        primary = asyncio.create_task(self._respond(context, next, deployment), context=_budgeted(budget))
+        attempts = [primary]
+        try:
+            done, _ = await asyncio.wait(attempts, timeout=self.hedge_delay(stats))
+            if not done and budget.take():
+                stats.hedged += 1
+                attempts.append(asyncio.create_task(self._respond_hedge(context, next, deployment), context=_budgeted(budget)))
+            winner = await _first_success(attempts)
+        finally:
+            for attempt in attempts:
+                await _cancel(attempt)
+        self._record(stats, start, winner is not primary)
+        context.result = winner.result()
+
+    async def _respond(self, context, next, deployment):
+        """The call's response, retried on transient failures"""
+        for attempt in range(self.max_retries + 1):
+            attempt_context = copy.copy(context)
+            try:
+                await next(attempt_context)
+                return attempt_context.result
+            except Exception as e:
+                if attempt == self.max_retries or not is_transient(e) or not take_attempt():
+                    raise
+                await self._retry_wait(deployment, attempt, e)
+
+    async def _respond_hedge(self, context, next, deployment):
+        alternate = self.alternates.get(deployment)
+        if alternate is None or self.hedge_client is None:
+            return await self._respond(context, next, deployment)
+        client = self.hedge_client(context.chat_client, alternate)
+        return await client.get_response(list(context.messages), chat_options=context.chat_options, **context.kwargs)
+
+    async def _stream(self, context, next, deployment):
+        """The call's updates; retried on transient failures until the first update arrives"""
+        for attempt in range(self.max_retries + 1):
+            attempt_context = copy.copy(context)
+            started = False
+            try:
+                await next(attempt_context)
+                async for update in attempt_context.result:
+                    started = True
+                    yield update
+                return
+            except Exception as e:
+                if started or attempt == self.max_retries or not is_transient(e) or not take_attempt():
+                    raise
+                await self._retry_wait(deployment, attempt, e)
+
+    def _stream_hedge(self, context, next, deployment):
+        alternate = self.alternates.get(deployment)
+        if alternate is None or self.hedge_client is None:
+            return self._stream(context, next, deployment)
+        client = self.hedge_client(context.chat_client, alternate)
+        return client.get_streaming_response(list(context.messages), chat_options=context.chat_options, **context.kwargs)
+
+    async def _hedged_stream(self, context, next, deployment, stats):
+        start = time.monotonic()
+        # Retries happen before the first update, so only the first-update tasks need the budget
+        budget = AttemptBudget(self.max_attempts)
+        streams = [self._stream(context, next, deployment)]
+        attempts = [asyncio.create_task(_first_update(streams[0]), context=_budgeted(budget))]
+        try:
+            done, _ = await asyncio.wait(attempts, timeout=self.hedge_delay(stats))
+            if not done and budget.take():
+                stats.hedged += 1
+                streams.append(self._stream_hedge(context, next, deployment))
+                attempts.append(asyncio.create_task(_first_update(streams[1]), context=_budgeted(budget)))
+            winner = await _first_success(attempts)
+            index = attempts.index(winner)
+            # The loser stops here, so only the winner holds a concurrency slot
+            for attempt, stream in zip(attempts, streams):
+                if attempt is not winner:
+                    await _close(attempt, stream)
+            self._record(stats, start, index > 0)
+
+            update = winner.result()
+            if update is _END:
+                return
+            yield update
+            async for update in streams[index]:
+                yield update
+        finally:
+            for attempt, stream in zip(attempts, streams):
+                await _close(attempt, stream)
+
+    def _record(self, stats, start, hedge_won):
+        # Hedged calls are counted at the hedge delay or later, so hedging
+        # does not pull the percentile it is triggered by down
+        stats.latencies.append(time.monotonic() - start)
+        stats.calls += 1
+        if hedge_won:
+            stats.hedge_wins += 1
+
+    def stats(self):
+        """Hedge rate, retries and latency percentiles per deployment, for the health endpoint"""
+        deployments = {}
+        for (deployment, call_type), stats in sorted(self.calls.items()):
+            deployments.setdefault(deployment, {})[call_type] = {
+                "calls": stats.calls,
+                "hedged": stats.hedged,
+                "hedge_wins": stats.hedge_wins,
+                "hedge_rate": round(stats.hedged / stats.calls, 4) if stats.calls else 0.0,
+                "hedge_delay_ms": _ms(self.hedge_delay(stats)),
+                **{f"p{pct}_ms": _ms(percentile(stats.latencies, pct)) for pct in REPORTED_PERCENTILES},
+            }
+        for deployment, count in self.retries.items():
+            deployments.setdefault(deployment, {})["retries"] = count
+        return {"enabled": self.enabled, "percentile": self.percentile, "deployments": deployments}
+
+    def render_prometheus(self):
+        lines = []
+        render_header(lines, "magentic_hedge_calls_total", "counter", "Model calls by deployment, call type and whether they were hedged")
+        for (deployment, call_type), stats in sorted(self.calls.items()):
+            labels = dict(deployment=deployment, call=call_type)
+            lines.append(f"magentic_hedge_calls_total{prometheus_labels(**labels, hedged='false')} {stats.calls - stats.hedged}")
+            lines.append(f"magentic_hedge_calls_total{prometheus_labels(**labels, hedged='true')} {stats.hedged}")
+        render_header(lines, "magentic_hedge_wins_total", "counter", "Hedged model calls answered by the hedge")
+        for (deployment, call_type), stats in sorted(self.calls.items()):
+            lines.append(f"magentic_hedge_wins_total{prometheus_labels(deployment=deployment, call=call_type)} {stats.hedge_wins}")
+        render_header(lines, "magentic_call_retries_total", "counter", "Model calls retried after a transient failure")
+        for deployment, count in sorted(self.retries.items()):
+            lines.append(f"magentic_call_retries_total{prometheus_labels(deployment=deployment)} {count}")
+        render_header(lines, "magentic_call_latency_quantile_seconds", "gauge", "Recent model call latency percentiles per deployment")
+        for (deployment, call_type), stats in sorted(self.calls.items()):
+            for pct in REPORTED_PERCENTILES:
+                value = percentile(stats.latencies, pct)
+                if value is not None:
+                    labels = prometheus_labels(deployment=deployment, call=call_type, quantile=pct / 100)
+                    lines.append(f"magentic_call_latency_quantile_seconds{labels} {value:.6f}")
+        return "\n".join(lines) + "\n"
+
+
+# First-update result of a stream that ended without any update
+_END = object()
+
+
+async def _first_update(stream):
+    async for update in stream:
+        return update
+    return _END
+
+
+async def _first_success(attempts):
+    """The first attempt to finish without an error; raises the first attempt's error if all fail"""
+    pending = set(attempts)
+    while pending:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for attempt in attempts:
+            if attempt in done and attempt.exception() is None:
+                return attempt
+    attempts[0].result()
+
+
+async def _cancel(attempt):
+    """Cancel an attempt and wait for it to let go of its connection and concurrency slot"""
+    if not attempt.done():
+        attempt.cancel()
+        try:
+            await attempt
+        except asyncio.CancelledError:
+            pass
+
+
+async def _close(attempt, stream):
+    await _cancel(attempt)
+    aclose = getattr(stream, "aclose", None)
+    if aclose is not None:
+        await aclose()
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 1) if seconds is not None else None
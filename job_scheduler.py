@@ -0,0 +1,215 @@
+"""
+Magentic Job Scheduler
+======================
+Runs submitted tasks in the background on a fixed pool of asyncio workers fed
+by a bounded queue. Submitting returns a job id right away; callers poll the
+job for its status and result instead of holding a connection open for the
+whole run, and the worker count caps how many workflows run at once.
+"""
+
+import asyncio
+import logging
+import time
+import uuid
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    """Raised when a job is submitted while the queue is at capacity"""
+
+
+class Job:
+    """A submitted task and its lifecycle timestamps"""
+
+    def __init__(self, request):
+        self.id = uuid.uuid4().hex
+        self.request = request
+        self.status = "queued"
+        self.result = None
+        self.error = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.cancel_requested = False
+        self._task = None
+
+    @property
+    def finished(self):
+        return self.status in ("succeeded", "failed", "cancelled")
+
+    @property
+    def queue_wait_seconds(self):
+        """Time spent queued before a worker picked the job up"""
+        end = self.started_at or self.finished_at or time.time()
+        return round(end - self.submitted_at, 3)
+
+    @property
+    def run_seconds(self):
+        """Time spent running, so far or in total"""
+        if self.started_at is None:
+            return None
+        end = self.finished_at or time.time()
+        return round(end - self.started_at, 3)
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "error": self.error,
+            "submitted_at": self.submitted_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "queue_wait_seconds": self.queue_wait_seconds,
+            "run_seconds": self.run_seconds,
+        }
+
+
+class JobScheduler:
+    """Bounded queue of jobs drained by a fixed number of worker tasks.
+
+    ``run_job`` is awaited with the job's request and its return value is
+    stored as the job result. ``max_finished`` caps how many completed jobs
+    are kept for result lookups.
+    """
+
+    def __init__(self, run_job, workers=4, max_queue=50, max_finished=1000):
+        self._run_job = run_job
+        self.worker_count = workers
+        self.max_queue = max_queue
+        self.max_finished = max_finished
+
+        self._queue = None
+        self._workers = []
+        self._jobs = OrderedDict()
+
+        self.submitted = 0
+        self.rejected = 0
+        self.completed = 0
+        self.cancelled = 0
+        self.running = 0
+
+    async def start(self):
+        """Start the worker tasks"""
+        if self._workers:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._workers = [asyncio.create_task(self._worker(i)) for i in range(self.worker_count)]
+        logger.info(f"Job scheduler started with {self.worker_count} workers (queue limit {self.max_queue})")
+
+    async def stop(self):
+        """Cancel the workers along with any running jobs"""
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def submit(self, request):
+        """Queue a job for ``request`` and return it immediately"""
+        if self._queue is None:
+            raise RuntimeError("Job scheduler not started")
+
+        job = Job(request)
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise QueueFullError(f"Job queue is full ({self.max_queue} jobs waiting)")
+
+        self._jobs[job.id] = job
+        self.submitted += 1
+        self._prune_finished()
+        return job
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """Cancel a queued or running job. Returns False if it already finished."""
+        job = self._jobs.get(job_id)
+        if job is None or job.finished:
+            return False
+
+        job.cancel_requested = True
+        if job._task is not None:
+            job._task.cancel()
+        else:
+            self._mark_cancelled(job)
+            self._drop_cancelled()
+        return True
+
+    def _mark_cancelled(self, job):
+        job.status = "cancelled"
+        job.finished_at = time.time()
+        self.cancelled += 1
+
+    def _drop_cancelled(self):
+        """Take cancelled jobs out of the queue so their slots go to new submissions"""
+        waiting = []
+        while not self._queue.empty():
+            waiting.append(self._queue.get_nowait())
+            self._queue.task_done()
+        for job in waiting:
+            if not job.cancel_requested:
+                self._queue.put_nowait(job)
+
+    def _prune_finished(self):
+        """Drop the oldest finished jobs beyond ``max_finished``"""
+        finished = sum(1 for job in self._jobs.values() if job.finished)
+        for job_id in list(self._jobs):
+            if finished <= self.max_finished:
+                break
+            if self._jobs[job_id].finished:
+                del self._jobs[job_id]
+                finished -= 1
+
+    async def _worker(self, index):
+        while True:
+            job = await self._queue.get()
+            try:
+                if job.cancel_requested:
+                    continue
+                await self._run(job)
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job):
+        job.status = "running"
+        job.started_at = time.time()
+        job._task = asyncio.create_task(self._run_job(job.request))
+        self.running += 1
+        try:
+            job.result = await job._task
+            job.status = "succeeded"
+            self.completed += 1
+        except asyncio.CancelledError:
+            if not job.cancel_requested:
+                raise  # The scheduler is shutting down
+            self._mark_cancelled(job)
+            return
+        except Exception as e:
+            logger.exception(f"Job {job.id} failed")
+            job.status = "failed"
+            job.error = str(e)
+        finally:
+            self.running -= 1
+            job._task = None
+            if job.finished_at is None:
+                job.finished_at = time.time()
+
+        logger.info(f"Job {job.id} {job.status}: waited {job.queue_wait_seconds}s, ran {job.run_seconds}s")
+
+    def stats(self):
+        """Queue depth, worker usage and job counters"""
+        return {
+            "workers": self.worker_count,
+            "running": self.running,
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "max_queue": self.max_queue,
+            "submitted": self.submitted,
+            "rejected": self.rejected,
+            "completed": self.completed,
+            "cancelled": self.cancelled,
+            "tracked_jobs": len(self._jobs),
+        }
@@ -4,6 +4,43 @@ import axios from 'axios'
 import { Sparkles, Users, Play, Clock, CheckCircle, XCircle, Loader } from 'lucide-react'
 import './MagenticWorkflow.css'
 
+const AGENT_ICONS = { researcher: '🔍', coder: '💻', reviewer: '🔎', manager: '🎯' }
+
+// Reads a text/event-stream response and calls onEvent(type, data) for each frame
+async function readEventStream(response, onEvent) {
+  const reader = response.body.getReader()
+  const decoder = new TextDecoder()
+  let buffer = ''
+  while (true) {
+    const { value, done } = await reader.read()
+    if (done) break
+    buffer += decoder.decode(value, { stream: true })
+    let boundary
+    while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+      const frame = buffer.slice(0, boundary)
+      buffer = buffer.slice(boundary + 2)
+      let type = 'message'
+      const data = []
+      for (const line of frame.split('\n')) {
+        if (line.startsWith('event:')) type = line.slice(6).trim()
+        else if (line.startsWith('data:')) data.push(line.slice(5).trimStart())
+      }
+      // Heartbeats are comment frames without data
+      if (data.length) onEvent(type, JSON.parse(data.join('\n')))
+    }
+  }
+}
+
+// Appends a delta frame to the live output of its agent turn
+function appendDelta(turns, { agent, round, text }) {
+  const key = `${agent}-${round}`
+  const index = turns.findIndex(turn => turn.key === key)
+  if (index === -1) return [...turns, { key, agent, round, text }]
+  const next = [...turns]
+  next[index] = { ...next[index], text: next[index].text + text }
+  return next
+}
+
 function MagenticWorkflow() {
   const [task, setTask] = useState('')
   const [result, setResult] = useState(null)
@@ -11,6 +48,7 @@ function MagenticWorkflow() {
   const [error, setError] = useState(null)
   const [examples, setExamples] = useState([])
   const [activityLog, setActivityLog] = useState([])
+  const [liveOutput, setLiveOutput] = useState([])
   const [showActivityLog, setShowActivityLog] = useState(true)
   const [models, setModels] = useState([])
   const [researcherModel, setResearcherModel] = useState('gpt-4o')
@@ -69,42 +107,51 @@ function MagenticWorkflow() {
     setError(null)
     setResult(null)
     setActivityLog([])
+    setLiveOutput([])
     setShowActivityLog(true)
 
     // Add initial log entry
     addActivityLog('system', '🚀 Task submitted - Agents initializing...', '�')
 
     try {
-      const response = await axios.post('/api/execute', {
-        task: taskText,
-        max_rounds: 20,
-        researcher_model: researcherModel,
-        coder_model: coderModel,
-        manager_model: managerModel,
-        reviewer_model: reviewerModel
+      // Activity, token deltas and the result arrive as server-sent events while the agents work
+      const response = await fetch('/api/execute-stream', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({
+          task: taskText,
+          max_rounds: 20,
+          researcher_model: researcherModel,
+          coder_model: coderModel,
+          manager_model: managerModel,
+          reviewer_model: reviewerModel
+        })
       })
+      if (!response.ok) {
+        const body = await response.json().catch(() => ({}))
+        throw new Error(typeof body.detail === 'string' ? body.detail : `Request failed with status ${response.status}`)
+      }
 
-      if (response.data.status === 'success') {
-        // Clear the initial message and show REAL backend activity log
-        setActivityLog([])
-        
-        // Add all detailed backend activity logs
-        if (response.data.activity_log && response.data.activity_log.length > 0) {
-          response.data.activity_log.forEach(log => {
-            addActivityLog(log.type, log.message, log.icon)
-          })
-        } else {
-          // Fallback if no activity log
-          addActivityLog('system', '✅ Task completed successfully', '✅')
+      let completed = false
+      await readEventStream(response, (type, data) => {
+        if (type === 'delta') {
+          setLiveOutput(prev => appendDelta(prev, data))
+        } else if (type === 'activity') {
+          addActivityLog(data.type, data.message, data.icon)
+        } else if (type === 'result') {
+          completed = true
+          setResult(data.content)
+        } else if (type === 'error') {
+          completed = true
+          setError(data.message || 'Task execution failed')
+          addActivityLog('error', data.message || 'Task execution failed', '❌')
         }
-        
-        setResult(response.data.result)
-      } else {
-        setError(response.data.error || 'Task execution failed')
-        addActivityLog('error', response.data.error || 'Task execution failed', '❌')
+      })
+      if (!completed) {
+        throw new Error('Connection closed before the task finished')
       }
     } catch (err) {
-      const errorMsg = err.response?.data?.detail || err.message || 'Failed to execute task'
+      const errorMsg = err.message || 'Failed to execute task'
       setError(errorMsg)
       addActivityLog('error', errorMsg, '❌')
     } finally {
@@ -122,6 +169,7 @@ function MagenticWorkflow() {
     setResult(null)
     setError(null)
     setActivityLog([])
+    setLiveOutput([])
   }
 
   return (
@@ -265,6 +313,30 @@ function MagenticWorkflow() {
         </div>
       )}
 
+      {/* Live Agent Output, rendered as the agents stream it */}
+      {liveOutput.length > 0 && (
+        <div className="live-output-section">
+          <h3>
+            <Sparkles size={20} />
+            Live Agent Output
+          </h3>
+          <div className="live-output-content">
+            {liveOutput.map((turn, idx) => (
+              <div key={turn.key} className={`live-output-item ${turn.agent}`}>
+                <div className="live-output-header">
+                  <span className="activity-icon">{AGENT_ICONS[turn.agent] || '🤖'}</span>
+                  <span className="live-output-agent">{turn.agent}</span>
+                  <span className="live-output-round">Round {turn.round}</span>
+                </div>
+                <pre className={`live-output-text${loading && idx === liveOutput.length - 1 ? ' streaming' : ''}`}>
+                  {turn.text}
+                </pre>
+              </div>
+            ))}
+          </div>
+        </div>
+      )}
+
       {/* Activity Log */}
       {activityLog.length > 0 && (
         <div className="activity-log-section">
@@ -16,8 +16,7 @@ from agent_framework import (
     WorkflowEvent,
     WorkflowOutputEvent,
 )
-from agent_framework.azure import AzureOpenAIChatClient
-from azure.identity import DefaultAzureCredential
+from client_registry import ChatClientRegistry
 
 logging.basicConfig(level=logging.WARNING)  # Reduce noise for demo
 logger = logging.getLogger(__name__)
@@ -69,17 +68,17 @@ async def run_workflow(workflow, task: str, description: str):
         return False
 
 
-async def setup_agents():
+async def setup_agents(registry):
     """Create and return the specialized agents"""
-    credential = DefaultAzureCredential()
-    env_path = "c:\\E2EDemo\\.env"
+    # One shared chat client for the whole team
+    chat_client = registry.get_chat_client()
     
     # Researcher Agent - Good at finding information
     researcher = ChatAgent(
         name="ResearcherAgent",
         description="Information gathering and research specialist",
         instructions="You are a researcher who finds and synthesizes information. Be thorough and cite sources when possible.",
-        chat_client=AzureOpenAIChatClient(env_file_path=env_path, credential=credential),
+        chat_client=chat_client,
     )
     
     # Analyst Agent - Good at data analysis and computation
@@ -87,7 +86,7 @@ async def setup_agents():
         name="AnalystAgent",
         description="Data analysis and computational specialist",
         instructions="You analyze data using code and mathematics. Provide clear calculations and visualizations through code.",
-        chat_client=AzureOpenAIChatClient(env_file_path=env_path, credential=credential),
+        chat_client=chat_client,
         tools=HostedCodeInterpreterTool(),
     )
     
@@ -96,7 +95,7 @@ async def setup_agents():
         name="WriterAgent",
         description="Content creation and writing specialist",
         instructions="You create well-structured, clear, and engaging written content. Format professionally.",
-        chat_client=AzureOpenAIChatClient(env_file_path=env_path, credential=credential),
+        chat_client=chat_client,
     )
     
     # Manager Agent - Coordinates the team
@@ -104,7 +103,7 @@ async def setup_agents():
         name="ManagerAgent",
         description="Team coordinator and workflow manager",
         instructions="You coordinate agents to accomplish tasks efficiently. Break down complex tasks and delegate appropriately.",
-        chat_client=AzureOpenAIChatClient(env_file_path=env_path, credential=credential),
+        chat_client=chat_client,
     )
     
     return researcher, analyst, writer, manager
@@ -226,48 +225,52 @@ async def main():
     print("Showcasing AI agent collaboration for complex tasks")
     print("🌟" * 50 + "\n")
     
-    print("⚙️  Setting up specialized agents...\n")
-    researcher, analyst, writer, manager = await setup_agents()
-    print("✅ Agents ready!\n")
-    
-    # Run demos
-    demos = [
-        ("Quick Research (Fastest)", demo_4_quick_research(researcher, manager)),
-        ("Cost Calculator", demo_5_cost_calculator(analyst, manager)),
-        ("Math Analysis", demo_3_data_analysis(analyst, manager)),
-        ("Business Analysis", demo_1_business_analysis(researcher, analyst, manager)),
-        ("Technical Report (Most Complex)", demo_2_technical_report(researcher, analyst, writer, manager)),
-    ]
-    
-    print("\n📋 Running 5 demos to showcase different collaboration patterns...\n")
-    print("Note: Each demo demonstrates how agents work together based on their specializations\n")
-    
-    results = []
-    for demo_name, demo_coro in demos:
-        print(f"▶️  Starting: {demo_name}")
-        success = await demo_coro
-        results.append((demo_name, success))
+    # One credential and token refresher for the whole run, closed on the way out
+    registry = ChatClientRegistry(env_file_path="c:\\E2EDemo\\.env")
+    await registry.start()
+    try:
+        print("⚙️  Setting up specialized agents...\n")
+        researcher, analyst, writer, manager = await setup_agents(registry)
+        print("✅ Agents ready!\n")
+    
+        # Run demos
+        demos = [
+            ("Quick Research (Fastest)", demo_4_quick_research(researcher, manager)),
+            ("Cost Calculator", demo_5_cost_calculator(analyst, manager)),
+            ("Math Analysis", demo_3_data_analysis(analyst, manager)),
+            ("Business Analysis", demo_1_business_analysis(researcher, analyst, manager)),
+            ("Technical Report (Most Complex)", demo_2_technical_report(researcher, analyst, writer, manager)),
+        ]
+    
+        print("\n📋 Running 5 demos to showcase different collaboration patterns...\n")
+        print("Note: Each demo demonstrates how agents work together based on their specializations\n")
+    
+        results = []
+        for demo_name, demo_coro in demos:
+            print(f"▶️  Starting: {demo_name}")
+            success = await demo_coro
+            results.append((demo_name, success))
         
-        if demo_count < len(demos):
-            print("\n⏸️  Press Enter to continue to next demo...")
-            input()
-    
-    # Summary
-    print("\n" + "🎊" * 50)
-    print("DEMO SUMMARY")
-    print("🎊" * 50 + "\n")
-    
-    for demo_name, success in results:
-        status = "✅ SUCCESS" if success else "❌ FAILED"
-        print(f"{status} - {demo_name}")
-    
-    successful = sum(1 for _, success in results if success)
-    print(f"\n📊 Results: {successful}/{len(results)} demos completed successfully")
-    
-    print("\n" + "=" * 100)
-    print("🎯 KEY TAKEAWAYS:")
-    print("=" * 100)
-    print("""
+            if demo_count < len(demos):
+                print("\n⏸️  Press Enter to continue to next demo...")
+                input()
+    
+        # Summary
+        print("\n" + "🎊" * 50)
+        print("DEMO SUMMARY")
+        print("🎊" * 50 + "\n")
+    
+        for demo_name, success in results:
+            status = "✅ SUCCESS" if success else "❌ FAILED"
+            print(f"{status} - {demo_name}")
+    
+        successful = sum(1 for _, success in results if success)
+        print(f"\n📊 Results: {successful}/{len(results)} demos completed successfully")
+    
+        print("\n" + "=" * 100)
+        print("🎯 KEY TAKEAWAYS:")
+        print("=" * 100)
+        print("""
 1. 🤝 COLLABORATION: Multiple specialized agents working together
 2. 🎯 SPECIALIZATION: Each agent has specific skills (research, analysis, writing)
 3. 🧠 INTELLIGENCE: Manager agent orchestrates and delegates tasks
@@ -277,7 +280,9 @@ async def main():
 The Magentic pattern enables AI systems to work like human teams - 
 with specialized roles collaborating towards a common goal!
     """)
-    print("=" * 100 + "\n")
+        print("=" * 100 + "\n")
+    finally:
+        await registry.close()
 
 
 if __name__ == "__main__":
@@ -6,38 +6,205 @@ that can be used with a React frontend.
 """
 
 import asyncio
+import itertools
+import json
 import logging
-from typing import AsyncGenerator
-from fastapi import FastAPI, HTTPException
+import os
+from typing import AsyncGenerator, Literal, Optional
+from fastapi import FastAPI, Header, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
+from pydantic import BaseModel, Field, ValidationError
 from agent_framework import (
     ChatAgent,
     HostedCodeInterpreterTool,
-    MagenticBuilder,
+    MagenticAgentDeltaEvent,
     WorkflowEvent,
-    WorkflowOutputEvent,
 )
-from agent_framework.azure import AzureOpenAIChatClient
-from azure.identity import DefaultAzureCredential
-from contextlib import asynccontextmanager
+from contextlib import aclosing, asynccontextmanager
+from activity_tracker import ActivityTracker, iter_activity_json
+from batch_scheduler import BatchScheduler, parse_batch
+from cancellation import Cancellations, ClientDisconnected, deadline_after, time_left
+from client_registry import ChatClientRegistry
+from concurrency_limiter import ConcurrencyLimitMiddleware, parse_limits
+from context_compaction import ContextCompactionMiddleware, parse_budgets
+from endpoint_balancer import EndpointBalancer, load_endpoints
+from event_tracing import EventTracer, should_trace
+from fan_out import FanOutMagenticBuilder, FanOutMagenticManager
+from hedging import HedgingMiddleware, parse_alternates
+from job_scheduler import JobScheduler, QueueFullError
+from model_routing import ModelRouter, load_policy
+from offline_chat_client import LatencyModel, OfflineChatClient
+from prompt_cache import PromptMemoMiddleware
+from result_cache import ResultCache
+from round_budget import adaptive_round_limit, find_manager
+from single_flight import SingleFlight
+from sse import SSE_HEADERS, SSEWriter, with_heartbeats
+from task_checkpoints import TaskCheckpointStorage, decode_checkpoint
+from task_metrics import TaskMetrics, UsageMiddleware, current_trace, install_retry_counter
+from task_store import TaskStore
+from token_stream import DeltaCoalescer
+from workflow_pool import WorkflowPool
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Per-round and per-agent spans of recent runs, served by /api/metrics and /api/traces
+task_metrics = TaskMetrics(max_traces=int(os.getenv("MAGENTIC_METRICS_MAX_TRACES", "500")))
+
+# Attributes every model call's tokens to the span of the task that made it
+usage_middleware = UsageMiddleware()
+install_retry_counter()
+
+# Fits the conversation sent by each participant into a token budget (0 turns compaction off)
+context_middleware = ContextCompactionMiddleware(
+    budget=int(os.getenv("MAGENTIC_CONTEXT_BUDGET", "12000")),
+    budgets=parse_budgets(os.getenv("MAGENTIC_CONTEXT_BUDGETS")),
+)
+
+# Answers the manager's fact-sheet and plan calls for an identical task from memory (0 entries turns it off)
+prompt_memo = PromptMemoMiddleware(
+    max_entries=int(os.getenv("MAGENTIC_PROMPT_MEMO_SIZE", "256")),
+    ttl_seconds=float(os.getenv("MAGENTIC_PROMPT_MEMO_TTL_SECONDS", "3600")),
+)
+
+# Adapts the calls each deployment runs at once to its 429s and latency (a max of 0 turns it off)
+concurrency_limiter = ConcurrencyLimitMiddleware(
+    initial=int(os.getenv("MAGENTIC_CONCURRENCY_INITIAL", "8")),
+    max_concurrency=int(os.getenv("MAGENTIC_CONCURRENCY_MAX", "64")),
+    tpm_limits=parse_limits(os.getenv("MAGENTIC_TPM_LIMITS")),
+    latency_target=float(os.getenv("MAGENTIC_CONCURRENCY_LATENCY_TARGET_MS", "0")) / 1000 or None,
+    max_retries=int(os.getenv("MAGENTIC_THROTTLE_RETRIES", "3")),
+)
+
+# Retries transient failures, and with hedging on duplicates calls slower than
+# the deployment's recent percentile, to the alternate deployment if one is set
+call_hedging = HedgingMiddleware(
+    enabled=os.getenv("MAGENTIC_HEDGING", "0") == "1",
+    percentile=float(os.getenv("MAGENTIC_HEDGE_PERCENTILE", "95")),
+    min_delay=float(os.getenv("MAGENTIC_HEDGE_MIN_DELAY_MS", "250")) / 1000,
+    alternates=parse_alternates(os.getenv("MAGENTIC_HEDGE_ALTERNATES")),
+    hedge_client=lambda client, deployment: get_hedge_client(client, deployment),
+    max_retries=int(os.getenv("MAGENTIC_RETRY_ATTEMPTS", "2")),
+    retry_base=float(os.getenv("MAGENTIC_RETRY_BASE_MS", "200")) / 1000,
+    max_attempts=int(os.getenv("MAGENTIC_CALL_MAX_ATTEMPTS", "4")),
+)
+
+# Spreads the calls for a model id over its endpoints (MAGENTIC_ENDPOINTS, a JSON
+# file or inline JSON) and ejects endpoints that keep failing until they recover
+endpoint_balancer = EndpointBalancer(
+    load_endpoints(os.getenv("MAGENTIC_ENDPOINTS")),
+    balancing=os.getenv("MAGENTIC_BALANCING", "least_outstanding").lower(),
+    failure_threshold=int(os.getenv("MAGENTIC_BREAKER_FAILURES", "3")),
+    cooldown=float(os.getenv("MAGENTIC_BREAKER_COOLDOWN_SECONDS", "30")),
+    max_cooldown=float(os.getenv("MAGENTIC_BREAKER_MAX_COOLDOWN_SECONDS", "300")),
+    backend_client=lambda client, endpoint: get_backend_client(client, endpoint),
+)
+
+# Installed on every chat client, outermost first. Each attempt of a hedged,
+# retried or failed-over call passes through call_middleware on its own
+call_middleware = [concurrency_limiter, usage_middleware]
+chat_middleware = [context_middleware, prompt_memo, call_hedging, endpoint_balancer, *call_middleware]
+# Hedges sent to an alternate deployment are balanced over its endpoints like any other call
+hedge_middleware = [endpoint_balancer, *call_middleware]
+
 # Global agents (initialized once)
 researcher_agent = None
 coder_agent = None
 manager_agent = None
 workflow = None
 
+# One credential and one chat client per (endpoint, deployment), shared by all workflows
+client_registry = ChatClientRegistry(
+    env_file_path=os.getenv("MAGENTIC_ENV_FILE", "c:\\E2EDemo\\.env"), middleware=chat_middleware
+)
+
+# "azure" for Azure OpenAI, "offline" for scripted responses with no network access
+CHAT_CLIENT_MODE = os.getenv("MAGENTIC_CHAT_CLIENT", "azure").lower()
+
+
+def get_chat_client(role, model):
+    """Chat client for one workflow participant"""
+    if CHAT_CLIENT_MODE == "offline":
+        return OfflineChatClient.from_env(role, model_id=model, middleware=chat_middleware)
+    return client_registry.get_chat_client(model)
+
+
+# Offline hedge and endpoint clients by (role, model id), kept like the registry's
+# clients so their seeded latency and error draws carry on from call to call.
+# Hedge clients are named by deployment and endpoint clients by endpoint, so they never share an entry
+offline_call_clients = {}
+
+
+def get_offline_call_client(role, model_id, middleware=call_middleware):
+    client = offline_call_clients.get((role, model_id))
+    if client is None:
+        client = offline_call_clients[(role, model_id)] = OfflineChatClient.from_env(role, model_id=model_id, middleware=middleware)
+    return client
+
+
+def get_hedge_client(client, deployment):
+    """Chat client for hedges sent to ``deployment``; the prompt is already shaped, so it has hedge_middleware"""
+    if CHAT_CLIENT_MODE == "offline":
+        return get_offline_call_client(getattr(client, "role", None), deployment, middleware=hedge_middleware)
+    return client_registry.get_chat_client(deployment, middleware=hedge_middleware)
+
+
+def get_backend_client(client, endpoint):
+    """Chat client for the calls the balancer sends to ``endpoint``, with only call_middleware"""
+    if CHAT_CLIENT_MODE == "offline":
+        # Offline endpoints are told apart by name; "latency_ms" and "error_rate" options simulate a bad region
+        backend = get_offline_call_client(getattr(client, "role", None), endpoint.name)
+        if "latency_ms" in endpoint.options and backend.latency.spec != endpoint.options["latency_ms"]:
+            seed = os.getenv("MAGENTIC_OFFLINE_SEED")
+            backend.latency = LatencyModel(endpoint.options["latency_ms"], seed=int(seed) if seed else None)
+        backend.error_rate = float(endpoint.options.get("error_rate", os.getenv("MAGENTIC_OFFLINE_ERROR_RATE", "0")))
+        return backend
+    api_key = os.getenv(endpoint.api_key_env) if endpoint.api_key_env else None
+    return client_registry.get_chat_client(
+        endpoint.deployment, endpoint=endpoint.url, middleware=call_middleware, api_key=api_key
+    )
+
+
+# Round limit when a request does not set one, and whether requests use the adaptive budget by default
+DEFAULT_MAX_ROUNDS = 20
+ADAPTIVE_ROUNDS_DEFAULT = os.getenv("MAGENTIC_ADAPTIVE_ROUNDS", "0") == "1"
+
+# "sequential" hands the task to one participant per round; "parallel" lets the
+# manager run independent instructions for several participants at once
+ORCHESTRATION_DEFAULT = os.getenv("MAGENTIC_ORCHESTRATION", "sequential").lower()
+
+# Manager calls routed between a small model and the selected manager model
+ROUTING_ENABLED = os.getenv("MAGENTIC_ROUTING", "0") == "1"
+ROUTING_SMALL_MODEL = os.getenv("MAGENTIC_ROUTING_SMALL_MODEL", "gpt-4o-mini")
+model_router = ModelRouter(*load_policy(os.getenv("MAGENTIC_ROUTING_POLICY")))
+
+
+def get_manager_chat_client(model):
+    """Chat client for the Magentic manager, tiered when routing is enabled"""
+    client = get_chat_client("manager", model)
+    if not ROUTING_ENABLED:
+        return client
+    return model_router.client({
+        "small": (ROUTING_SMALL_MODEL, get_chat_client("manager", ROUTING_SMALL_MODEL)),
+        "strong": (model, client),
+    })
+
+
+# System prompt of every manager call, the same for every task. At about 60 tokens
+# it is far below the 1024 tokens prompt caching starts at, so it brings no cache
+# hits of its own; being static keeps it from breaking the prefix the manager's
+# calls in a run share with the conversation so far once that grows past 1024 tokens
+MANAGER_INSTRUCTIONS = (
+    "You are the orchestrator of a team of specialist agents working on a user's request. "
+    "You gather facts, plan, track progress, decide which team member acts next and write the final answer. "
+    "Answer each request in exactly the format it asks for."
+)
+
 
 def create_workflow_with_models(researcher_model="gpt-4o", coder_model="gpt-4o", manager_model="gpt-4o", reviewer_model="gpt-4o"):
     """Create a workflow with specified models for each agent"""
-    credential = DefaultAzureCredential()
-    env_path = "c:\\E2EDemo\\.env"
-    
     # Create specialized agents with model selection
     researcher = ChatAgent(
         name="ResearcherAgent",
@@ -46,22 +213,14 @@ def create_workflow_with_models(researcher_model="gpt-4o", coder_model="gpt-4o",
             "You are a Researcher. You find information without additional "
             "computation or quantitative analysis."
         ),
-        chat_client=AzureOpenAIChatClient(
-            env_file_path=env_path,
-            credential=credential,
-            model=researcher_model
-        ),
+        chat_client=get_chat_client("researcher", researcher_model),
     )
     
     coder = ChatAgent(
         name="CoderAgent",
         description="A helpful assistant that writes and executes code to process and analyze data.",
         instructions="You solve questions using code. Please provide detailed analysis and computation process.",
-        chat_client=AzureOpenAIChatClient(
-            env_file_path=env_path,
-            credential=credential,
-            model=coder_model
-        ),
+        chat_client=get_chat_client("coder", coder_model),
         tools=HostedCodeInterpreterTool(),
     )
     
@@ -74,34 +233,56 @@ def create_workflow_with_models(researcher_model="gpt-4o", coder_model="gpt-4o",
             "challenge conclusions, spot logical flaws, and ensure recommendations are evidence-based. "
             "Be constructive but rigorous. Flag data gaps, questionable assumptions, and weak reasoning."
         ),
-        chat_client=AzureOpenAIChatClient(
-            env_file_path=env_path,
-            credential=credential,
-            model=reviewer_model
-        ),
+        chat_client=get_chat_client("reviewer", reviewer_model),
     )
     
-    # Create chat client for the manager
-    manager_chat_client = AzureOpenAIChatClient(
-        env_file_path=env_path,
-        credential=credential,
-        model=manager_model
+    # Manager whose round limit and orchestration mode are set per run (see configure_run)
+    manager = FanOutMagenticManager(
+        chat_client=get_manager_chat_client(manager_model),
+        instructions=MANAGER_INSTRUCTIONS,
+        max_round_count=DEFAULT_MAX_ROUNDS,
+        max_stall_count=5,
+        max_reset_count=3,
     )
     
-    # Build the workflow with reviewer as participant
+    # Build the workflow with reviewer as participant (names must match PARTICIPANTS)
     return (
-        MagenticBuilder()
+        FanOutMagenticBuilder()
         .participants(researcher=researcher, coder=coder, reviewer=reviewer)
-        .with_standard_manager(
-            chat_client=manager_chat_client,
-            max_round_count=20,
-            max_stall_count=5,
-            max_reset_count=3,
-        )
+        .with_standard_manager(manager)
         .build()
     )
 
 
+# Participant names of every workflow built by create_workflow_with_models
+PARTICIPANTS = ("researcher", "coder", "reviewer")
+
+# Model selection of the global workflow used by execute_task_internal
+DEFAULT_MODEL_KEY = ("gpt-4o", "gpt-4o", "gpt-4o", "gpt-4o")
+
+# Seconds of silence before a heartbeat is sent on an SSE stream
+SSE_HEARTBEAT_SECONDS = float(os.getenv("MAGENTIC_SSE_HEARTBEAT_SECONDS", "15"))
+
+# Agent token deltas are sent to subscribers in frames of about this many seconds
+DELTA_FRAME_SECONDS = float(os.getenv("MAGENTIC_DELTA_FRAME_MS", "50")) / 1000
+
+# Activity log entries kept per run; further ones are counted in a closing entry
+ACTIVITY_MAX_ENTRIES = int(os.getenv("MAGENTIC_ACTIVITY_MAX_ENTRIES", "500"))
+
+# Seconds a request waits for its result when it sets no deadline (0 waits without a limit)
+DEFAULT_DEADLINE_SECONDS = float(os.getenv("MAGENTIC_TASK_DEADLINE_SECONDS", "0"))
+
+# Requests that left before their result; their runs are cancelled once nobody else waits
+cancellations = Cancellations()
+
+# Ready-to-run workflows keyed by (researcher, coder, manager, reviewer) model
+workflow_pool = WorkflowPool(
+    create_workflow_with_models,
+    max_idle_per_key=int(os.getenv("MAGENTIC_POOL_MAX_IDLE_PER_KEY", "2")),
+    max_idle_total=int(os.getenv("MAGENTIC_POOL_MAX_IDLE_TOTAL", "16")),
+)
+
+
 async def initialize_agents():
     """Initialize the agents once at startup with default models"""
     global researcher_agent, coder_agent, manager_agent, workflow
@@ -119,11 +300,25 @@ async def initialize_agents():
 class TaskRequest(BaseModel):
     """Request model for task execution"""
     task: str
-    max_rounds: int = 20
+    max_rounds: int = Field(DEFAULT_MAX_ROUNDS, ge=1, le=100)
+    # Scale the round budget to the task and stop once the manager converges;
+    # None uses MAGENTIC_ADAPTIVE_ROUNDS
+    adaptive_rounds: Optional[bool] = None
+    # "parallel" runs independent steps of different participants at the same
+    # time; None uses MAGENTIC_ORCHESTRATION
+    orchestration: Optional[Literal["sequential", "parallel"]] = None
     researcher_model: str = "gpt-4o"
     coder_model: str = "gpt-4o"
     manager_model: str = "gpt-4o"
     reviewer_model: str = "gpt-4o"
+    # Result cache control: skip the lookup, skip storing the result, or only
+    # accept a cached result younger than max_age seconds
+    no_cache: bool = False
+    no_store: bool = False
+    max_age: Optional[float] = None
+    # Seconds the caller will wait for the result; the run shortens its round
+    # budget to finish in time. None uses MAGENTIC_TASK_DEADLINE_SECONDS
+    deadline_s: Optional[float] = Field(None, gt=0)
 
 
 class TaskResponse(BaseModel):
@@ -132,6 +327,72 @@ class TaskResponse(BaseModel):
     result: str = None
     error: str = None
     activity_log: list = []
+    cached: bool = False
+    task_id: str = None
+
+
+def render_task_response(response: TaskResponse):
+    """JSON body of a TaskResponse, with the activity entries encoded straight from the log"""
+    head = json.dumps(response.model_dump(exclude={"activity_log"}), ensure_ascii=False)
+    
+    async def body():
+        yield head[:-1] + ', "activity_log": '
+        for chunk in iter_activity_json(response.activity_log):
+            yield chunk
+        yield "}"
+    
+    return StreamingResponse(body(), media_type="application/json")
+
+
+# Finished results of repeated tasks, keyed by normalized task, models and participants
+RESULT_CACHE_ENABLED = os.getenv("MAGENTIC_CACHE_ENABLED", "1") != "0"
+CACHE_EMBEDDING_DEPLOYMENT = os.getenv("MAGENTIC_CACHE_EMBEDDING_DEPLOYMENT")
+
+
+async def embed_task(text):
+    """Embedding of a task for near-duplicate cache lookups"""
+    response = await client_registry.get_embedding_client().embeddings.create(model=CACHE_EMBEDDING_DEPLOYMENT, input=text)
+    return response.data[0].embedding
+
+
+result_cache = ResultCache(
+    ttl_seconds=float(os.getenv("MAGENTIC_CACHE_TTL_SECONDS", "3600")),
+    max_bytes=int(float(os.getenv("MAGENTIC_CACHE_MAX_MB", "64")) * 2**20),
+    embed=embed_task if CACHE_EMBEDDING_DEPLOYMENT and CHAT_CLIENT_MODE != "offline" else None,
+    similarity_threshold=float(os.getenv("MAGENTIC_CACHE_SIMILARITY", "0.97")),
+)
+
+
+def run_options(max_rounds, adaptive, parallel):
+    """Run parameters that change a task's answer; results and runs are only shared between equal ones"""
+    return (("max_rounds", max_rounds), ("adaptive", adaptive), ("parallel", parallel))
+
+
+async def get_cached_result(task, model_key, no_cache=False, max_age=None, options=()):
+    """Cached {"result", "activity_log"} for a task run with ``options``, or None"""
+    if not RESULT_CACHE_ENABLED:
+        return None
+    if no_cache:
+        result_cache.record_bypass()
+        return None
+    return await result_cache.get(task, model_key, PARTICIPANTS, max_age=max_age, options=options)
+
+
+async def store_result(task, model_key, result_text, activity_log, no_store=False, options=()):
+    if RESULT_CACHE_ENABLED and not no_store:
+        await result_cache.put(task, model_key, PARTICIPANTS, {"result": result_text, "activity_log": activity_log}, options=options)
+
+
+# Durable history of every workflow run, written in batches off the request path
+task_store = TaskStore(
+    os.getenv("MAGENTIC_TASK_DB", "magentic_tasks.db"),
+    flush_interval=float(os.getenv("MAGENTIC_TASK_DB_FLUSH_MS", "200")) / 1000,
+    batch_size=int(os.getenv("MAGENTIC_TASK_DB_BATCH", "500")),
+)
+
+
+# Checkpoint every workflow superstep so failed or interrupted runs can be resumed
+CHECKPOINTS_ENABLED = os.getenv("MAGENTIC_CHECKPOINTS", "1") != "0"
 
 
 # Use lifespan context manager instead of deprecated on_event
@@ -141,14 +402,26 @@ from contextlib import asynccontextmanager
 async def lifespan(app: FastAPI):
     """Lifespan context manager for startup/shutdown"""
     # Startup
+    if CHAT_CLIENT_MODE != "offline":
+        await client_registry.start()
+    await task_store.start()
     await initialize_agents()
+    await job_scheduler.start()
     yield
-    # Shutdown (if needed)
-    pass
+    # Shutdown
+    await job_scheduler.stop()
+    await task_store.stop()
+    await client_registry.close()
 
 # Update the app with lifespan
 app = FastAPI(title="Magentic Multi-Agent API", lifespan=lifespan)
 
+
+@app.exception_handler(ClientDisconnected)
+async def client_disconnected(request: Request, exc: ClientDisconnected):
+    # Nobody reads this; 499 is the conventional "client closed request" status
+    return Response(status_code=499)
+
 # Re-add CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -172,442 +445,536 @@ async def root():
 @app.get("/api/health")
 async def health():
     """Health check for the API"""
-    return {"status": "healthy", "agents_initialized": workflow is not None}
+    return {
+        "status": "healthy",
+        "agents_initialized": workflow is not None,
+        "workflow_pool": workflow_pool.stats(),
+        "chat_clients": client_registry.stats(),
+        "jobs": job_scheduler.stats(),
+        "batches": batch_scheduler.stats(),
+        "result_cache": result_cache.stats(),
+        "coalescing": task_runs.stats(),
+        "task_store": task_store.stats(),
+        "model_routing": model_router.stats() if ROUTING_ENABLED else {"enabled": False},
+        "prompt_memo": prompt_memo.stats(),
+        "concurrency": concurrency_limiter.stats(),
+        "hedging": call_hedging.stats(),
+        "endpoints": endpoint_balancer.stats(),
+        "cancellation": {**cancellations.stats(), **task_metrics.cancellation_stats()},
+    }
+
+
+@app.get("/api/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Task, round, agent, model-route, prompt-memo, deployment, hedging, endpoint and batch metrics in the Prometheus text format"""
+    body = (
+        task_metrics.render_prometheus()
+        + prompt_memo.render_prometheus()
+        + concurrency_limiter.render_prometheus()
+        + call_hedging.render_prometheus()
+        + endpoint_balancer.render_prometheus()
+        + cancellations.render_prometheus()
+        + batch_scheduler.render_prometheus()
+    )
+    if ROUTING_ENABLED:
+        body += model_router.render_prometheus()
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4")
+
+
+@app.get("/api/traces/{task_id}")
+async def get_task_trace(task_id: str):
+    """Per-round and per-agent spans of a running or recent task"""
+    trace = task_metrics.get(task_id)
+    if trace is None:
+        raise HTTPException(status_code=404, detail="Trace not found")
+    return trace.to_dict()
+
+
+@app.get("/api/tasks")
+async def list_tasks(
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    model: Optional[str] = None,
+    role: Optional[str] = None,
+    agent: Optional[str] = None,
+    status: Optional[str] = None,
+    since: Optional[float] = None,
+    until: Optional[float] = None,
+):
+    """
+    Task history, newest first. Pass the returned next_cursor to get the next page
+    """
+    try:
+        return await task_store.list_tasks(limit, cursor, model=model, role=role, agent=agent, status=status, since=since, until=until)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/api/tasks/{task_id}")
+async def get_task(task_id: str):
+    """Metadata, model selection and result of a past or running task"""
+    task = await task_store.get_task(task_id)
+    if task is None:
+        raise HTTPException(status_code=404, detail="Task not found")
+    return task
+
+
+@app.get("/api/tasks/{task_id}/activity")
+async def get_task_activity(task_id: str, after: int = -1, limit: int = Query(500, ge=1, le=5000)):
+    """Activity log of a task, in pages of entries with seq greater than after"""
+    return await task_store.get_activity(task_id, after=after, limit=limit)
 
 
 @app.get("/api/models")
 async def get_available_models():
-    """Get list of available AI models"""
-    return {
-        "models": [
-            {"id": "gpt-4o", "name": "GPT-4o (Recommended)", "description": "Most capable, best for complex analysis"},
-            {"id": "gpt-4o-mini", "name": "GPT-4o Mini", "description": "Fast and cost-effective"},
-            {"id": "gpt-4", "name": "GPT-4 Turbo", "description": "Previous generation, reliable"},
-            {"id": "gpt-35-turbo", "name": "GPT-3.5 Turbo", "description": "Fast, good for simple tasks"}
-        ]
-    }
+    """Get list of available AI models, with the endpoints each is balanced over"""
+    models = [
+        {"id": "gpt-4o", "name": "GPT-4o (Recommended)", "description": "Most capable, best for complex analysis"},
+        {"id": "gpt-4o-mini", "name": "GPT-4o Mini", "description": "Fast and cost-effective"},
+        {"id": "gpt-4", "name": "GPT-4 Turbo", "description": "Previous generation, reliable"},
+        {"id": "gpt-35-turbo", "name": "GPT-3.5 Turbo", "description": "Fast, good for simple tasks"}
+    ]
+    for model in models:
+        model["endpoints"] = endpoint_balancer.describe(model["id"])
+    return {"models": models}
+
+
+def start_trace(header_value):
+    """Event tracer for a request that opted into tracing, else None"""
+    if not should_trace(header_value):
+        return None
+    tracer = EventTracer()
+    logger.info(f"Tracing workflow events under trace id {tracer.trace_id}")
+    return tracer
+
+
+def configure_run(task_workflow, task, max_rounds, adaptive, parallel, deadline=None):
+    """Set the manager's round limit, deadline and orchestration mode for this run; returns the limit"""
+    limit = adaptive_round_limit(task, max_rounds) if adaptive else max_rounds
+    manager = find_manager(task_workflow)
+    manager.configure(limit, adaptive=adaptive, deadline=deadline)
+    manager.configure_fan_out(parallel)
+    return limit
+
+
+async def run_workflow(task, model_key, tracer=None, store=True, task_id=None, checkpoint=None, first_seq=0,
+                       max_rounds=DEFAULT_MAX_ROUNDS, adaptive=False, parallel=False, deadline=None):
+    """Run a task on a pooled workflow, or resume ``task_id`` from ``checkpoint``.
+
+    Yields ("trace", task_id) first, then ("event", name) per workflow event,
+    ("delta", {"agent", "round", "text"}) per frame of agent token deltas,
+    ("activity", entry) per ActivityEntry of the activity log and finally
+    ("result", {"result", "activity_log"}).
+    """
+    # Check out a ready-to-run workflow for the selected models
+    task_workflow = workflow_pool.checkout(model_key)
+    run_completed = False
+    trace = task_metrics.start(task, model_key, task_id=task_id)
+    # A resumed run restores the budget and mode it started with from the checkpoint
+    trace.max_rounds = configure_run(task_workflow, task, max_rounds, adaptive, parallel, deadline)
+    trace.budget_mode = "adaptive" if adaptive else "fixed"
+    trace.orchestration = "parallel" if parallel else "sequential"
+    trace_status = "cancelled"
+    error = None
+    tracker = ActivityTracker(tracer=tracer, max_entries=ACTIVITY_MAX_ENTRIES)
+    # Model calls made while this run is driven are attributed to its trace
+    current_trace.set(trace)
+    task_store.task_started(trace.task_id, task, model_key, trace.created_at)
+    activity_seq = itertools.count(first_seq)
+    deltas = DeltaCoalescer(DELTA_FRAME_SECONDS)
+    
+    checkpoints = TaskCheckpointStorage(task_store, trace.task_id, latest=checkpoint) if CHECKPOINTS_ENABLED else None
+    if checkpoint is not None:
+        logger.info(f"Resuming task {trace.task_id} from checkpoint at superstep {checkpoint.iteration_count}")
+        events = task_workflow.run_stream(checkpoint_id=checkpoint.checkpoint_id, checkpoint_storage=checkpoints)
+    else:
+        events = task_workflow.run_stream(task, checkpoint_storage=checkpoints)
+    
+    try:
+        yield ("trace", trace.task_id)
+        
+        # None means no event arrived before the buffered token deltas were due
+        async for event in with_heartbeats(events, deltas.time_left):
+            is_delta = isinstance(event, MagenticAgentDeltaEvent)
+            if event is None or not is_delta or deltas.due:
+                for frame in deltas.flush():
+                    yield ("delta", frame)
+            if event is None:
+                continue
+            
+            trace.on_event(event)
+            if is_delta:
+                deltas.add(event.agent_id, trace.rounds, event.text)
+            else:
+                yield ("event", event.__class__.__name__)
+            for entry in tracker.process_event(event):
+                task_store.add_activity(trace.task_id, next(activity_seq), entry.to_dict())
+                yield ("activity", entry)
+        
+        for frame in deltas.flush():
+            yield ("delta", frame)
+        run_completed = True
+        
+        # Parse the final result and add the collaboration summary
+        for entry in tracker.finish():
+            task_store.add_activity(trace.task_id, next(activity_seq), entry.to_dict())
+            yield ("activity", entry)
+        
+        # A run cut short by its deadline or round budget is not the answer a fresh run would give
+        if tracker.result_text and not find_manager(task_workflow).stopped_early:
+            await store_result(
+                task, model_key, tracker.result_text, tracker.activity_log,
+                no_store=not store, options=run_options(max_rounds, adaptive, parallel),
+            )
+        
+        trace_status = "completed"
+        if checkpoints is not None:
+            # Nothing left to resume
+            task_store.delete_checkpoint(trace.task_id)
+        yield ("result", {"result": tracker.result_text, "activity_log": tracker.activity_log})
+    
+    except Exception as e:
+        trace_status = "failed"
+        error = str(e)
+        raise
+    
+    finally:
+        manager = find_manager(task_workflow)
+        trace.max_rounds, trace.stopped_early = manager.max_round_count, manager.stopped_early
+        trace.budget_mode = "adaptive" if manager.adaptive else "fixed"
+        trace.orchestration = "parallel" if manager.parallel else "sequential"
+        trace.parallel_batches, trace.parallel_turns = manager.batches, manager.batched_turns
+        trace.stream_deltas, trace.stream_frames = deltas.deltas, deltas.frames
+        task_metrics.finish(trace, trace_status)
+        task_store.task_finished(
+            trace.task_id, trace_status, result=tracker.result_text or None, error=error,
+            duration=round(trace.duration, 3), rounds=trace.rounds, event_count=tracker.event_count,
+            prompt_tokens=trace.prompt_tokens, completion_tokens=trace.completion_tokens,
+        )
+        # Interrupted or failed runs leave the workflow mid-task, so only completed ones are reused
+        workflow_pool.checkin(model_key, task_workflow, reusable=run_completed)
+
+
+# Identical concurrent tasks share one workflow run
+task_runs = SingleFlight()
+
+
+def request_deadline(request):
+    """``time.monotonic()`` deadline of a request, or None"""
+    return deadline_after(request.deadline_s or DEFAULT_DEADLINE_SECONDS)
+
 
+def request_adaptive(request):
+    """Whether a request's run uses an adaptive round budget"""
+    return ADAPTIVE_ROUNDS_DEFAULT if request.adaptive_rounds is None else request.adaptive_rounds
 
-def extract_agent_activities_from_result(text, activity_log, researcher_outputs, coder_outputs, researcher_topics, coder_operations):
-    """Extract what agents did by analyzing the final result text"""
-    if not text:
-        return
-    
-    import re
-    
-    # Look for calculations (Coder's work)
-    calculations = re.findall(r'\$[0-9,]+|×|÷|[0-9]+%|=\s*\$?[0-9,]+|ROI|CAGR|calculation|formula', text, re.IGNORECASE)
-    if calculations:
-        # Found calculation-related content
-        activity_log.append({
-            "type": "coder",
-            "message": f"🧮 Coder performed calculations:\n   Found {len(set(calculations))} mathematical operations in analysis",
-            "icon": "🧮"
-        })
-        coder_outputs.append("calculations_found")
-        coder_operations.append("Mathematical Analysis")
-    
-    # Look for research data (Researcher's work)
-    research_indicators = re.findall(r'average|market|industry|study|research|data|statistics|according to|typical|standard', text, re.IGNORECASE)
-    if research_indicators:
-        activity_log.append({
-            "type": "researcher",
-            "message": f"📚 Researcher gathered market intelligence:\n   Found {len(set(research_indicators))} research data points",
-            "icon": "📚"
-        })
-        researcher_outputs.append("research_found")
-        researcher_topics.add("market_research")
+
+def request_parallel(request):
+    """Whether a request's run uses parallel orchestration"""
+    return (request.orchestration or ORCHESTRATION_DEFAULT) == "parallel"
+
+
+def join_task_run(request, model_key, header_value, deadline=None):
+    """Attach to the in-flight run of an identical task with the same options, or start a new one.
+
+    A run with a deadline is shaped by it, so only requests without one share runs.
+    A run caches its result by the no_store of the request that started it, so only
+    requests with the same no_store share it.
+    """
+    adaptive, parallel = request_adaptive(request), request_parallel(request)
+    options = run_options(request.max_rounds, adaptive, parallel) + (("deadline", deadline), ("no_store", request.no_store))
+    key = ResultCache.make_key(request.task, model_key, PARTICIPANTS, options)
+    return task_runs.join(
+        key,
+        lambda: run_workflow(
+            request.task, model_key, tracer=start_trace(header_value), store=not request.no_store,
+            max_rounds=request.max_rounds,
+            adaptive=adaptive,
+            parallel=parallel,
+            deadline=deadline,
+        ),
+    )
 
 
 @app.post("/api/execute", response_model=TaskResponse)
-async def execute_task(request: TaskRequest):
+async def execute_task(request: TaskRequest, http_request: Request, x_magentic_trace: Optional[str] = Header(None)):
     """
     Execute a task using the Magentic workflow with model selection
     """
+    response = await cancellations.until_disconnected(http_request, run_task(request, x_magentic_trace), "execute")
+    return render_task_response(response)
+
+
+async def run_task(request: TaskRequest, trace_header=None, endpoint="execute") -> TaskResponse:
+    """Serve a task from the result cache or run it"""
     logger.info(f"Executing task with models - Researcher: {request.researcher_model}, Coder: {request.coder_model}, Reviewer: {request.reviewer_model}, Manager: {request.manager_model}")
     
-    # Create workflow with selected models
-    task_workflow = create_workflow_with_models(
-        researcher_model=request.researcher_model,
-        coder_model=request.coder_model,
-        manager_model=request.manager_model,
-        reviewer_model=request.reviewer_model
-    )
+    model_key = (request.researcher_model, request.coder_model, request.manager_model, request.reviewer_model)
+    
+    options = run_options(request.max_rounds, request_adaptive(request), request_parallel(request))
+    cached = await get_cached_result(request.task, model_key, request.no_cache, request.max_age, options)
+    if cached is not None:
+        logger.info(f"Serving cached result for task: {request.task[:100]}...")
+        return TaskResponse(status="success", cached=True, **cached)
     
     logger.info(f"Task: {request.task[:100]}...")
     
+    deadline = request_deadline(request)
+    run = join_task_run(request, model_key, trace_header, deadline)
+    return await collect_task_response(run, deadline, endpoint)
+
+
+async def collect_task_response(run, deadline=None, endpoint="execute"):
+    """Wait for a workflow run, until ``deadline`` at the latest, and build its TaskResponse"""
+    result = task_id = None
     try:
-        result_text = ""
-        activity_log = []
-        event_count = 0
-        
-        # Track which agents have been active and their detailed outputs
-        agent_activities = set()
-        researcher_outputs = []
-        coder_outputs = []
-        researcher_topics = set()
-        coder_operations = []
-        
-        async for event in task_workflow.run_stream(request.task):
-            event_count += 1
-            event_type = event.__class__.__name__
-            
-            # Get event source/agent info
-            event_str = str(event)
-            agent_name = None
-            
-            if hasattr(event, 'source'):
-                agent_name = str(event.source)
-            elif hasattr(event, 'agent_name'):
-                agent_name = event.agent_name
-            
-            # Debug logging - inspect ALL event attributes
-            if event_count <= 20:  # Only for first 20 events to avoid spam
-                logger.info(f"Event {event_count}: {event_type}")
-                logger.info(f"  Attributes: {dir(event)}")
-                if hasattr(event, '__dict__'):
-                    logger.info(f"  Dict: {event.__dict__}")
-            
-            # Extract full message content from events - check multiple possible attributes
-            message_content = None
-            full_message = None
-            
-            # Check various event data structures
-            if hasattr(event, 'data') and event.data:
-                messages = event.data if isinstance(event.data, list) else [event.data]
-                for msg in messages:
-                    if hasattr(msg, 'text') and msg.text:
-                        full_message = msg.text
-                        message_content = msg.text[:300]
-                    elif hasattr(msg, 'content') and msg.content:
-                        full_message = msg.content
-                        message_content = msg.content[:300]
-            
-            # Also check if event itself has content
-            if not message_content and hasattr(event, 'content'):
-                full_message = str(event.content)
-                message_content = str(event.content)[:300]
-            
-            # Check for messages in event directly
-            if not message_content and hasattr(event, 'message'):
-                full_message = str(event.message)
-                message_content = str(event.message)[:300]
-            
-            # Log ANY message content we find for debugging
-            if message_content and message_content.strip():
-                logger.info(f"📝 Agent message detected: {message_content[:150]}")
-            
-            # Track Researcher Agent activities with detailed analysis
-            if "researcher" in event_str.lower() or (agent_name and "researcher" in agent_name.lower()):
-                if "researcher" not in agent_activities:
-                    activity_log.append({
-                        "type": "researcher",
-                        "message": "🔍 Researcher Agent activated - Starting comprehensive information gathering",
-                        "icon": "🔍"
-                    })
-                    agent_activities.add("researcher")
-                
-                # ALWAYS log researcher activity, even without message content
-                if not message_content or message_content in researcher_outputs:
-                    # Log the event type at minimum
-                    if event_type not in ["WorkflowEvent", "WorkflowOutputEvent"]:
-                        activity_log.append({
-                            "type": "researcher",
-                            "message": f"🔍 Researcher processing: {event_type}",
-                            "icon": "🔍"
-                        })
-                
-                # Track detailed researcher outputs
-                if message_content and message_content not in researcher_outputs:
-                    researcher_outputs.append(message_content)
-                    
-                    # Analyze what the researcher found
-                    analysis_type = "Information"
-                    if any(word in message_content.lower() for word in ['market', 'industry', 'sector', 'company', 'companies']):
-                        analysis_type = "Market Research"
-                        researcher_topics.add("market_analysis")
-                    elif any(word in message_content.lower() for word in ['data', 'statistics', 'number', 'figure', 'percent']):
-                        analysis_type = "Data Analysis"
-                        researcher_topics.add("data_research")
-                    elif any(word in message_content.lower() for word in ['trend', 'growth', 'increase', 'decrease', 'change']):
-                        analysis_type = "Trend Analysis"
-                        researcher_topics.add("trend_research")
-                    elif any(word in message_content.lower() for word in ['compare', 'comparison', 'versus', 'vs', 'difference']):
-                        analysis_type = "Comparative Analysis"
-                        researcher_topics.add("comparative_research")
-                    
-                    # Extract key findings
-                    key_points = []
-                    if full_message:
-                        # Look for bullet points or numbered lists
-                        lines = full_message.split('\n')
-                        for line in lines[:5]:  # First 5 lines
-                            line = line.strip()
-                            if line and (line.startswith('-') or line.startswith('•') or line.startswith('*') or line[0].isdigit()):
-                                key_points.append(line.lstrip('-•* 0123456789.)'))
-                    
-                    # Create detailed log entry
-                    detail_msg = f"📚 Researcher completed {analysis_type}:\n"
-                    if key_points:
-                        detail_msg += f"   • {key_points[0][:100]}"
-                        if len(key_points) > 1:
-                            detail_msg += f"\n   • {key_points[1][:100]}"
-                    else:
-                        detail_msg += f"   {message_content[:200]}"
-                    
-                    activity_log.append({
-                        "type": "researcher",
-                        "message": detail_msg,
-                        "icon": "📚"
-                    })
-            
-            # Track Coder Agent activities with detailed code analysis
-            if "coder" in event_str.lower() or (agent_name and "coder" in agent_name.lower()):
-                if "coder" not in agent_activities:
-                    activity_log.append({
-                        "type": "coder",
-                        "message": "💻 Coder Agent activated - Initializing computational analysis tools",
-                        "icon": "💻"
-                    })
-                    agent_activities.add("coder")
-                
-                # ALWAYS log coder activity, even without message content
-                if not message_content or message_content in coder_outputs:
-                    # Log the event type at minimum
-                    if event_type not in ["WorkflowEvent", "WorkflowOutputEvent"]:
-                        activity_log.append({
-                            "type": "coder",
-                            "message": f"💻 Coder processing: {event_type}",
-                            "icon": "💻"
-                        })
-                
-                # Track detailed coder outputs
-                if message_content and message_content not in coder_outputs:
-                    coder_outputs.append(message_content)
-                    
-                    # Analyze what type of coding/calculation was performed
-                    operation_type = "Processing"
-                    detail_info = ""
-                    
-                    # Check for mathematical operations
-                    if any(op in message_content for op in ['=', 'result', 'answer', 'equals']):
-                        operation_type = "Calculation"
-                        
-                        # Try to extract the calculation
-                        if '=' in message_content:
-                            parts = message_content.split('=')
-                            if len(parts) >= 2:
-                                detail_info = f"Formula: {parts[0].strip()[:80]} = {parts[1].strip()[:80]}"
-                        
-                        # Look for specific math operations
-                        if any(term in message_content.lower() for term in ['cagr', 'compound', 'growth rate']):
-                            operation_type = "CAGR Calculation"
-                        elif any(term in message_content.lower() for term in ['roi', 'return on investment', 'payback']):
-                            operation_type = "ROI Analysis"
-                        elif any(term in message_content.lower() for term in ['sum', 'total', 'add']):
-                            operation_type = "Summation"
-                        elif any(term in message_content.lower() for term in ['average', 'mean', 'median']):
-                            operation_type = "Statistical Analysis"
-                        elif any(term in message_content.lower() for term in ['percent', '%', 'percentage']):
-                            operation_type = "Percentage Calculation"
-                    
-                    elif 'python' in message_content.lower() or 'code' in message_content.lower():
-                        operation_type = "Code Execution"
-                        detail_info = "Running Python code interpreter"
-                    
-                    elif any(term in message_content.lower() for term in ['analyze', 'analysis', 'examine']):
-                        operation_type = "Data Analysis"
-                    
-                    # Extract code snippets if present
-                    code_snippet = None
-                    if '```' in message_content:
-                        code_parts = message_content.split('```')
-                        if len(code_parts) > 1:
-                            code_snippet = code_parts[1].strip()[:150]
-                    
-                    # Create detailed log entry
-                    detail_msg = f"🧮 Coder performing {operation_type}:"
-                    if detail_info:
-                        detail_msg += f"\n   {detail_info}"
-                    elif code_snippet:
-                        detail_msg += f"\n   Code: {code_snippet}..."
-                    else:
-                        # Show the actual calculation or result
-                        detail_msg += f"\n   {message_content[:200]}"
-                    
-                    coder_operations.append(operation_type)
-                    
-                    activity_log.append({
-                        "type": "coder",
-                        "message": detail_msg,
-                        "icon": "🧮"
-                    })
-            
-            # Track Reviewer Agent activities
-            if "reviewer" in event_str.lower() or (agent_name and "reviewer" in agent_name.lower()):
-                if "reviewer" not in agent_activities:
-                    activity_log.append({
-                        "type": "reviewer",
-                        "message": "🔍 Reviewer Agent activated - Critically evaluating analysis quality",
-                        "icon": "🔍"
-                    })
-                    agent_activities.add("reviewer")
-                
-                # Track reviewer feedback/critique
-                if message_content:
-                    critique_indicators = ['however', 'concern', 'gap', 'missing', 'assumption', 'validate', 'suggest', 'recommend', 'issue', 'question']
-                    if any(indicator in message_content.lower() for indicator in critique_indicators):
-                        activity_log.append({
-                            "type": "reviewer",
-                            "message": f"🔎 Reviewer providing critical feedback:\n   Identified quality checks and improvement areas",
-                            "icon": "🔎"
-                        })
-            
-            # Track Manager/Orchestrator
-            if "manager" in event_str.lower() or "orchestrator" in event_str.lower() or (agent_name and "manager" in agent_name.lower()):
-                if "manager" not in agent_activities:
-                    activity_log.append({
-                        "type": "manager",
-                        "message": "🎯 Manager Agent coordinating - Analyzing task and planning workflow",
-                        "icon": "🎯"
-                    })
-                    agent_activities.add("manager")
-            
-            # Track tool/code execution
-            if "tool" in event_str.lower() or "code" in event_str.lower():
-                activity_log.append({
-                    "type": "coder",
-                    "message": "🔧 Coder executing code interpreter for calculations",
-                    "icon": "🔧"
-                })
-            
-            # Track workflow progress milestones
-            if event_count in [10, 20, 30, 40]:
-                activity_log.append({
-                    "type": "system",
-                    "message": f"⚡ Workflow milestone: {event_count} events processed, agents collaborating",
-                    "icon": "⚡"
-                })
-            
-            if isinstance(event, WorkflowOutputEvent):
-                if event.data:
-                    # Handle if data is a list or a single object
-                    messages = event.data if isinstance(event.data, list) else [event.data]
-                    for message in messages:
-                        if hasattr(message, 'text') and message.text:
-                            result_text = message.text
-                            
-                            # Parse the result to extract what each agent did
-                            extract_agent_activities_from_result(result_text, activity_log, researcher_outputs, coder_outputs, researcher_topics, coder_operations)
-                            
-                            activity_log.append({
-                                "type": "success",
-                                "message": f"📄 Final report compiled! Manager synthesized inputs from {len(agent_activities)} agents",
-                                "icon": "✅"
-                            })
-                        elif hasattr(message, 'content') and message.content:
-                            result_text = message.content
-                            
-                            # Parse the result to extract what each agent did
-                            extract_agent_activities_from_result(result_text, activity_log, researcher_outputs, coder_outputs, researcher_topics, coder_operations)
-                            
-                            activity_log.append({
-                                "type": "success",
-                                "message": "✨ Results generated successfully with multi-agent collaboration",
-                                "icon": "✅"
-                            })
-        
-        # Parse the final result to extract what agents did
-        extract_agent_activities_from_result(result_text, activity_log, researcher_outputs, coder_outputs, researcher_topics, coder_operations)
-        
-        # Add comprehensive final summary
-        if len(agent_activities) > 0:
-            summary_parts = []
-            
-            if "researcher" in agent_activities:
-                research_types = []
-                if "market_analysis" in researcher_topics:
-                    research_types.append("market analysis")
-                if "data_research" in researcher_topics:
-                    research_types.append("data research")
-                if "trend_research" in researcher_topics:
-                    research_types.append("trend analysis")
-                if "comparative_research" in researcher_topics:
-                    research_types.append("comparative analysis")
-                
-                research_detail = f"{len(researcher_outputs)} findings"
-                if research_types:
-                    research_detail += f" ({', '.join(research_types)})"
-                summary_parts.append(f"� Researcher: {research_detail}")
-            
-            if "coder" in agent_activities:
-                # Count unique operation types
-                unique_ops = list(set(coder_operations))
-                coder_detail = f"{len(coder_outputs)} operations"
-                if unique_ops:
-                    coder_detail += f" ({', '.join(unique_ops[:3])})"  # Show up to 3 types
-                summary_parts.append(f"💻 Coder: {coder_detail}")
-            
-            if "manager" in agent_activities:
-                summary_parts.append(f"🎯 Manager: Coordinated {event_count} workflow events")
-            
-            if summary_parts:
-                activity_log.append({
-                    "type": "system",
-                    "message": f"📊 Collaboration Summary:\n   " + "\n   ".join(summary_parts),
-                    "icon": "📊"
-                })
+        deadline_scope = asyncio.timeout(time_left(deadline))
+        try:
+            async with deadline_scope:
+                async for kind, payload in run.subscribe():
+                    if kind == "trace":
+                        task_id = payload
+                    elif kind == "result":
+                        result = payload
+        except TimeoutError:
+            if not deadline_scope.expired():
+                raise
+            cancellations.record(endpoint, "deadline")
+            # The run stops unless other requests wait for it; its task id can resume it
+            return TaskResponse(status="error", error="Deadline passed before the task finished", activity_log=[], task_id=task_id)
         
-        if result_text:
+        if result["result"]:
             logger.info("Task completed successfully")
-            return TaskResponse(status="success", result=result_text, activity_log=activity_log)
+            return TaskResponse(status="success", result=result["result"], activity_log=result["activity_log"], task_id=task_id)
         else:
             logger.warning("Task completed but no result generated")
             return TaskResponse(
                 status="success", 
                 result="Task completed but no output generated.",
-                activity_log=activity_log
+                activity_log=result["activity_log"],
+                task_id=task_id
             )
     
     except Exception as e:
         logger.exception("Task execution failed")
-        return TaskResponse(status="error", error=str(e), activity_log=[])
+        # The task id lets the caller resume the run from its last checkpoint
+        return TaskResponse(status="error", error=str(e), activity_log=[], task_id=task_id)
+    
+    finally:
+        # The run stops unless other requests wait for it
+        run.leave()
+
+
+@app.post("/api/tasks/{task_id}/resume", response_model=TaskResponse)
+async def resume_task(task_id: str):
+    """
+    Continue a failed or interrupted task from its last checkpoint
+    """
+    trace = task_metrics.get(task_id)
+    if trace is not None and trace.status == "running":
+        raise HTTPException(status_code=409, detail="Task is still running")
+    
+    task = await task_store.get_task(task_id)
+    if task is None:
+        raise HTTPException(status_code=404, detail="Task not found")
+    if task["status"] == "completed":
+        raise HTTPException(status_code=409, detail="Task already completed")
+    
+    row = await task_store.get_checkpoint(task_id)
+    if row is None:
+        raise HTTPException(status_code=409, detail="Task has no checkpoint to resume from")
+    
+    model_key = tuple(task["models"][role] for role in ("researcher", "coder", "manager", "reviewer"))
+    checkpoint = decode_checkpoint(row["data"])
+    first_seq = await task_store.next_activity_seq(task_id)
+    
+    # The request's round options are not kept, so a resumed result is not cached under any
+    run = task_runs.join(
+        ("resume", task_id),
+        lambda: run_workflow(task["task"], model_key, store=False, task_id=task_id, checkpoint=checkpoint, first_seq=first_seq),
+    )
+    return render_task_response(await collect_task_response(run))
 
 
 @app.post("/api/execute-stream")
-async def execute_task_stream(request: TaskRequest):
+async def execute_task_stream(request: TaskRequest, x_magentic_trace: Optional[str] = Header(None)):
     """
-    Execute a task and stream events (for real-time updates)
+    Execute a task and stream activity as server-sent events (for real-time updates)
     """
-    await initialize_agents()
+    logger.info(f"Streaming task with models - Researcher: {request.researcher_model}, Coder: {request.coder_model}, Reviewer: {request.reviewer_model}, Manager: {request.manager_model}")
     
-    if not workflow:
-        raise HTTPException(status_code=500, detail="Workflow not initialized")
+    model_key = (request.researcher_model, request.coder_model, request.manager_model, request.reviewer_model)
     
     async def event_generator():
+        sse = SSEWriter()
+        
         try:
-            async for event in workflow.run_stream(request.task):
-                event_type = event.__class__.__name__
-                
-                # Send different event types
-                if isinstance(event, WorkflowOutputEvent):
-                    if event.data:
-                        # Handle if data is a list or a single object
-                        messages = event.data if isinstance(event.data, list) else [event.data]
-                        for message in messages:
-                            if hasattr(message, 'text') and message.text:
-                                yield f"data: {{'type': 'result', 'content': {repr(message.text)}}}\n\n"
-                            elif hasattr(message, 'content') and message.content:
-                                yield f"data: {{'type': 'result', 'content': {repr(message.content)}}}\n\n"
-                else:
-                    yield f"data: {{'type': 'event', 'name': '{event_type}'}}\n\n"
+            # First frame goes out before any model call so the client sees progress immediately
+            yield sse.frame("start", {
+                "models": {
+                    "researcher": request.researcher_model,
+                    "coder": request.coder_model,
+                    "manager": request.manager_model,
+                    "reviewer": request.reviewer_model,
+                }
+            })
+            
+            deadline = request_deadline(request)
+            run = join_task_run(request, model_key, x_magentic_trace, deadline)
+            task_id = None
+            
+            def wait_seconds():
+                left = time_left(deadline)
+                return SSE_HEARTBEAT_SECONDS if left is None else min(SSE_HEARTBEAT_SECONDS, left)
             
-            yield f"data: {{'type': 'done'}}\n\n"
+            # Leaving the stream, however early, stops the run unless other requests wait for it
+            try:
+                async with aclosing(with_heartbeats(run.subscribe(), wait_seconds)) as items:
+                    async for item in items:
+                        if item is None:
+                            if time_left(deadline) == 0:
+                                cancellations.record("execute-stream", "deadline")
+                                yield sse.frame("error", {"message": "Deadline passed before the task finished", "task_id": task_id})
+                                return
+                            yield sse.heartbeat()
+                            continue
+                        
+                        kind, payload = item
+                        if kind == "trace":
+                            task_id = payload
+                            yield sse.frame("trace", {"task_id": payload})
+                        elif kind == "event":
+                            yield sse.frame("event", {"name": payload})
+                        elif kind == "delta":
+                            yield sse.frame("delta", payload)
+                        elif kind == "activity":
+                            yield sse.frame("activity", payload.to_dict())
+                        elif kind == "result":
+                            yield sse.frame("result", {"content": payload["result"] or "Task completed but no output generated."})
+            finally:
+                run.leave()
+            
+            yield sse.frame("done", {})
+        except (asyncio.CancelledError, GeneratorExit):
+            # The server stops the stream once the client disconnects
+            cancellations.record("execute-stream", "disconnect")
+            raise
         except Exception as e:
-            yield f"data: {{'type': 'error', 'message': {repr(str(e))}}}\n\n"
+            logger.exception("Streaming task execution failed")
+            yield sse.frame("error", {"message": str(e)})
+    
+    return StreamingResponse(event_generator(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+
+# Worker slots shared by all /api/execute-batch requests; each item runs like /api/execute
+batch_scheduler = BatchScheduler(
+    lambda request: run_task(request, endpoint="execute-batch"),
+    workers=int(os.getenv("MAGENTIC_BATCH_WORKERS", "4")),
+)
+
+BATCH_MAX_ITEMS = int(os.getenv("MAGENTIC_BATCH_MAX_ITEMS", "1000"))
+
+
+@app.post("/api/execute-batch")
+async def execute_batch(http_request: Request):
+    """
+    Execute a batch of tasks, sent as a JSON array or JSON Lines of task requests,
+    and stream one NDJSON result per item as it finishes, then a summary
+    """
+    try:
+        items = parse_batch(await http_request.body())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid batch: {e}")
+    if not items:
+        raise HTTPException(status_code=400, detail="Batch has no tasks")
+    if len(items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Batch has {len(items)} tasks (limit {BATCH_MAX_ITEMS})")
+    
+    requests = []
+    for index, item in enumerate(items):
+        try:
+            requests.append(TaskRequest.model_validate(item))
+        except ValidationError as e:
+            raise HTTPException(status_code=422, detail={"index": index, "errors": e.errors(include_url=False, include_context=False)})
+    
+    logger.info(f"Batch of {len(requests)} tasks submitted")
+    
+    async def result_lines():
+        try:
+            async with aclosing(batch_scheduler.run(requests)) as results:
+                async for result in results:
+                    yield json.dumps(result, ensure_ascii=False) + "\n"
+        except (asyncio.CancelledError, GeneratorExit):
+            # The server stops the stream once the client disconnects; unfinished items are cancelled
+            cancellations.record("execute-batch", "disconnect")
+            raise
     
-    from fastapi.responses import StreamingResponse
-    return StreamingResponse(event_generator(), media_type="text/event-stream")
+    return StreamingResponse(result_lines(), media_type="application/x-ndjson")
+
+
+async def run_task_job(request: TaskRequest) -> TaskResponse:
+    """Run a queued job through the same path as /api/execute"""
+    response = await run_task(request, endpoint="jobs")
+    if response.status == "error":
+        raise RuntimeError(response.error)
+    return response
+
+
+# Background workers for /api/jobs; the worker count caps concurrent workflows
+job_scheduler = JobScheduler(
+    run_task_job,
+    workers=int(os.getenv("MAGENTIC_JOB_WORKERS", "4")),
+    max_queue=int(os.getenv("MAGENTIC_JOB_MAX_QUEUE", "50")),
+)
+
+
+@app.post("/api/jobs", status_code=202)
+async def submit_job(request: TaskRequest):
+    """
+    Queue a task for background execution and return its job id immediately
+    """
+    try:
+        job = job_scheduler.submit(request)
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "30"})
+    
+    logger.info(f"Job {job.id} queued: {request.task[:100]}...")
+    return job.to_dict()
+
+
+def get_job_or_404(job_id: str):
+    job = job_scheduler.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@app.get("/api/jobs/{job_id}")
+async def get_job_status(job_id: str):
+    """Get the status and timing of a job"""
+    return get_job_or_404(job_id).to_dict()
+
+
+@app.get("/api/jobs/{job_id}/result", response_model=TaskResponse)
+async def get_job_result(job_id: str):
+    """Get the result of a finished job"""
+    job = get_job_or_404(job_id)
+    
+    if not job.finished:
+        raise HTTPException(status_code=409, detail=f"Job is still {job.status}")
+    if job.status == "succeeded":
+        return render_task_response(job.result)
+    return TaskResponse(status="error", error=job.error or f"Job {job.status}", activity_log=[])
+
+
+@app.post("/api/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str):
+    """Cancel a queued or running job"""
+    job = get_job_or_404(job_id)
+    
+    if not job_scheduler.cancel(job_id):
+        raise HTTPException(status_code=409, detail=f"Job already {job.status}")
+    return job.to_dict()
 
 
 async def execute_task_internal(task: str) -> str:
@@ -617,25 +984,17 @@ async def execute_task_internal(task: str) -> str:
     if not workflow:
         raise Exception("Workflow not initialized")
     
-    result_text = ""
-    
-    async for event in workflow.run_stream(task):
-        if isinstance(event, WorkflowOutputEvent):
-            if event.data:
-                # Handle if data is a list or a single object
-                messages = event.data if isinstance(event.data, list) else [event.data]
-                for message in messages:
-                    if hasattr(message, 'text') and message.text:
-                        result_text = message.text
-                    elif hasattr(message, 'content') and message.content:
-                        result_text = message.content
-    
-    return result_text if result_text else "Task completed but no output generated."
+    # Runs on a pooled workflow like /api/execute, so a cancelled request
+    # never leaves the shared workflow halfway through a task
+    response = await run_task(TaskRequest(task=task), endpoint="copilotkit")
+    if response.status == "error":
+        raise Exception(response.error)
+    return response.result
 
 
 # CopilotKit integration endpoint (simplified)
 @app.post("/copilotkit")
-async def copilotkit_endpoint(request: dict):
+async def copilotkit_endpoint(request: dict, http_request: Request):
     """
     Simplified endpoint for CopilotKit integration
     Note: Full CopilotKit runtime integration requires agent_framework.chatkit
@@ -650,7 +1009,7 @@ async def copilotkit_endpoint(request: dict):
         
         # Execute task
         try:
-            result = await execute_task_internal(user_input)
+            result = await cancellations.until_disconnected(http_request, execute_task_internal(user_input), "copilotkit")
             return {
                 "messages": [
                     {
@@ -659,6 +1018,8 @@ async def copilotkit_endpoint(request: dict):
                     }
                 ]
             }
+        except ClientDisconnected:
+            raise
         except Exception as e:
             return {
                 "messages": [
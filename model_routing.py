@@ -0,0 +1,287 @@
+"""
+Model Routing
+=============
+Tiered deployments for the Magentic manager. Most manager calls are small
+structured decisions: the progress ledger that checks for completion, stalls
+and loops and picks the next speaker. A small model handles those fine, while
+the fact sheet, the plan and the final answer need the strong model the
+request selected. ``RoutedChatClient`` stands in for the manager's chat
+client, classifies each call from its prompt and tries the tiers of that
+call's route in order:
+
+- a tier other than the last is skipped when the prompt is larger than the
+  route allows, when the call's estimated cost is over the route's cost
+  budget, or when the tier's recent latency is over the route's latency budget
+- the reply is validated (a progress ledger must be the JSON the manager
+  parses), and an invalid reply or a failed call falls back to the next tier
+
+Per-route call counts, latency, tokens, cost and fallbacks are rendered for
+``/api/metrics``.
+"""
+
+import json
+import logging
+import os
+import time
+
+from agent_framework._workflows._magentic import _extract_json
+
+from task_metrics import Histogram, prometheus_labels, render_header, render_histogram
+
+logger = logging.getLogger(__name__)
+
+
+class Route:
+    """Tiers for one type of manager call, tried in order; the last is the fallback.
+
+    ``max_prompt_tokens``, ``cost_budget`` (USD per call) and ``latency_budget``
+    (seconds) decide whether the earlier tiers are tried at all.
+    ``completion_tokens`` is the expected reply size, for the cost estimate.
+    """
+
+    def __init__(self, tiers, max_prompt_tokens=None, cost_budget=None, latency_budget=None, completion_tokens=500):
+        self.tiers = tuple(tiers)
+        self.max_prompt_tokens = max_prompt_tokens
+        self.cost_budget = cost_budget
+        self.latency_budget = latency_budget
+        self.completion_tokens = completion_tokens
+
+
+# Bookkeeping goes to the small model first; substantive calls stay on the selected model
+DEFAULT_ROUTES = {
+    "progress_ledger": Route(("small", "strong"), max_prompt_tokens=16000, completion_tokens=400),
+    "facts": Route(("strong",), completion_tokens=800),
+    "plan": Route(("strong",), completion_tokens=600),
+    "replan": Route(("strong",), completion_tokens=800),
+    "final_answer": Route(("strong",), completion_tokens=1000),
+    "other": Route(("strong",)),
+}
+
+# USD per million (prompt, completion) tokens, by deployment name
+DEFAULT_PRICES = {
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4": (10.00, 30.00),
+    "gpt-35-turbo": (0.50, 1.50),
+}
+
+# Text that identifies each of the standard manager prompts, checked in order
+CALL_MARKERS = (
+    ("progress_ledger", '"is_request_satisfied"'),
+    ("final_answer", "We have completed the task"),
+    ("replan", "rewrite the following fact sheet"),
+    ("replan", "what went wrong on this last run"),
+    ("plan", "devise a short bullet-point plan"),
+    ("facts", "pre-survey"),
+)
+
+LEDGER_KEYS = ("is_request_satisfied", "is_in_loop", "is_progress_being_made", "next_speaker", "instruction_or_question")
+
+# Seconds after which a tier skipped for being slow is tried again
+LATENCY_PROBE_INTERVAL = 60
+
+# Weight of the newest sample in a tier's latency average
+LATENCY_ALPHA = 0.2
+
+
+def classify_manager_call(messages):
+    """Route name for a manager call, from the prompt in its last message"""
+    prompt = messages[-1].text if messages else ""
+    for route, marker in CALL_MARKERS:
+        if marker in prompt:
+            return route
+    return "other"
+
+
+def estimate_tokens(messages):
+    """Rough prompt size: about four characters per token"""
+    return sum(len(message.text or "") for message in messages) // 4
+
+
+def reply_text(response):
+    messages = list(getattr(response, "messages", None) or [])
+    return (messages[-1].text or "") if messages else ""
+
+
+def validate_reply(route, response):
+    """Whether a reply is usable for its route"""
+    text = reply_text(response)
+    if not text.strip():
+        return False
+    if route == "progress_ledger":
+        try:
+            ledger = _extract_json(text)
+        except Exception:
+            return False
+        return all(key in ledger for key in LEDGER_KEYS)
+    return True
+
+
+def load_policy(spec):
+    """Routes and prices from a JSON file path or inline JSON, over the defaults.
+
+    The JSON may hold ``routes`` (route name -> ``Route`` keyword arguments)
+    and ``prices`` (deployment -> [prompt, completion] USD per million tokens).
+    """
+    routes, prices = dict(DEFAULT_ROUTES), dict(DEFAULT_PRICES)
+    if not spec:
+        return routes, prices
+    if os.path.exists(spec):
+        with open(spec, encoding="utf-8") as f:
+            policy = json.load(f)
+    else:
+        policy = json.loads(spec)
+    for name, settings in (policy.get("routes") or {}).items():
+        routes[name] = Route(**settings)
+    for deployment, (prompt_price, completion_price) in (policy.get("prices") or {}).items():
+        prices[deployment] = (prompt_price, completion_price)
+    return routes, prices
+
+
+class ModelRouter:
+    """Routing policy and per-route statistics shared by every workflow's manager"""
+
+    def __init__(self, routes=None, prices=None):
+        self.routes = routes or DEFAULT_ROUTES
+        self.prices = DEFAULT_PRICES if prices is None else prices
+        # (route, deployment) -> (latency average, time of the last sample)
+        self._latency = {}
+
+        self.calls = {}
+        self.latencies = {}
+        self.tokens = {}
+        self.cost = {}
+        self.fallbacks = {}
+
+    def client(self, tiers):
+        """Chat client for a manager, routing between ``tiers`` ({tier: (deployment, chat_client)})"""
+        return RoutedChatClient(self, tiers)
+
+    def estimate_cost(self, deployment, prompt_tokens, completion_tokens):
+        """USD for a call, or None if the deployment has no price"""
+        price = self.prices.get(deployment)
+        if price is None:
+            return None
+        return (prompt_tokens * price[0] + completion_tokens * price[1]) / 1_000_000
+
+    def candidates(self, route_name, tiers, prompt_tokens):
+        """(deployment, client) pairs to try for a call, in order"""
+        route = self.routes.get(route_name) or self.routes["other"]
+        ordered = []
+        for tier in route.tiers:
+            # Tiers served by the same deployment are tried once
+            if tier in tiers and all(tiers[tier][0] != deployment for deployment, _ in ordered):
+                ordered.append(tiers[tier])
+        if not ordered:
+            ordered = [tiers["strong"]]
+        preferred = [candidate for candidate in ordered[:-1] if self._within_budget(route_name, route, candidate[0], prompt_tokens)]
+        return preferred + ordered[-1:]
+
+    def _within_budget(self, route_name, route, deployment, prompt_tokens):
+        if route.max_prompt_tokens is not None and prompt_tokens > route.max_prompt_tokens:
+            return False
+        if route.cost_budget is not None:
+            cost = self.estimate_cost(deployment, prompt_tokens, route.completion_tokens)
+            if cost is not None and cost > route.cost_budget:
+                return False
+        if route.latency_budget is not None:
+            average, sampled_at = self._latency.get((route_name, deployment), (0, 0))
+            if average > route.latency_budget and time.monotonic() - sampled_at < LATENCY_PROBE_INTERVAL:
+                return False
+        return True
+
+    def record(self, route, deployment, outcome, elapsed, usage=None):
+        """Account one call: outcome is "ok", "invalid" or "error" """
+        key = (route, deployment)
+        self.calls[key + (outcome,)] = self.calls.get(key + (outcome,), 0) + 1
+        self.latencies.setdefault(key, Histogram()).observe(elapsed)
+        average, _ = self._latency.get(key, (elapsed, 0))
+        self._latency[key] = (average + LATENCY_ALPHA * (elapsed - average), time.monotonic())
+
+        if usage is None:
+            return
+        prompt_tokens, completion_tokens = usage.input_token_count or 0, usage.output_token_count or 0
+        self.tokens[key + ("prompt",)] = self.tokens.get(key + ("prompt",), 0) + prompt_tokens
+        self.tokens[key + ("completion",)] = self.tokens.get(key + ("completion",), 0) + completion_tokens
+        cost = self.estimate_cost(deployment, prompt_tokens, completion_tokens)
+        if cost is not None:
+            self.cost[key] = self.cost.get(key, 0.0) + cost
+
+    def record_fallback(self, route, from_deployment, to_deployment):
+        key = (route, from_deployment, to_deployment)
+        self.fallbacks[key] = self.fallbacks.get(key, 0) + 1
+
+    def stats(self):
+        """Per-route summary for the health endpoint"""
+        routes = {}
+        for (route, deployment), values in sorted(self.latencies.items()):
+            routes.setdefault(route, {})[deployment] = {
+                "calls": values.count,
+                "invalid": self.calls.get((route, deployment, "invalid"), 0),
+                "errors": self.calls.get((route, deployment, "error"), 0),
+                "mean_latency_ms": round(values.total / values.count * 1000, 1) if values.count else None,
+                "cost_usd": round(self.cost.get((route, deployment), 0.0), 6),
+            }
+        return {
+            "routes": routes,
+            "fallbacks": sum(self.fallbacks.values()),
+        }
+
+    def render_prometheus(self):
+        lines = []
+
+        render_header(lines, "magentic_route_calls_total", "counter", "Manager model calls by route, deployment and outcome")
+        for (route, deployment, outcome), count in sorted(self.calls.items()):
+            lines.append(f"magentic_route_calls_total{prometheus_labels(route=route, deployment=deployment, outcome=outcome)} {count}")
+
+        render_header(lines, "magentic_route_latency_seconds", "histogram", "Latency of manager model calls by route and deployment")
+        for (route, deployment), values in sorted(self.latencies.items()):
+            render_histogram(lines, "magentic_route_latency_seconds", values, route=route, deployment=deployment)
+
+        render_header(lines, "magentic_route_tokens_total", "counter", "Tokens of manager model calls by route and deployment")
+        for (route, deployment, token_type), count in sorted(self.tokens.items()):
+            lines.append(f"magentic_route_tokens_total{prometheus_labels(route=route, deployment=deployment, type=token_type)} {count}")
+
+        render_header(lines, "magentic_route_cost_usd_total", "counter", "Estimated cost of manager model calls by route and deployment")
+        for (route, deployment), cost in sorted(self.cost.items()):
+            lines.append(f"magentic_route_cost_usd_total{prometheus_labels(route=route, deployment=deployment)} {cost:.6f}")
+
+        render_header(lines, "magentic_route_fallbacks_total", "counter", "Manager calls retried on the next tier after an invalid reply or error")
+        for (route, from_deployment, to_deployment), count in sorted(self.fallbacks.items()):
+            lines.append(f"magentic_route_fallbacks_total{prometheus_labels(route=route, **{'from': from_deployment, 'to': to_deployment})} {count}")
+        return "\n".join(lines) + "\n"
+
+
+class RoutedChatClient:
+    """The manager's chat client: sends each call to the deployment its route picks"""
+
+    def __init__(self, router, tiers):
+        self.router = router
+        self.tiers = tiers
+
+    async def get_response(self, messages, **kwargs):
+        route = classify_manager_call(messages)
+        candidates = self.router.candidates(route, self.tiers, estimate_tokens(messages))
+
+        for index, (deployment, client) in enumerate(candidates):
+            fallback = candidates[index + 1][0] if index + 1 < len(candidates) else None
+            start = time.perf_counter()
+            try:
+                response = await client.get_response(messages, **kwargs)
+            except Exception as e:
+                self.router.record(route, deployment, "error", time.perf_counter() - start)
+                if fallback is None:
+                    raise
+                logger.warning(f"Route {route}: {deployment} failed ({e}), falling back to {fallback}")
+                self.router.record_fallback(route, deployment, fallback)
+                continue
+
+            valid = validate_reply(route, response)
+            self.router.record(
+                route, deployment, "ok" if valid else "invalid", time.perf_counter() - start,
+                getattr(response, "usage_details", None),
+            )
+            if valid or fallback is None:
+                return response
+            logger.info(f"Route {route}: invalid reply from {deployment}, falling back to {fallback}")
+            self.router.record_fallback(route, deployment, fallback)
@@ -0,0 +1,279 @@
+"""
+Offline Chat Client
+===================
+A stand-in for ``AzureOpenAIChatClient`` that never touches the network. It
+replays scripted or recorded agent responses with a configurable latency
+distribution and reports token usage, so the FastAPI app and the Magentic
+orchestration can be load tested without an Azure quota.
+
+The backend uses it with ``MAGENTIC_CHAT_CLIENT=offline``; the console demos
+always call Azure OpenAI. Optional settings:
+
+- ``MAGENTIC_OFFLINE_SCRIPT``: JSON file of responses (see ``DEFAULT_SCRIPT``)
+- ``MAGENTIC_OFFLINE_LATENCY_MS``: time to first token, e.g. ``constant:200``,
+  ``uniform:100,400``, ``normal:300,50`` or ``lognormal:300,0.5``
+- ``MAGENTIC_OFFLINE_TOKENS_PER_SECOND``: streaming speed after the first token
+  (0 streams instantly)
+- ``MAGENTIC_OFFLINE_SEED``: seed for reproducible latency samples and
+  injected errors
+- ``MAGENTIC_OFFLINE_CAPACITY``: calls a deployment (model id) serves at once;
+  further calls fail with a synthetic 429 (0, the default, never throttles)
+- ``MAGENTIC_OFFLINE_RETRY_AFTER_MS``: Retry-After of those 429s (default 500)
+- ``MAGENTIC_OFFLINE_ERROR_RATE``: fraction of calls that fail with a
+  synthetic 503 (default 0)
+"""
+
+import asyncio
+import json
+import math
+import os
+import random
+import re
+from functools import lru_cache
+
+from agent_framework import (
+    BaseChatClient,
+    ChatMessage,
+    ChatResponse,
+    ChatResponseUpdate,
+    TextContent,
+    UsageContent,
+    UsageDetails,
+    use_chat_middleware,
+    use_function_invocation,
+)
+
+# Author name the Magentic manager puts on its own messages
+MANAGER_AUTHOR = "magentic_manager"
+
+# Responses per participant, cycled by the number of agent turns so far. The
+# manager declares the task done after ``rounds`` agent turns. When the progress
+# ledger asks for parallel instructions, the speakers of a ``parallel`` group are
+# sent together.
+DEFAULT_SCRIPT = {
+    "rounds": 3,
+    "speakers": ["researcher", "coder", "reviewer"],
+    "parallel": [["researcher", "coder"]],
+    "facts": "GIVEN OR VERIFIED FACTS\n- The request needs market data and a calculation.",
+    "plan": "- researcher: gather market data\n- coder: run the numbers\n- reviewer: check the analysis",
+    "instruction": "Continue with your part of the plan.",
+    "final_answer": (
+        "Final report: the market average ROI = 18% with a CAGR of 12.4%. "
+        "However, the adoption assumptions should be validated."
+    ),
+    "responses": {
+        "researcher": [
+            "- The market grew 35% year over year\n- Industry analysts expect growth to continue",
+        ],
+        "coder": [
+            "```python\nroi = (1180000 - 1000000) / 1000000\n```\nROI result = 18%",
+        ],
+        "reviewer": [
+            "However, the assumption about adoption rates is missing a source; I suggest we validate it.",
+        ],
+    },
+}
+
+_DISTRIBUTIONS = {
+    "constant": lambda rng, value: value,
+    "uniform": lambda rng, low, high: rng.uniform(low, high),
+    "normal": lambda rng, mean, stdev: rng.gauss(mean, stdev),
+    "lognormal": lambda rng, median, sigma: median * math.exp(rng.gauss(0, sigma)),
+    "exponential": lambda rng, mean: rng.expovariate(1 / mean) if mean > 0 else 0,
+}
+
+
+class LatencyModel:
+    """Samples latencies from a ``name:arg1,arg2`` spec given in milliseconds"""
+
+    def __init__(self, spec="constant:0", seed=None):
+        name, _, args = spec.partition(":")
+        if name not in _DISTRIBUTIONS:
+            raise ValueError(f"Unknown latency distribution '{name}' (expected one of {', '.join(_DISTRIBUTIONS)})")
+        self.spec = spec
+        self._sample = _DISTRIBUTIONS[name]
+        self._args = [float(arg) for arg in args.split(",") if arg.strip()]
+        self._rng = random.Random(seed)
+
+    def sample(self):
+        """One latency in seconds, never negative"""
+        return max(self._sample(self._rng, *self._args), 0) / 1000
+
+
+@lru_cache(maxsize=None)
+def load_script(path=None):
+    """The default script, overlaid with the JSON file at ``path`` if given"""
+    script = json.loads(json.dumps(DEFAULT_SCRIPT))
+    if path:
+        with open(path, encoding="utf-8") as f:
+            script.update(json.load(f))
+    return script
+
+
+class OfflineThrottleError(Exception):
+    """Synthetic 429 for a call over a deployment's capacity"""
+
+    status_code = 429
+
+    def __init__(self, model_id, retry_after):
+        super().__init__(f"Offline deployment '{model_id}' is at capacity (429), retry after {retry_after:.2f}s")
+        self.retry_after = retry_after
+
+
+class OfflineServerError(Exception):
+    """Synthetic 503, for exercising retries"""
+
+    status_code = 503
+
+    def __init__(self, model_id):
+        super().__init__(f"Offline deployment '{model_id}' failed the call (503)")
+
+
+def count_tokens(text):
+    """Rough token estimate: about four characters per token"""
+    return max(len(text) // 4, 1) if text else 0
+
+
+@use_function_invocation
+@use_chat_middleware
+class OfflineChatClient(BaseChatClient):
+    """Chat client that answers from a script instead of calling a model.
+
+    ``role`` is the participant the client serves: "manager" answers the
+    Magentic manager's facts, plan, progress-ledger and final-answer prompts,
+    any other role replays that participant's scripted responses.
+    """
+
+    # Calls in flight per model id, across every client, for the capacity check
+    _in_flight = {}
+
+    def __init__(self, role, model_id="offline", script=None, latency=None, tokens_per_second=0,
+                 capacity=0, retry_after=0.5, error_rate=0.0, seed=None, **kwargs):
+        super().__init__(**kwargs)
+        self.role = role
+        self.model_id = model_id
+        self.script = script or load_script()
+        self.latency = latency or LatencyModel()
+        self.tokens_per_second = tokens_per_second
+        self.capacity = capacity
+        self.retry_after = retry_after
+        self.error_rate = error_rate
+        # Draws for injected errors, apart from the latency samples so those stay the same
+        self._rng = random.Random(seed)
+
+    @classmethod
+    def from_env(cls, role, model_id="offline", middleware=None):
+        """Client configured from the ``MAGENTIC_OFFLINE_*`` environment variables"""
+        seed = os.getenv("MAGENTIC_OFFLINE_SEED")
+        seed = int(seed) if seed else None
+        return cls(
+            role,
+            model_id=model_id,
+            script=load_script(os.getenv("MAGENTIC_OFFLINE_SCRIPT") or None),
+            latency=LatencyModel(os.getenv("MAGENTIC_OFFLINE_LATENCY_MS", "constant:0"), seed=seed),
+            tokens_per_second=float(os.getenv("MAGENTIC_OFFLINE_TOKENS_PER_SECOND", "0")),
+            capacity=int(os.getenv("MAGENTIC_OFFLINE_CAPACITY", "0")),
+            retry_after=float(os.getenv("MAGENTIC_OFFLINE_RETRY_AFTER_MS", "500")) / 1000,
+            error_rate=float(os.getenv("MAGENTIC_OFFLINE_ERROR_RATE", "0")),
+            seed=seed,
+            middleware=middleware,
+        )
+
+    def _reply(self, messages):
+        """The scripted text for the conversation so far"""
+        agent_turns = sum(1 for m in messages if m.author_name and m.author_name != MANAGER_AUTHOR)
+        prompt = messages[-1].text if messages else ""
+
+        if self.role != "manager":
+            responses = self.script["responses"].get(self.role) or ["Done."]
+            return responses[agent_turns % len(responses)]
+
+        if '"is_request_satisfied"' in prompt:
+            return self._progress_ledger(prompt, agent_turns)
+        if "We have completed the task" in prompt:
+            return self.script["final_answer"]
+        if "assembled the following team" in prompt:
+            return self.script["plan"]
+        return self.script["facts"]
+
+    def _progress_ledger(self, prompt, agent_turns):
+        # Speak only names the manager offered, in script order
+        offered = re.search(r"select from: ([^)]*)\)", prompt)
+        names = [name.strip() for name in offered.group(1).split(",")] if offered else []
+        speakers = [name for name in self.script["speakers"] if name in names] or names or self.script["speakers"]
+        done = agent_turns >= self.script["rounds"]
+        speaker = speakers[agent_turns % len(speakers)]
+
+        def answer(value):
+            return {"reason": "Scripted offline response", "answer": value}
+
+        ledger = {
+            "is_request_satisfied": answer(done),
+            "is_in_loop": answer(False),
+            "is_progress_being_made": answer(True),
+            "next_speaker": answer(speaker),
+            "instruction_or_question": answer(self.script["instruction"]),
+        }
+        if '"parallel_instructions"' in prompt:
+            group = next((group for group in self.script.get("parallel", ()) if speaker in group), ())
+            ledger["parallel_instructions"] = [
+                {"agent": name, "instruction": self.script["instruction"]}
+                for name in group if name != speaker and name in speakers
+            ]
+        return json.dumps(ledger)
+
+    def _usage(self, messages, text):
+        input_tokens = sum(count_tokens(m.text) for m in messages)
+        output_tokens = count_tokens(text)
+        return UsageDetails(
+            input_token_count=input_tokens,
+            output_token_count=output_tokens,
+            total_token_count=input_tokens + output_tokens,
+        )
+
+    def _admit(self):
+        """Take a slot of the deployment's capacity, or fail like a throttled or failing deployment"""
+        if self.error_rate and self._rng.random() < self.error_rate:
+            raise OfflineServerError(self.model_id)
+        in_flight = OfflineChatClient._in_flight.get(self.model_id, 0)
+        if self.capacity and in_flight >= self.capacity:
+            raise OfflineThrottleError(self.model_id, self.retry_after)
+        OfflineChatClient._in_flight[self.model_id] = in_flight + 1
+
+    def _leave(self):
+        OfflineChatClient._in_flight[self.model_id] -= 1
+
+    async def _inner_get_response(self, *, messages, chat_options, **kwargs):
+        text = self._reply(messages)
+        self._admit()
+        try:
+            await asyncio.sleep(self.latency.sample())
+            if self.tokens_per_second > 0:
+                await asyncio.sleep(count_tokens(text) / self.tokens_per_second)
+        finally:
+            self._leave()
+        return ChatResponse(
+            messages=[ChatMessage(role="assistant", text=text)],
+            model_id=self.model_id,
+            usage_details=self._usage(messages, text),
+        )
+
+    async def _inner_get_streaming_response(self, *, messages, chat_options, **kwargs):
+        text = self._reply(messages)
+        self._admit()
+        try:
+            await asyncio.sleep(self.latency.sample())
+
+            # Stream word by word, paced by tokens_per_second
+            for chunk in re.findall(r"\S+\s*|\s+", text):
+                if self.tokens_per_second > 0:
+                    await asyncio.sleep(count_tokens(chunk) / self.tokens_per_second)
+                yield ChatResponseUpdate(role="assistant", contents=[TextContent(text=chunk)], model_id=self.model_id)
+        finally:
+            self._leave()
+
+        yield ChatResponseUpdate(
+            role="assistant",
+            contents=[UsageContent(details=self._usage(messages, text))],
+            model_id=self.model_id,
+        )
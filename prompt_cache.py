@@ -0,0 +1,123 @@
+"""
+Prompt Cache
+============
+Local memoization of deterministic manager sub-calls. The fact sheet and the
+plan the manager writes for a task depend only on the task, the team and the
+manager model, so an identical task sends byte-identical prompts for both.
+``PromptMemoMiddleware`` answers those calls from memory instead of the model:
+
+- only non-streaming manager calls of the memoized kinds (facts and plan by
+  default, classified like model routing does) are looked up
+- entries are keyed by the model and every message's role, author and text,
+  expire after a TTL and are evicted least recently used first
+
+Hits and misses are counted per participant and call kind, next to the
+prompt tokens the provider served from its own prompt cache (see
+``task_metrics``).
+"""
+
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+
+from agent_framework import ChatMessage, ChatMiddleware, ChatResponse, Role
+
+from model_routing import classify_manager_call, reply_text
+from task_metrics import AGENT_EXECUTOR_PREFIX, current_executor, prometheus_labels, render_header
+
+logger = logging.getLogger(__name__)
+
+# Manager calls whose prompt depends only on the task, the team and the model
+MEMOIZED_CALLS = ("facts", "plan")
+
+
+def prompt_key(model, messages):
+    """Digest of the model and the exact messages of a call"""
+    digest = hashlib.sha256(str(model).encode())
+    for message in messages:
+        for part in (str(message.role), message.author_name or "", message.text or ""):
+            digest.update(b"\x00" + part.encode())
+    return digest.hexdigest()
+
+
+class PromptMemoMiddleware(ChatMiddleware):
+    """Chat middleware that memoizes deterministic manager sub-calls.
+
+    ``max_entries`` of 0 turns memoization off; calls are still counted.
+    """
+
+    def __init__(self, max_entries=256, ttl_seconds=3600, calls=MEMOIZED_CALLS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.calls = frozenset(calls)
+        # key -> (reply text, expiry time)
+        self._entries = OrderedDict()
+        # (participant, call kind, "hit" or "miss") -> count
+        self.lookups = {}
+
+    def _get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        text, expires_at = entry
+        if expires_at < time.time():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return text
+
+    def _put(self, key, text):
+        self._entries[key] = (text, time.time() + self.ttl_seconds)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _count(self, participant, kind, outcome):
+        key = (participant, kind, outcome)
+        self.lookups[key] = self.lookups.get(key, 0) + 1
+
+    async def process(self, context, next):
+        executor_id = current_executor.get()
+        if context.is_streaming or (executor_id and executor_id.startswith(AGENT_EXECUTOR_PREFIX)):
+            await next(context)
+            return
+        kind = classify_manager_call(context.messages)
+        if kind not in self.calls or self.max_entries <= 0:
+            await next(context)
+            return
+
+        model = context.chat_options.model_id or getattr(context.chat_client, "model_id", None)
+        key = prompt_key(model, context.messages)
+        text = self._get(key)
+        if text is not None:
+            logger.debug(f"Prompt memo: {kind} call answered from memory")
+            self._count("manager", kind, "hit")
+            context.result = ChatResponse(messages=ChatMessage(role=Role.ASSISTANT, text=text))
+            return
+
+        self._count("manager", kind, "miss")
+        await next(context)
+        text = reply_text(context.result)
+        if text.strip():
+            self._put(key, text)
+
+    def stats(self):
+        """Hits, misses and hit rate per participant and call kind, for the health endpoint"""
+        stats = {}
+        for (participant, kind, outcome), count in self.lookups.items():
+            counts = stats.setdefault(participant, {}).setdefault(kind, {"hits": 0, "misses": 0})
+            counts["hits" if outcome == "hit" else "misses"] = count
+        for kinds in stats.values():
+            for counts in kinds.values():
+                counts["hit_rate"] = round(counts["hits"] / (counts["hits"] + counts["misses"]), 3)
+        return {"entries": len(self._entries), "participants": stats}
+
+    def render_prometheus(self):
+        lines = []
+        render_header(lines, "magentic_prompt_memo_lookups_total", "counter", "Memoized manager sub-calls by participant, call kind and outcome")
+        for (participant, kind, outcome), count in sorted(self.lookups.items()):
+            lines.append(f"magentic_prompt_memo_lookups_total{prometheus_labels(agent=participant, call=kind, outcome=outcome)} {count}")
+        render_header(lines, "magentic_prompt_memo_entries", "gauge", "Manager replies held by the prompt memo")
+        lines.append(f"magentic_prompt_memo_entries {len(self._entries)}")
+        return "\n".join(lines) + "\n"
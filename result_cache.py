@@ -0,0 +1,192 @@
+"""
+Task Result Cache
+=================
+Caches finished task results so repeated and near-duplicate tasks skip the
+multi-agent run. Entries are keyed by the normalized task text, the model
+selection and the participant set, expire after a TTL, and are evicted least
+recently used first once the cache exceeds its memory budget. With an
+embedding function configured, an exact miss falls back to the most similar
+cached task for the same models and participants.
+"""
+
+import json
+import logging
+import math
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_task(text):
+    """Case, whitespace and trailing-punctuation insensitive form of a task"""
+    text = unicodedata.normalize("NFKC", text).lower()
+    text = re.sub(r"\s+", " ", text).strip()
+    return text.rstrip(" .!?")
+
+
+def _encode(value):
+    """JSON stand-in for values such as activity log entries, for sizing entries"""
+    to_dict = getattr(value, "to_dict", None)
+    return to_dict() if to_dict is not None else str(value)
+
+
+def cosine_similarity(a, b):
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+class CacheEntry:
+    __slots__ = ("value", "created_at", "expires_at", "size", "embedding")
+
+    def __init__(self, value, ttl, size, embedding=None):
+        self.value = value
+        self.created_at = time.time()
+        self.expires_at = self.created_at + ttl
+        self.size = size
+        self.embedding = embedding
+
+    @property
+    def age(self):
+        return time.time() - self.created_at
+
+
+class ResultCache:
+    """TTL + memory-bounded LRU cache of task results.
+
+    ``embed`` is an optional async callable returning an embedding vector for
+    a task; without it only exact (normalized) matches are served.
+    """
+
+    def __init__(self, ttl_seconds=3600, max_bytes=64 * 2**20, embed=None, similarity_threshold=0.97):
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.similarity_threshold = similarity_threshold
+        self._embed = embed
+        self._entries = OrderedDict()
+        self._embeddings = OrderedDict()
+        self.total_bytes = 0
+
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.bypasses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.embedding_failures = 0
+
+    @staticmethod
+    def make_key(task, models, participants, options=()):
+        """Cache key of a task; ``options`` are the run parameters that change its answer"""
+        return (normalize_task(task), tuple(models), tuple(sorted(participants)), tuple(options))
+
+    async def get(self, task, models, participants, max_age=None, options=()):
+        """Cached value for the task, or None. ``max_age`` (seconds) rejects older entries."""
+        key = self.make_key(task, models, participants, options)
+        entry = self._live_entry(key)
+        if entry is not None and (max_age is None or entry.age <= max_age):
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry.value
+
+        if self._embed is not None:
+            match = await self._nearest(key, max_age)
+            if match is not None:
+                self._entries.move_to_end(match)
+                self.near_hits += 1
+                logger.info(f"Result cache near-duplicate hit for '{key[0][:60]}' -> '{match[0][:60]}'")
+                return self._entries[match].value
+
+        self.misses += 1
+        return None
+
+    async def put(self, task, models, participants, value, options=()):
+        """Store a result, evicting least recently used entries beyond the memory budget"""
+        key = self.make_key(task, models, participants, options)
+        embedding = await self._embedding(key[0]) if self._embed is not None else None
+        size = len(json.dumps(value, default=_encode)) + (len(embedding) * 8 if embedding else 0)
+        if size > self.max_bytes:
+            return
+
+        self._remove(key)
+        self._entries[key] = CacheEntry(value, self.ttl_seconds, size, embedding)
+        self.total_bytes += size
+        self.stores += 1
+
+        while self.total_bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def record_bypass(self):
+        self.bypasses += 1
+
+    def _live_entry(self, key):
+        entry = self._entries.get(key)
+        if entry is not None and entry.expires_at <= time.time():
+            self._remove(key)
+            self.expirations += 1
+            return None
+        return entry
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.total_bytes -= entry.size
+
+    async def _embedding(self, text):
+        """Embedding for ``text``, memoized so a miss followed by a store embeds once"""
+        if text in self._embeddings:
+            return self._embeddings[text]
+        try:
+            embedding = list(await self._embed(text))
+        except Exception:
+            self.embedding_failures += 1
+            logger.exception("Task embedding failed; falling back to exact matching")
+            return None
+        self._embeddings[text] = embedding
+        if len(self._embeddings) > 256:
+            self._embeddings.popitem(last=False)
+        return embedding
+
+    async def _nearest(self, key, max_age):
+        """Most similar live entry for the same models, participants and options above the threshold"""
+        candidates = [k for k in self._entries if k[1:] == key[1:]]
+        if not candidates:
+            return None
+        embedding = await self._embedding(key[0])
+        if embedding is None:
+            return None
+
+        best_key, best_score = None, self.similarity_threshold
+        for candidate in candidates:
+            entry = self._live_entry(candidate)
+            if entry is None or entry.embedding is None or (max_age is not None and entry.age > max_age):
+                continue
+            score = cosine_similarity(embedding, entry.embedding)
+            if score >= best_score:
+                best_key, best_score = candidate, score
+        return best_key
+
+    def stats(self):
+        """Hit rate, size and eviction counters"""
+        lookups = self.hits + self.near_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "near_hits": self.near_hits,
+            "misses": self.misses,
+            "bypasses": self.bypasses,
+            "stores": self.stores,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "embedding_failures": self.embedding_failures,
+            "hit_rate": round((self.hits + self.near_hits) / lookups, 3) if lookups else 0.0,
+        }
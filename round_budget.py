@@ -0,0 +1,181 @@
+"""
+Round Budget
+============
+Per-request round limits for the Magentic manager. ``BudgetedMagenticManager``
+is a ``StandardMagenticManager`` whose round limit is set for each run
+instead of once when the workflow is built, so pooled workflows honor the
+``max_rounds`` of every request.
+
+In adaptive mode the limit is first scaled to an estimate of the task's
+complexity (the number of distinct things it asks for), and the run ends
+early, with a proper final answer, once the progress ledger converges: the
+manager repeats the same instruction to the same agent, or reports that the
+team is looping without progress. The last round of an adaptive budget also
+asks for the final answer instead of stopping with a partial result.
+
+A run with a deadline splits the time left across its remaining rounds. Once
+rounds take longer than their share, the round limit shrinks to the rounds
+that still fit, and the run finishes with a final answer when only time for
+that answer is left, in either budget mode. The shrink belongs to that run
+alone: checkpoints keep the requested limit, so a run resumed after its
+deadline passed gets its full budget back.
+"""
+
+import logging
+import math
+import re
+import time
+
+from agent_framework import StandardMagenticManager
+
+logger = logging.getLogger(__name__)
+
+# Rounds for planning plus one turn of each participant and the final answer
+MIN_ROUNDS = 4
+
+# Extra rounds for every deliverable beyond the first
+ROUNDS_PER_DELIVERABLE = 2
+
+# Verbs that introduce a separate deliverable in a task description
+ACTION_WORDS = (
+    "analyze", "analyse", "assess", "calculate", "compare", "compute", "describe", "estimate",
+    "evaluate", "explain", "find", "forecast", "identify", "include", "list", "plot", "project",
+    "rank", "recommend", "research", "review", "show", "summarize", "summarise", "visualize",
+)
+
+_ACTION_PATTERN = re.compile(r"\b(" + "|".join(ACTION_WORDS) + r")\w*", re.IGNORECASE)
+_LIST_ITEM_PATTERN = re.compile(r"^\s*(?:\d+[.)]|[-*•])\s+", re.MULTILINE)
+
+
+def estimate_deliverables(task):
+    """Rough count of the separate things a task asks for (at least 1)"""
+    actions = len(_ACTION_PATTERN.findall(task))
+    list_items = len(_LIST_ITEM_PATTERN.findall(task))
+    return max(actions, list_items, 1)
+
+
+def adaptive_round_limit(task, max_rounds):
+    """Round limit scaled to the task's estimated complexity, capped at ``max_rounds``"""
+    limit = MIN_ROUNDS + ROUNDS_PER_DELIVERABLE * (estimate_deliverables(task) - 1)
+    return max(min(limit, max_rounds), 1)
+
+
+# Why a run finished before the manager declared the request satisfied
+STOP_REASONS = {
+    "converged": "the progress ledger converged",
+    "looping": "the team is looping without progress",
+    "budget": "this is the last round of the budget",
+    "deadline": "the time left before the deadline only fits the final answer",
+}
+
+
+def _normalize(text):
+    return " ".join(str(text).lower().split())
+
+
+class BudgetedMagenticManager(StandardMagenticManager):
+    """Standard manager with a per-run round limit and optional early stopping.
+
+    Call ``configure()`` before each run. ``convergence_window`` is how many
+    consecutive identical (speaker, instruction) decisions count as converged.
+    """
+
+    def __init__(self, *args, convergence_window=2, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.default_max_rounds = self.max_round_count
+        self.convergence_window = convergence_window
+        self.configure(self.default_max_rounds)
+
+    def configure(self, max_rounds=None, adaptive=False, deadline=None):
+        """Set the round limit and deadline (a ``time.monotonic()`` value) for the next run and clear per-run state"""
+        # The deadline may lower max_round_count during the run; requested_max_rounds keeps what was asked for
+        self.requested_max_rounds = self.max_round_count = max_rounds or self.default_max_rounds
+        self.adaptive = adaptive
+        self.deadline = deadline
+        self.stopped_early = None
+        self._decisions = []
+        self._first_ledger_at = None
+        self._deadline_limited = False
+
+    def _stop(self, ledger, round_count, reason):
+        budget = "Deadline" if reason == "deadline" else "Adaptive round budget"
+        logger.info(f"{budget}: finishing after round {round_count} ({reason})")
+        self.stopped_early = reason
+        ledger.is_request_satisfied.answer = True
+        ledger.is_request_satisfied.reason = f"{budget}: {STOP_REASONS[reason]}"
+        return ledger
+
+    def _deadline_limit(self, round_count):
+        """Round whose ledger should ask for the final answer to finish by the deadline, or None while unknown"""
+        now = time.monotonic()
+        if self._first_ledger_at is None:
+            self._first_ledger_at = now
+        time_left = self.deadline - now
+        if time_left <= 0:
+            return round_count
+        if round_count <= 1:
+            return None
+        round_time = (now - self._first_ledger_at) / (round_count - 1)
+        # Each remaining round gets an even share of the time left; while a round fits in it the limit stands
+        if self.max_round_count is not None and self.max_round_count > round_count:
+            if time_left / (self.max_round_count - round_count) >= round_time:
+                return None
+        # Finish once the time left only covers this round's turn and the final answer
+        return round_count + math.floor(time_left / round_time)
+
+    async def create_progress_ledger(self, magentic_context):
+        ledger = await super().create_progress_ledger(magentic_context)
+        round_count = magentic_context.round_count
+        if self.deadline is not None and not ledger.is_request_satisfied.answer:
+            limit = self._deadline_limit(round_count)
+            if limit is not None and (self.max_round_count is None or limit < self.max_round_count):
+                logger.info(f"Deadline: lowering the round limit from {self.max_round_count} to {limit}")
+                self.max_round_count = limit
+                self._deadline_limited = True
+            if self._deadline_limited and round_count >= self.max_round_count:
+                return self._stop(ledger, round_count, "deadline")
+        if not self.adaptive or ledger.is_request_satisfied.answer:
+            return ledger
+
+        decision = (str(ledger.next_speaker.answer), _normalize(ledger.instruction_or_question.answer))
+        self._decisions.append(decision)
+
+        reason = None
+        recent = self._decisions[-(self.convergence_window + 1):]
+        if len(recent) > self.convergence_window and len(set(recent)) == 1:
+            reason = "converged"
+        elif ledger.is_in_loop.answer and not ledger.is_progress_being_made.answer:
+            reason = "looping"
+        elif self.max_round_count is not None and round_count >= self.max_round_count:
+            reason = "budget"
+
+        if reason is not None and round_count > 1:
+            return self._stop(ledger, round_count, reason)
+        return ledger
+
+    def on_checkpoint_save(self):
+        state = super().on_checkpoint_save()
+        state["round_budget"] = {
+            "max_rounds": self.requested_max_rounds,
+            "adaptive": self.adaptive,
+            "decisions": [list(decision) for decision in self._decisions],
+        }
+        return state
+
+    def on_checkpoint_restore(self, state):
+        super().on_checkpoint_restore(state)
+        budget = state.get("round_budget")
+        if budget:
+            # A resumed run keeps the budget it was asked for, without the deadline of the run it resumes
+            self.requested_max_rounds = self.max_round_count = budget["max_rounds"]
+            self.adaptive = budget["adaptive"]
+            self._decisions = [tuple(decision) for decision in budget["decisions"]]
+
+
+def find_manager(workflow):
+    """The Magentic manager of a built workflow, or None"""
+    for executor in workflow.get_executors_list():
+        manager = getattr(executor, "_manager", None)
+        if manager is not None:
+            return manager
+    return None
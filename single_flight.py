@@ -0,0 +1,129 @@
+"""
+Single-Flight Task Runs
+=======================
+Coalesces identical in-flight tasks. The first request for a key starts the
+run; concurrent requests for the same key attach to it instead of starting
+their own workflow. Every item the run produces is kept in order and fanned
+out to each subscriber, so late joiners replay the run from the start and
+everyone receives the same final result. A run is cancelled once its last
+subscriber leaves.
+
+Joining counts a subscriber and ``leave()`` uncounts it, apart from
+iterating ``subscribe()``. A request that goes away before it started
+reading the run still leaves it, so the run cannot outlive everyone waiting
+for it.
+"""
+
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class RunCancelled(Exception):
+    """The shared run was cancelled before it finished"""
+
+
+class InFlightRun:
+    """A running producer whose items are shared by all subscribers"""
+
+    def __init__(self, key, producer):
+        self.key = key
+        self.items = []
+        self.error = None
+        self.done = False
+        self.abandoned = False
+        self.subscribers = 0
+        self._changed = asyncio.Event()
+        self.task = asyncio.create_task(self._run(producer))
+
+    @property
+    def active(self):
+        """Whether new subscribers can still attach"""
+        return not self.done and not self.abandoned
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def _run(self, producer):
+        try:
+            async for item in producer:
+                self.items.append(item)
+                self._notify()
+        except asyncio.CancelledError:
+            # Subscribers get an error they handle like any other failure, not a cancellation of their own
+            self.error = RunCancelled("The task run was cancelled before it finished")
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            self._notify()
+
+    async def subscribe(self):
+        """Yield every item of the run, from the first, then re-raise its error if it failed"""
+        index = 0
+        while True:
+            changed = self._changed
+            while index < len(self.items):
+                yield self.items[index]
+                index += 1
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            await changed.wait()
+
+    def leave(self):
+        """Stop counting one subscriber; the last one to leave an unfinished run cancels it"""
+        self.subscribers -= 1
+        if self.subscribers == 0 and not self.done:
+            # Nobody is waiting for the result any more
+            self.abandoned = True
+            self.task.cancel()
+
+
+class SingleFlight:
+    """Registry of in-flight runs keyed by request identity"""
+
+    def __init__(self):
+        self._runs = {}
+        self.leaders = 0
+        self.followers = 0
+        self.abandoned = 0
+
+    def join(self, key, start_producer):
+        """Attach to the active run for ``key``, or start one with ``start_producer()``.
+
+        The caller may iterate ``run.subscribe()`` once and must call
+        ``run.leave()`` once it stops waiting, read or not.
+        """
+        run = self._runs.get(key)
+        if run is not None and run.active:
+            self.followers += 1
+            logger.info(f"Coalesced request onto in-flight run ({run.subscribers + 1} subscribers)")
+        else:
+            run = InFlightRun(key, start_producer())
+            self._runs[key] = run
+            run.task.add_done_callback(lambda _: self._finished(run))
+            self.leaders += 1
+        run.subscribers += 1
+        return run
+
+    def _finished(self, run):
+        if run.abandoned:
+            self.abandoned += 1
+        if self._runs.get(run.key) is run:
+            del self._runs[run.key]
+
+    def stats(self):
+        """In-flight runs and how many requests were coalesced"""
+        requests = self.leaders + self.followers
+        return {
+            "in_flight": len(self._runs),
+            "subscribers": sum(run.subscribers for run in self._runs.values()),
+            "runs_started": self.leaders,
+            "requests_coalesced": self.followers,
+            "runs_abandoned": self.abandoned,
+            "coalesce_rate": round(self.followers / requests, 3) if requests else 0.0,
+        }
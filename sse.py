@@ -0,0 +1,82 @@
+"""
+Server-Sent Events Helpers
+==========================
+Framing and heartbeat helpers for streaming workflow activity to the UI over
+``text/event-stream``.
+"""
+
+import asyncio
+import json
+
+# Headers that keep proxies from buffering or caching the stream
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "Connection": "keep-alive",
+    "X-Accel-Buffering": "no",
+}
+
+
+class SSEWriter:
+    """Formats SSE frames with increasing event ids"""
+
+    def __init__(self):
+        self.last_id = 0
+
+    def frame(self, event_type, payload):
+        """Frame ``payload`` as JSON under the given event type"""
+        self.last_id += 1
+        data = json.dumps({"type": event_type, **payload}, ensure_ascii=False)
+        return f"id: {self.last_id}\nevent: {event_type}\ndata: {data}\n\n"
+
+    @staticmethod
+    def heartbeat():
+        """A comment frame that keeps idle connections open"""
+        return ": heartbeat\n\n"
+
+
+async def with_heartbeats(stream, interval):
+    """Iterate ``stream``, yielding ``None`` whenever it is idle for ``interval`` seconds.
+
+    ``interval`` may also be a callable returning the seconds to wait for the
+    next item, or None to wait without a limit.
+
+    The stream is consumed by a background task so that waiting for the next
+    item can time out without cancelling the stream itself.
+    """
+    queue = asyncio.Queue(maxsize=100)
+    done = object()
+
+    async def pump():
+        try:
+            async for item in stream:
+                await queue.put((item, None))
+            await queue.put((done, None))
+        except Exception as e:
+            await queue.put((done, e))
+        finally:
+            # Close the stream here rather than leaving it to garbage collection
+            await stream.aclose()
+
+    pump_task = asyncio.create_task(pump())
+    try:
+        while True:
+            try:
+                # Unlike wait_for, a timeout scope never swallows a cancellation
+                # that lands just as the next item arrives
+                async with asyncio.timeout(interval() if callable(interval) else interval):
+                    item, error = await queue.get()
+            except TimeoutError:
+                yield None
+                continue
+            if error is not None:
+                raise error
+            if item is done:
+                return
+            yield item
+    finally:
+        if not pump_task.done():
+            pump_task.cancel()
+            try:
+                await pump_task
+            except asyncio.CancelledError:
+                pass
@@ -0,0 +1,70 @@
+"""
+Task Checkpoints
+================
+Workflow checkpoint storage for a single task run. The framework checkpoints
+the Magentic workflow after every superstep (each manager round and each
+agent turn): orchestrator state, the manager's conversation history and the
+messages in flight. Only the latest checkpoint of a task is kept, as
+compressed JSON in the task history store. It is encoded and written by the
+store's background flusher, so the round loop neither serializes the
+conversation nor waits on disk. A failed or interrupted run resumes from it
+on a freshly checked-out workflow.
+"""
+
+import json
+import zlib
+from dataclasses import asdict
+
+from agent_framework import WorkflowCheckpoint
+
+
+def encode_checkpoint(checkpoint):
+    return zlib.compress(json.dumps(asdict(checkpoint), separators=(",", ":"), ensure_ascii=False).encode("utf-8"))
+
+
+def decode_checkpoint(data):
+    return WorkflowCheckpoint.from_dict(json.loads(zlib.decompress(data)))
+
+
+class TaskCheckpointStorage:
+    """``CheckpointStorage`` that keeps the latest checkpoint of one task.
+
+    ``latest`` is the checkpoint a resumed run starts from.
+    """
+
+    def __init__(self, task_store, task_id, latest=None):
+        self.task_store = task_store
+        self.task_id = task_id
+        self.latest = latest
+        self.saved = 0
+
+    async def save_checkpoint(self, checkpoint):
+        self.task_store.save_checkpoint(
+            self.task_id, checkpoint.checkpoint_id, checkpoint.iteration_count, lambda: encode_checkpoint(checkpoint)
+        )
+        self.latest = checkpoint
+        self.saved += 1
+        return checkpoint.checkpoint_id
+
+    async def load_checkpoint(self, checkpoint_id):
+        if self.latest is not None and self.latest.checkpoint_id == checkpoint_id:
+            return self.latest
+        row = await self.task_store.get_checkpoint(self.task_id)
+        if row is None or row["checkpoint_id"] != checkpoint_id:
+            return None
+        return decode_checkpoint(row["data"])
+
+    async def list_checkpoint_ids(self, workflow_id=None):
+        return [cp.checkpoint_id for cp in await self.list_checkpoints(workflow_id)]
+
+    async def list_checkpoints(self, workflow_id=None):
+        if self.latest is None or (workflow_id is not None and self.latest.workflow_id != workflow_id):
+            return []
+        return [self.latest]
+
+    async def delete_checkpoint(self, checkpoint_id):
+        if self.latest is None or self.latest.checkpoint_id != checkpoint_id:
+            return False
+        self.task_store.delete_checkpoint(self.task_id)
+        self.latest = None
+        return True
@@ -0,0 +1,582 @@
+"""
+Task Metrics
+============
+Span-based timing and token accounting for workflow runs. Each manager round
+and each agent turn becomes a span, opened and closed by the executor events
+of ``run_stream``. A chat middleware attributes every model call to the span
+that is open in the calling task (or, when agents of a fan-out batch run side
+by side, to the span of the calling agent), so each span records:
+
+- wall time and queue time (from hand-off to the first model call)
+- prompt and completion tokens reported by the model, and the prompt tokens
+  the provider served from its prompt cache
+- model calls, failed calls and SDK retries
+- estimated prompt tokens of the conversation before and after context
+  compaction
+
+Finished task traces are kept in a ring buffer for the per-task trace
+endpoint, and aggregated into counters and histograms rendered in the
+Prometheus text format for ``/api/metrics``. Runs cancelled because nobody
+was waiting any more count the model calls they wasted, and an estimate of
+the calls they would still have made.
+"""
+
+import asyncio
+import logging
+import time
+import uuid
+from collections import deque
+from contextvars import ContextVar
+
+from agent_framework import ChatMiddleware, ExecutorCompletedEvent, ExecutorInvokedEvent, UsageContent
+
+logger = logging.getLogger(__name__)
+
+# Trace of the task whose workflow is running in the current asyncio task
+current_trace = ContextVar("magentic_task_trace", default=None)
+
+# Executor whose handler is running in the current asyncio task, set where executors run concurrently
+current_executor = ContextVar("magentic_executor", default=None)
+
+ORCHESTRATOR_EXECUTOR = "magentic_orchestrator"
+AGENT_EXECUTOR_PREFIX = "agent_"
+
+# Histogram buckets in seconds, sized for model calls that take 0.1s - minutes
+DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# Manager rounds per task
+ROUND_BUCKETS = (1, 2, 3, 4, 5, 6, 8, 10, 12, 15, 20, 30, 50)
+
+
+class Span:
+    """One manager round or agent turn"""
+
+    __slots__ = (
+        "kind", "agent", "round", "start", "end", "ready_at", "first_call_at",
+        "prompt_tokens", "completion_tokens", "cached_tokens", "calls", "errors", "retries",
+        "context_before", "context_after",
+    )
+
+    def __init__(self, kind, agent, round_index, start, ready_at):
+        self.kind = kind
+        self.agent = agent
+        self.round = round_index
+        self.start = start
+        self.end = None
+        # When the previous span handed off, for queue time
+        self.ready_at = ready_at
+        self.first_call_at = None
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cached_tokens = 0
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        # Estimated conversation tokens sent, before and after compaction
+        self.context_before = 0
+        self.context_after = 0
+
+    @property
+    def duration(self):
+        return (self.end or time.perf_counter()) - self.start
+
+    @property
+    def queue_time(self):
+        """Time from hand-off until the first model call started"""
+        return max((self.first_call_at or self.start) - self.ready_at, 0)
+
+    def to_dict(self, origin):
+        return {
+            "kind": self.kind,
+            "agent": self.agent,
+            "round": self.round,
+            "start_s": round(self.start - origin, 4),
+            "duration_s": round(self.duration, 4),
+            "queue_s": round(self.queue_time, 4),
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "cached_prompt_tokens": self.cached_tokens,
+            "calls": self.calls,
+            "errors": self.errors,
+            "retries": self.retries,
+            "context_tokens": {"before": self.context_before, "after": self.context_after},
+        }
+
+
+class TaskTrace:
+    """Spans of one workflow run"""
+
+    def __init__(self, task, model_key, task_id=None):
+        self.task_id = task_id or uuid.uuid4().hex[:16]
+        self.task = task
+        self.model_key = model_key
+        self.created_at = time.time()
+        self.start = time.perf_counter()
+        self.end = None
+        self.status = "running"
+        self.spans = []
+        self.rounds = 0
+        # Round budget of the run: "fixed" or "adaptive", and why an adaptive run stopped early
+        self.max_rounds = None
+        self.budget_mode = "fixed"
+        self.stopped_early = None
+        # "sequential" or "parallel", and the fan-out batches run and agent turns they held
+        self.orchestration = "sequential"
+        self.parallel_batches = 0
+        self.parallel_turns = 0
+        # Agent token deltas streamed, and the frames they were coalesced into
+        self.stream_deltas = 0
+        self.stream_frames = 0
+        # Model calls cut off before they finished, as when the run is cancelled
+        self.cut_off_calls = 0
+        # Open spans by executor id; agents of a fan-out batch overlap
+        self._open = {}
+        self._last_end = self.start
+        # Model calls made before the executor event that opens their span arrives
+        self._pending = []
+        self._pending_retries = 0
+        self._pending_context = [0, 0]
+
+    def on_event(self, event):
+        """Open or close a span from an executor event"""
+        if isinstance(event, ExecutorInvokedEvent):
+            self._open_span(event.executor_id)
+        elif isinstance(event, ExecutorCompletedEvent) and event.executor_id in self._open:
+            self._close_span(self._open.pop(event.executor_id))
+
+    def _open_span(self, executor_id):
+        manager = executor_id == ORCHESTRATOR_EXECUTOR
+        if manager:
+            last = self.spans[-1] if self.spans else None
+            if last is not None and last.kind == "manager_round":
+                # Each reply of a fan-out batch invokes the orchestrator; together they are one round
+                last.end = None
+                self._open[executor_id] = last
+                self._absorb_pending(last)
+                return
+            self.rounds += 1
+            kind, agent = "manager_round", "manager"
+        elif executor_id and executor_id.startswith(AGENT_EXECUTOR_PREFIX):
+            kind, agent = "agent_turn", executor_id[len(AGENT_EXECUTOR_PREFIX):]
+        else:
+            return
+        # Agent turns end when the manager takes over, and the other way round
+        for open_id in list(self._open):
+            if open_id == executor_id or (open_id == ORCHESTRATOR_EXECUTOR) != manager:
+                self._close_span(self._open.pop(open_id))
+
+        span = Span(kind, agent, self.rounds, time.perf_counter(), self._last_end)
+        self._absorb_pending(span)
+        self._open[executor_id] = span
+        self.spans.append(span)
+
+    def _absorb_pending(self, span):
+        # The first superstep reports its invocation only after it has run
+        for call in self._pending:
+            span.start = min(span.start, call[0])
+            self._add_call(span, *call)
+        self._pending.clear()
+        span.retries += self._pending_retries
+        self._pending_retries = 0
+        span.context_before += self._pending_context[0]
+        span.context_after += self._pending_context[1]
+        self._pending_context = [0, 0]
+
+    def _close_span(self, span):
+        span.end = time.perf_counter()
+        self._last_end = span.end
+
+    def _span_for(self, executor_id):
+        """The open span of ``executor_id``, else the most recently opened one"""
+        span = self._open.get(executor_id) if executor_id else None
+        if span is None and self._open:
+            span = next(reversed(self._open.values()))
+        return span
+
+    @staticmethod
+    def _add_call(span, call_start, prompt_tokens, completion_tokens, cached_tokens, failed):
+        if span.first_call_at is None or call_start < span.first_call_at:
+            span.first_call_at = call_start
+        span.calls += 1
+        span.errors += failed
+        span.prompt_tokens += prompt_tokens
+        span.completion_tokens += completion_tokens
+        span.cached_tokens += cached_tokens
+
+    def record_call(self, call_start, prompt_tokens, completion_tokens, cached_tokens=0, failed=False, executor_id=None):
+        """Attribute a finished model call to the span of the executor that made it"""
+        call = (call_start, prompt_tokens, completion_tokens, cached_tokens, failed)
+        span = self._span_for(executor_id)
+        if span is not None:
+            self._add_call(span, *call)
+        else:
+            self._pending.append(call)
+
+    def record_retry(self, executor_id=None):
+        span = self._span_for(executor_id)
+        if span is not None:
+            span.retries += 1
+        else:
+            self._pending_retries += 1
+
+    def record_context(self, before, after, executor_id=None):
+        """Estimated conversation tokens of a model call, before and after compaction"""
+        span = self._span_for(executor_id)
+        if span is not None:
+            span.context_before += before
+            span.context_after += after
+        else:
+            self._pending_context[0] += before
+            self._pending_context[1] += after
+
+    def finish(self, status):
+        for span in self._open.values():
+            self._close_span(span)
+        self._open.clear()
+        self.end = time.perf_counter()
+        self.status = status
+
+    @property
+    def duration(self):
+        return (self.end or time.perf_counter()) - self.start
+
+    @property
+    def prompt_tokens(self):
+        return sum(span.prompt_tokens for span in self.spans)
+
+    @property
+    def completion_tokens(self):
+        return sum(span.completion_tokens for span in self.spans)
+
+    def context_by_round(self):
+        """Estimated conversation tokens sent per round (manager round plus agent turns)"""
+        rounds = {}
+        for span in self.spans:
+            totals = rounds.setdefault(span.round, [0, 0])
+            totals[0] += span.context_before
+            totals[1] += span.context_after
+        return [{"round": index, "before": before, "after": after} for index, (before, after) in sorted(rounds.items())]
+
+    def to_dict(self):
+        return {
+            "task_id": self.task_id,
+            "task": self.task[:200],
+            "models": dict(zip(("researcher", "coder", "manager", "reviewer"), self.model_key)),
+            "status": self.status,
+            "created_at": self.created_at,
+            "duration_s": round(self.duration, 4),
+            "rounds": self.rounds,
+            "round_budget": {"max_rounds": self.max_rounds, "mode": self.budget_mode, "stopped_early": self.stopped_early},
+            "orchestration": {"mode": self.orchestration, "batches": self.parallel_batches, "batched_turns": self.parallel_turns},
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "cached_prompt_tokens": sum(span.cached_tokens for span in self.spans),
+            "retries": sum(span.retries for span in self.spans),
+            "cut_off_calls": self.cut_off_calls,
+            "context_tokens": {
+                "before": sum(span.context_before for span in self.spans),
+                "after": sum(span.context_after for span in self.spans),
+                "by_round": self.context_by_round(),
+            },
+            "spans": [span.to_dict(self.start) for span in self.spans],
+        }
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "total", "count")
+
+    def __init__(self, buckets=DURATION_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.total += value
+        self.count += 1
+
+
+def prometheus_labels(**labels):
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels.items()) + "}"
+
+
+def render_header(lines, name, kind, help_text):
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} {kind}")
+
+
+def render_histogram(lines, name, values, **labels):
+    """Append a histogram in the Prometheus text format; bucket counts are already cumulative"""
+    for bound, count in zip(values.buckets, values.counts):
+        lines.append(f"{name}_bucket{prometheus_labels(**labels, le=bound)} {count}")
+    lines.append(f"{name}_bucket{prometheus_labels(**labels, le='+Inf')} {values.count}")
+    lines.append(f"{name}_sum{prometheus_labels(**labels) if labels else ''} {values.total:.6f}")
+    lines.append(f"{name}_count{prometheus_labels(**labels) if labels else ''} {values.count}")
+
+
+class TaskMetrics:
+    """Ring buffer of recent task traces plus aggregate Prometheus metrics"""
+
+    def __init__(self, max_traces=500):
+        self.max_traces = max_traces
+        self._traces = deque(maxlen=max_traces)
+        self._by_id = {}
+        self._active = {}
+
+        self.tasks = {}
+        self.task_durations = {}
+        self.task_rounds = {}
+        self.stopped_early = {}
+        self.span_durations = {}
+        self.span_queue_times = {}
+        self.tokens = {}
+        self.calls = {}
+        self.errors = {}
+        self.retries = {}
+        self.context_tokens = {}
+        self.parallel_batches = 0
+        self.parallel_turns = 0
+        self.stream_deltas = 0
+        self.stream_frames = 0
+        # Model calls of completed runs, for estimating what cancelled runs saved
+        self.completed_runs = 0
+        self.completed_calls = 0
+        self.wasted_calls = 0
+        self.wasted_tokens = 0
+        self.saved_calls = 0
+
+    def start(self, task, model_key, task_id=None):
+        """Trace a new run, or a resumed run of ``task_id``"""
+        trace = TaskTrace(task, model_key, task_id)
+        self._active[trace.task_id] = trace
+        return trace
+
+    def finish(self, trace, status):
+        """Close the trace, fold it into the aggregates and keep it in the ring buffer"""
+        trace.finish(status)
+        self._active.pop(trace.task_id, None)
+
+        self.tasks[status] = self.tasks.get(status, 0) + 1
+        self.task_durations.setdefault(trace.orchestration, Histogram()).observe(trace.duration)
+        self.parallel_batches += trace.parallel_batches
+        self.parallel_turns += trace.parallel_turns
+        self.stream_deltas += trace.stream_deltas
+        self.stream_frames += trace.stream_frames
+        self.task_rounds.setdefault(trace.budget_mode, Histogram(ROUND_BUCKETS)).observe(trace.rounds)
+        if trace.stopped_early:
+            self.stopped_early[trace.stopped_early] = self.stopped_early.get(trace.stopped_early, 0) + 1
+        calls = sum(span.calls for span in trace.spans)
+        if status == "completed":
+            self.completed_runs += 1
+            self.completed_calls += calls
+        elif status == "cancelled":
+            self.wasted_calls += calls + trace.cut_off_calls
+            self.wasted_tokens += trace.prompt_tokens + trace.completion_tokens
+            self.saved_calls += self.remaining_calls(trace, calls)
+        for span in trace.spans:
+            key = (span.kind, span.agent)
+            self.span_durations.setdefault(key, Histogram()).observe(span.duration)
+            self.span_queue_times.setdefault(key, Histogram()).observe(span.queue_time)
+            self.tokens[key + ("prompt",)] = self.tokens.get(key + ("prompt",), 0) + span.prompt_tokens
+            self.tokens[key + ("completion",)] = self.tokens.get(key + ("completion",), 0) + span.completion_tokens
+            self.tokens[key + ("cached_prompt",)] = self.tokens.get(key + ("cached_prompt",), 0) + span.cached_tokens
+            self.calls[key] = self.calls.get(key, 0) + span.calls
+            self.errors[key] = self.errors.get(key, 0) + span.errors
+            self.retries[key] = self.retries.get(key, 0) + span.retries
+            self.context_tokens[key + ("before",)] = self.context_tokens.get(key + ("before",), 0) + span.context_before
+            self.context_tokens[key + ("after",)] = self.context_tokens.get(key + ("after",), 0) + span.context_after
+
+        if len(self._traces) == self.max_traces:
+            oldest = self._traces[0]
+            # A resumed task's later trace replaces its earlier one
+            if self._by_id.get(oldest.task_id) is oldest:
+                del self._by_id[oldest.task_id]
+        self._traces.append(trace)
+        self._by_id[trace.task_id] = trace
+
+    def remaining_calls(self, trace, calls):
+        """Estimated model calls a cancelled run would still have made, from completed runs or its own pace"""
+        if self.completed_runs:
+            expected = self.completed_calls / self.completed_runs
+        elif trace.rounds and trace.max_rounds:
+            expected = calls / trace.rounds * trace.max_rounds
+        else:
+            expected = calls
+        return max(round(expected - calls), 0)
+
+    def cancellation_stats(self):
+        """Model calls wasted on, and saved by, cancelled runs"""
+        return {
+            "runs_cancelled": self.tasks.get("cancelled", 0),
+            "calls_wasted": self.wasted_calls,
+            "tokens_wasted": self.wasted_tokens,
+            "calls_saved_estimate": self.saved_calls,
+        }
+
+    def get(self, task_id):
+        """A running or recently finished trace, or None"""
+        return self._active.get(task_id) or self._by_id.get(task_id)
+
+    def render_prometheus(self):
+        """Aggregates in the Prometheus text exposition format"""
+        lines = []
+
+        def header(name, kind, help_text):
+            render_header(lines, name, kind, help_text)
+
+        def histogram(name, values, **labels):
+            render_histogram(lines, name, values, **labels)
+
+        header("magentic_tasks_total", "counter", "Finished workflow runs by status")
+        for status, count in sorted(self.tasks.items()):
+            lines.append(f"magentic_tasks_total{prometheus_labels(status=status)} {count}")
+
+        header("magentic_tasks_in_flight", "gauge", "Workflow runs in progress")
+        lines.append(f"magentic_tasks_in_flight {len(self._active)}")
+
+        header("magentic_task_duration_seconds", "histogram", "Wall time of workflow runs, by orchestration mode")
+        for mode, values in sorted(self.task_durations.items()):
+            histogram("magentic_task_duration_seconds", values, orchestration=mode)
+
+        header("magentic_task_rounds", "histogram", "Manager rounds per workflow run, by round budget mode")
+        for mode, values in sorted(self.task_rounds.items()):
+            histogram("magentic_task_rounds", values, mode=mode)
+
+        header("magentic_task_rounds_average", "gauge", "Mean manager rounds per workflow run")
+        runs = sum(values.count for values in self.task_rounds.values())
+        rounds = sum(values.total for values in self.task_rounds.values())
+        lines.append(f"magentic_task_rounds_average {rounds / runs if runs else 0:.3f}")
+
+        header("magentic_tasks_stopped_early_total", "counter", "Runs finished before the manager declared the request satisfied, by reason")
+        for reason, count in sorted(self.stopped_early.items()):
+            lines.append(f"magentic_tasks_stopped_early_total{prometheus_labels(reason=reason)} {count}")
+
+        header("magentic_parallel_batches_total", "counter", "Fan-out batches of agent turns run in one superstep")
+        lines.append(f"magentic_parallel_batches_total {self.parallel_batches}")
+
+        header("magentic_parallel_agent_turns_total", "counter", "Agent turns run as part of a fan-out batch")
+        lines.append(f"magentic_parallel_agent_turns_total {self.parallel_turns}")
+
+        header("magentic_stream_deltas_total", "counter", "Token deltas streamed by agents")
+        lines.append(f"magentic_stream_deltas_total {self.stream_deltas}")
+
+        header("magentic_stream_frames_total", "counter", "Frames the streamed token deltas were coalesced into")
+        lines.append(f"magentic_stream_frames_total {self.stream_frames}")
+
+        header("magentic_span_duration_seconds", "histogram", "Wall time of manager rounds and agent turns")
+        for (kind, agent), values in sorted(self.span_durations.items()):
+            histogram("magentic_span_duration_seconds", values, kind=kind, agent=agent)
+
+        header("magentic_span_queue_seconds", "histogram", "Time from hand-off to the first model call of a span")
+        for (kind, agent), values in sorted(self.span_queue_times.items()):
+            histogram("magentic_span_queue_seconds", values, kind=kind, agent=agent)
+
+        header("magentic_tokens_total", "counter", "Tokens reported by the model; cached_prompt tokens are part of prompt")
+        for (kind, agent, token_type), count in sorted(self.tokens.items()):
+            lines.append(f"magentic_tokens_total{prometheus_labels(kind=kind, agent=agent, type=token_type)} {count}")
+
+        header("magentic_context_tokens_total", "counter", "Estimated conversation tokens sent, before and after context compaction")
+        for (kind, agent, stage), count in sorted(self.context_tokens.items()):
+            lines.append(f"magentic_context_tokens_total{prometheus_labels(kind=kind, agent=agent, stage=stage)} {count}")
+
+        for name, values, help_text in (
+            ("magentic_model_calls_total", self.calls, "Model calls"),
+            ("magentic_model_call_errors_total", self.errors, "Model calls that raised"),
+            ("magentic_model_retries_total", self.retries, "Retries made by the OpenAI SDK"),
+        ):
+            header(name, "counter", help_text)
+            for (kind, agent), count in sorted(values.items()):
+                lines.append(f"{name}{prometheus_labels(kind=kind, agent=agent)} {count}")
+
+        header("magentic_cancelled_model_calls_total", "counter", "Model calls made or cut off by runs cancelled before finishing")
+        lines.append(f"magentic_cancelled_model_calls_total {self.wasted_calls}")
+
+        header("magentic_cancelled_tokens_total", "counter", "Tokens used by runs cancelled before finishing")
+        lines.append(f"magentic_cancelled_tokens_total {self.wasted_tokens}")
+
+        header("magentic_model_calls_saved_total", "counter", "Estimated model calls cancelled runs would still have made")
+        lines.append(f"magentic_model_calls_saved_total {self.saved_calls}")
+
+        header("magentic_trace_buffer_size", "gauge", "Finished task traces kept for /api/traces")
+        lines.append(f"magentic_trace_buffer_size {len(self._traces)}")
+        return "\n".join(lines) + "\n"
+
+
+class UsageMiddleware(ChatMiddleware):
+    """Chat middleware that reports each model call to the current task trace"""
+
+    async def process(self, context, next):
+        trace = current_trace.get()
+        if trace is None:
+            await next(context)
+            return
+
+        call_start = time.perf_counter()
+        executor_id = current_executor.get()
+        try:
+            await next(context)
+        except Exception:
+            trace.record_call(call_start, 0, 0, failed=True, executor_id=executor_id)
+            raise
+        except asyncio.CancelledError:
+            trace.cut_off_calls += 1
+            raise
+
+        if context.is_streaming:
+            context.result = self._observe_stream(trace, call_start, executor_id, context.result)
+        else:
+            usage = getattr(context.result, "usage_details", None)
+            trace.record_call(call_start, *_token_counts(usage), executor_id=executor_id)
+
+    @staticmethod
+    async def _observe_stream(trace, call_start, executor_id, stream):
+        usage = None
+        failed = True
+        try:
+            async for update in stream:
+                for content in update.contents or ():
+                    if isinstance(content, UsageContent):
+                        usage = content.details
+                yield update
+            failed = False
+        except (asyncio.CancelledError, GeneratorExit):
+            trace.cut_off_calls += 1
+            raise
+        finally:
+            trace.record_call(call_start, *_token_counts(usage), failed=failed, executor_id=executor_id)
+
+
+# Usage keys under which the OpenAI clients report prompt tokens served from the provider's cache
+CACHED_TOKEN_KEYS = ("prompt/cached_tokens", "openai.cached_input_tokens")
+
+
+def _token_counts(usage):
+    """(prompt, completion, cached prompt) tokens of a call's usage"""
+    if usage is None:
+        return 0, 0, 0
+    additional = usage.additional_counts or {}
+    cached = next((additional[key] for key in CACHED_TOKEN_KEYS if key in additional), 0)
+    return usage.input_token_count or 0, usage.output_token_count or 0, cached
+
+
+class RetryLogFilter(logging.Filter):
+    """Counts the OpenAI SDK's "Retrying request" log records against the current task trace"""
+
+    def filter(self, record):
+        if isinstance(record.msg, str) and record.msg.startswith("Retrying request"):
+            trace = current_trace.get()
+            if trace is not None:
+                trace.record_retry(current_executor.get())
+        return True
+
+
+def install_retry_counter():
+    """Hook the OpenAI SDK's retry log, which is emitted at INFO level"""
+    sdk_logger = logging.getLogger("openai._base_client")
+    if not any(isinstance(f, RetryLogFilter) for f in sdk_logger.filters):
+        sdk_logger.addFilter(RetryLogFilter())
+    if not sdk_logger.isEnabledFor(logging.INFO):
+        sdk_logger.setLevel(logging.INFO)
@@ -0,0 +1,353 @@
+"""
+Task History Store
+==================
+Durable history of workflow runs in a local SQLite database in WAL mode.
+Each run's metadata, model selection, activity log and final result are
+queued in memory and written in batches by a background flusher, so request
+handlers never wait on disk. Tasks are indexed by time, model and status and
+activity entries by agent type; history queries page with keyset cursors, so
+they stay fast however many rows the database holds. The latest workflow
+checkpoint of each unfinished task is kept alongside, for resuming it.
+"""
+
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+
+logger = logging.getLogger(__name__)
+
+MODEL_ROLES = ("researcher", "coder", "manager", "reviewer")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    id TEXT PRIMARY KEY,
+    created_at REAL NOT NULL,
+    finished_at REAL,
+    status TEXT NOT NULL,
+    task TEXT NOT NULL,
+    researcher_model TEXT,
+    coder_model TEXT,
+    manager_model TEXT,
+    reviewer_model TEXT,
+    result TEXT,
+    error TEXT,
+    duration_s REAL,
+    rounds INTEGER,
+    event_count INTEGER,
+    prompt_tokens INTEGER,
+    completion_tokens INTEGER
+);
+CREATE INDEX IF NOT EXISTS tasks_created ON tasks (created_at, id);
+CREATE INDEX IF NOT EXISTS tasks_status_created ON tasks (status, created_at, id);
+CREATE INDEX IF NOT EXISTS tasks_researcher_created ON tasks (researcher_model, created_at, id);
+CREATE INDEX IF NOT EXISTS tasks_coder_created ON tasks (coder_model, created_at, id);
+CREATE INDEX IF NOT EXISTS tasks_manager_created ON tasks (manager_model, created_at, id);
+CREATE INDEX IF NOT EXISTS tasks_reviewer_created ON tasks (reviewer_model, created_at, id);
+
+CREATE TABLE IF NOT EXISTS activities (
+    task_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    agent TEXT,
+    message TEXT,
+    data TEXT,
+    PRIMARY KEY (task_id, seq)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS activities_agent_created ON activities (agent, created_at);
+CREATE INDEX IF NOT EXISTS activities_agent_task ON activities (agent, task_id);
+
+CREATE TABLE IF NOT EXISTS checkpoints (
+    task_id TEXT PRIMARY KEY,
+    checkpoint_id TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    iteration INTEGER,
+    data BLOB NOT NULL
+);
+"""
+
+TASK_COLUMNS = (
+    "id", "created_at", "finished_at", "status", "task",
+    "researcher_model", "coder_model", "manager_model", "reviewer_model",
+    "result", "error", "duration_s", "rounds", "event_count", "prompt_tokens", "completion_tokens",
+)
+
+# Columns returned by history listings; results and errors are fetched per task
+SUMMARY_COLUMNS = tuple(c for c in TASK_COLUMNS if c not in ("result", "error"))
+
+# A finish row only fills in what the start row left empty; created_at and task are kept
+UPSERT_TASK = (
+    f"INSERT INTO tasks ({', '.join(TASK_COLUMNS)}) VALUES ({', '.join('?' * len(TASK_COLUMNS))}) "
+    "ON CONFLICT(id) DO UPDATE SET "
+    + ", ".join(f"{c} = COALESCE(excluded.{c}, {c})" for c in TASK_COLUMNS if c not in ("id", "created_at", "task"))
+)
+
+INSERT_ACTIVITY = "INSERT OR REPLACE INTO activities (task_id, seq, created_at, agent, message, data) VALUES (?, ?, ?, ?, ?, ?)"
+
+UPSERT_CHECKPOINT = "INSERT OR REPLACE INTO checkpoints (task_id, checkpoint_id, created_at, iteration, data) VALUES (?, ?, ?, ?, ?)"
+
+DELETE_CHECKPOINT = "DELETE FROM checkpoints WHERE task_id = ?"
+
+# Runs still marked running when the store opens were cut off by a restart
+MARK_INTERRUPTED = "UPDATE tasks SET status = 'interrupted' WHERE status = 'running'"
+
+
+def encode_cursor(row):
+    return f"{row['created_at']!r}:{row['id']}"
+
+
+def decode_cursor(cursor):
+    """(created_at, id) from a cursor string; raises ValueError if malformed"""
+    created_at, _, task_id = cursor.partition(":")
+    if not task_id:
+        raise ValueError(f"Invalid cursor '{cursor}'")
+    return float(created_at), task_id
+
+
+class TaskStore:
+    """SQLite-backed task history with batched, off-request-path writes.
+
+    ``flush_interval`` (seconds) bounds how long a write waits in memory;
+    ``batch_size`` pending rows trigger an early flush. Beyond ``max_pending``
+    rows (a stuck disk) new writes are dropped and counted.
+    """
+
+    def __init__(self, path, flush_interval=0.2, batch_size=500, max_pending=50000):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self._pending = []
+        # Batch being written right now; reads check it along with _pending
+        self._writing = []
+        self._wakeup = None
+        self._flusher = None
+        self._stopping = False
+        self._conn = None
+
+        self.rows_written = 0
+        self.batches = 0
+        self.rows_dropped = 0
+        self.write_failures = 0
+        self.write_seconds = 0.0
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    async def start(self):
+        """Create the schema and start the background flusher"""
+        if self._flusher is not None:
+            return
+        self._conn = await asyncio.to_thread(self._connect)
+        await asyncio.to_thread(self._conn.executescript, SCHEMA)
+        await asyncio.to_thread(self._write, [(MARK_INTERRUPTED, ())])
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._flusher = asyncio.create_task(self._flush_loop())
+        logger.info(f"Task history store at {self.path}")
+
+    async def stop(self):
+        """Flush what is pending and close the database"""
+        if self._flusher is None:
+            return
+        # Let the flusher finish its current write rather than cancelling it mid-transaction
+        self._stopping = True
+        self._wakeup.set()
+        await self._flusher
+        self._flusher = None
+        await asyncio.to_thread(self._conn.close)
+        self._conn = None
+
+    def _enqueue(self, statement, params):
+        if len(self._pending) >= self.max_pending:
+            self.rows_dropped += 1
+            return
+        self._pending.append((statement, params))
+        if self._wakeup is not None and len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+
+    def task_started(self, task_id, task, model_key, created_at=None):
+        self._enqueue(UPSERT_TASK, (
+            task_id, created_at or time.time(), None, "running", task, *model_key,
+            None, None, None, None, None, None, None,
+        ))
+
+    def task_finished(self, task_id, status, result=None, error=None, duration=None,
+                      rounds=None, event_count=None, prompt_tokens=None, completion_tokens=None):
+        # created_at and task are only stored if the start row was dropped
+        self._enqueue(UPSERT_TASK, (
+            task_id, time.time(), time.time(), status, "", None, None, None, None,
+            result, error, duration, rounds, event_count, prompt_tokens, completion_tokens,
+        ))
+
+    def add_activity(self, task_id, seq, entry):
+        extra = {k: v for k, v in entry.items() if k not in ("type", "message")}
+        self._enqueue(INSERT_ACTIVITY, (
+            task_id, seq, time.time(), entry.get("type"), entry.get("message"),
+            json.dumps(extra, ensure_ascii=False) if extra else None,
+        ))
+
+    def save_checkpoint(self, task_id, checkpoint_id, iteration, data):
+        """Replace the task's checkpoint with ``data``: compressed bytes, or a
+        callable returning them, which the flusher calls off the event loop"""
+        self._enqueue(UPSERT_CHECKPOINT, (task_id, checkpoint_id, time.time(), iteration, data))
+
+    def delete_checkpoint(self, task_id):
+        self._enqueue(DELETE_CHECKPOINT, (task_id,))
+
+    async def get_checkpoint(self, task_id):
+        """The task's latest checkpoint row, including one not yet flushed, or None"""
+        for statement, params in reversed(self._writing + self._pending):
+            if params[0] != task_id:
+                continue
+            if statement is UPSERT_CHECKPOINT:
+                row = dict(zip(("task_id", "checkpoint_id", "created_at", "iteration", "data"), params))
+                if callable(row["data"]):
+                    row["data"] = await asyncio.to_thread(row["data"])
+                return row
+            if statement is DELETE_CHECKPOINT:
+                return None
+        rows = await asyncio.to_thread(
+            self._query, "SELECT task_id, checkpoint_id, created_at, iteration, data FROM checkpoints WHERE task_id = ?", (task_id,)
+        )
+        return rows[0] if rows else None
+
+    async def next_activity_seq(self, task_id):
+        """Sequence number for the next activity entry of a resumed task"""
+        pending = [params[1] for statement, params in self._writing + self._pending if statement is INSERT_ACTIVITY and params[0] == task_id]
+        rows = await asyncio.to_thread(self._query, "SELECT MAX(seq) AS seq FROM activities WHERE task_id = ?", (task_id,))
+        stored = rows[0]["seq"] if rows and rows[0]["seq"] is not None else -1
+        return max(pending + [stored]) + 1
+
+    async def _flush_loop(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self._flush()
+        await self._flush()
+
+    async def _flush(self):
+        if not self._pending or self._conn is None:
+            return
+        batch, self._pending = self._pending, []
+        self._writing = batch
+        start = time.perf_counter()
+        try:
+            await asyncio.to_thread(self._write, batch)
+            self.rows_written += len(batch)
+            self.batches += 1
+        except Exception:
+            self.write_failures += 1
+            logger.exception(f"Task history write of {len(batch)} rows failed")
+        finally:
+            self._writing = []
+        self.write_seconds += time.perf_counter() - start
+
+    def _write(self, batch):
+        # Checkpoints are encoded here, on the writer thread, rather than in the
+        # round loop; one replaced later in the same batch is not encoded at all
+        latest = {params[0]: i for i, (statement, params) in enumerate(batch) if statement is UPSERT_CHECKPOINT}
+        rows = []
+        for i, (statement, params) in enumerate(batch):
+            if statement is UPSERT_CHECKPOINT:
+                if latest[params[0]] != i:
+                    continue
+                if callable(params[-1]):
+                    params = (*params[:-1], params[-1]())
+            rows.append((statement, params))
+        with self._conn:
+            for statement, params in rows:
+                self._conn.execute(statement, params)
+
+    def _query(self, sql, params):
+        # Each read gets its own connection; WAL lets it run beside the writer
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            return [dict(row) for row in conn.execute(sql, params)]
+        finally:
+            conn.close()
+
+    async def list_tasks(self, limit=50, cursor=None, model=None, role=None, agent=None, status=None, since=None, until=None):
+        """Newest-first page of task summaries and the cursor of the next page.
+
+        ``model`` matches any role's model, or only ``role``'s when given.
+        """
+        where, params = [], []
+        if cursor:
+            where.append("(created_at, id) < (?, ?)")
+            params += list(decode_cursor(cursor))
+        if model and role:
+            if role not in MODEL_ROLES:
+                raise ValueError(f"Unknown role '{role}' (expected one of {', '.join(MODEL_ROLES)})")
+            where.append(f"{role}_model = ?")
+            params.append(model)
+        elif model:
+            where.append("(" + " OR ".join(f"{r}_model = ?" for r in MODEL_ROLES) + ")")
+            params += [model] * len(MODEL_ROLES)
+        if agent:
+            where.append("EXISTS (SELECT 1 FROM activities a WHERE a.agent = ? AND a.task_id = tasks.id)")
+            params.append(agent)
+        if status:
+            where.append("status = ?")
+            params.append(status)
+        if since is not None:
+            where.append("created_at >= ?")
+            params.append(since)
+        if until is not None:
+            where.append("created_at < ?")
+            params.append(until)
+
+        sql = f"SELECT {', '.join(SUMMARY_COLUMNS)} FROM tasks"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY created_at DESC, id DESC LIMIT ?"
+        rows = await asyncio.to_thread(self._query, sql, params + [limit + 1])
+
+        next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+        return {"tasks": [self._task_dict(row) for row in rows[:limit]], "next_cursor": next_cursor}
+
+    async def get_task(self, task_id):
+        rows = await asyncio.to_thread(self._query, f"SELECT {', '.join(TASK_COLUMNS)} FROM tasks WHERE id = ?", (task_id,))
+        return self._task_dict(rows[0]) if rows else None
+
+    async def get_activity(self, task_id, after=-1, limit=500):
+        """Activity entries of a task with ``seq`` greater than ``after``"""
+        rows = await asyncio.to_thread(
+            self._query,
+            "SELECT seq, created_at, agent, message, data FROM activities WHERE task_id = ? AND seq > ? ORDER BY seq LIMIT ?",
+            (task_id, after, limit),
+        )
+        entries = []
+        for row in rows:
+            entry = {"seq": row["seq"], "created_at": row["created_at"], "type": row["agent"], "message": row["message"]}
+            if row["data"]:
+                entry.update(json.loads(row["data"]))
+            entries.append(entry)
+        return {"activity": entries, "next_after": entries[-1]["seq"] if len(entries) == limit else None}
+
+    @staticmethod
+    def _task_dict(row):
+        task = {k: v for k, v in row.items() if not k.endswith("_model")}
+        task["models"] = {role: row[f"{role}_model"] for role in MODEL_ROLES}
+        return task
+
+    def stats(self):
+        """Write throughput and backlog for the health endpoint"""
+        return {
+            "path": self.path,
+            "pending": len(self._pending),
+            "rows_written": self.rows_written,
+            "batches": self.batches,
+            "rows_dropped": self.rows_dropped,
+            "write_failures": self.write_failures,
+            "write_seconds": round(self.write_seconds, 3),
+        }
@@ -0,0 +1,58 @@
+"""
+Token Streaming
+===============
+Coalesces the token deltas agents stream into frames for the UI. A
+researcher turn can stream for 20+ seconds, one delta per token. Passing
+each one through the single-flight run and out as its own SSE frame costs
+a list append, a wake-up, a JSON encoding and a write per token and
+subscriber. ``DeltaCoalescer`` buffers deltas instead. It releases them as
+one payload per agent and round once the oldest buffered delta is
+``interval`` seconds old, or as soon as any other workflow event needs to
+go out after them.
+"""
+
+import time
+
+
+class DeltaCoalescer:
+    """Buffers agent token deltas into frames of about ``interval`` seconds"""
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        # (agent, round) -> text chunks, in the order agents started streaming
+        self._chunks = {}
+        self._opened_at = None
+        self.deltas = 0
+        self.frames = 0
+
+    def add(self, agent, round_index, text):
+        if not text:
+            return
+        if self._opened_at is None:
+            self._opened_at = time.monotonic()
+        self._chunks.setdefault((agent, round_index), []).append(text)
+        self.deltas += 1
+
+    def time_left(self):
+        """Seconds until the buffered frame is due, or None when nothing is buffered"""
+        if self._opened_at is None:
+            return None
+        return max(self._opened_at + self.interval - time.monotonic(), 0)
+
+    @property
+    def due(self):
+        left = self.time_left()
+        return left is not None and left <= 0
+
+    def flush(self):
+        """Buffered deltas as one {"agent", "round", "text"} payload per agent and round"""
+        if self._opened_at is None:
+            return []
+        frames = [
+            {"agent": agent, "round": round_index, "text": "".join(chunks)}
+            for (agent, round_index), chunks in self._chunks.items()
+        ]
+        self._chunks.clear()
+        self._opened_at = None
+        self.frames += len(frames)
+        return frames
@@ -0,0 +1,133 @@
+"""
+Magentic Workflow Pool
+======================
+Keeps ready-to-run Magentic workflows keyed by the model selection so the
+backend does not rebuild agents, chat clients and the workflow graph on every
+request. Workflows are checked out for exclusive use by a single run and
+checked back in (after their per-run state is cleared) when the run finishes.
+"""
+
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+def reset_workflow_state(workflow):
+    """Clear the per-run state a Magentic workflow keeps on its executors.
+
+    The runner context is reset by ``run_stream`` itself, but the orchestrator
+    and the agent executors hold conversation history and a terminated flag
+    that would otherwise leak into (or block) the next run.
+    """
+    for executor in workflow.get_executors_list():
+        # Agent executors: drop the participant's chat history
+        if hasattr(executor, "_chat_history") and callable(getattr(executor, "reset", None)):
+            executor.reset()
+
+        # Orchestrator: forget the previous task, ledger and terminal state
+        if hasattr(executor, "_terminated"):
+            executor._terminated = False
+            executor._context = None
+            executor._task_ledger = None
+            manager = getattr(executor, "_manager", None)
+            if manager is not None and hasattr(manager, "task_ledger"):
+                manager.task_ledger = None
+
+
+class WorkflowPool:
+    """Pool of idle workflows keyed by model selection, with LRU eviction.
+
+    ``factory`` is called with the key's items as positional arguments to
+    build a new workflow on a miss. Idle workflows are limited per key and in
+    total; when the total limit is hit the least recently used key gives up
+    its oldest workflow.
+    """
+
+    def __init__(self, factory, max_idle_per_key=2, max_idle_total=16):
+        self._factory = factory
+        self.max_idle_per_key = max_idle_per_key
+        self.max_idle_total = max_idle_total
+
+        # key -> list of idle workflows; order of keys tracks recency of use
+        self._idle = OrderedDict()
+        self._idle_count = 0
+        self._in_use = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.discards = 0
+
+    def checkout(self, key):
+        """Take an idle workflow for ``key`` or build a new one."""
+        idle = self._idle.get(key)
+        if idle:
+            workflow = idle.pop()
+            self._idle_count -= 1
+            if not idle:
+                del self._idle[key]
+            else:
+                self._idle.move_to_end(key)
+            self.hits += 1
+        else:
+            workflow = self._factory(*key)
+            self.misses += 1
+
+        self._in_use += 1
+        return workflow
+
+    def checkin(self, key, workflow, reusable=True):
+        """Return a workflow to the pool once its run has finished.
+
+        Workflows from failed or interrupted runs should be passed with
+        ``reusable=False``; they are dropped instead of being reset.
+        """
+        self._in_use -= 1
+
+        if not reusable:
+            self.discards += 1
+            return
+
+        try:
+            reset_workflow_state(workflow)
+        except Exception:
+            logger.exception("Failed to reset workflow state, discarding workflow")
+            self.discards += 1
+            return
+
+        if len(self._idle.get(key, ())) >= self.max_idle_per_key:
+            self.discards += 1
+            return
+
+        self._idle.setdefault(key, []).append(workflow)
+        self._idle.move_to_end(key)
+        self._idle_count += 1
+
+        while self._idle_count > self.max_idle_total:
+            self._evict_lru()
+
+    def _evict_lru(self):
+        """Drop the oldest idle workflow of the least recently used key."""
+        lru_key, lru_idle = next(iter(self._idle.items()))
+        lru_idle.pop(0)
+        self._idle_count -= 1
+        self.evictions += 1
+        if not lru_idle:
+            del self._idle[lru_key]
+
+    def stats(self):
+        """Pool counters for the health endpoint."""
+        lookups = self.hits + self.misses
+        return {
+            "idle": self._idle_count,
+            "in_use": self._in_use,
+            "keys": len(self._idle),
+            "max_idle_per_key": self.max_idle_per_key,
+            "max_idle_total": self.max_idle_total,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "discards": self.discards,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+        }